@@ -0,0 +1,451 @@
+"""
+Compiles experiments into a compact program for the QCGPU backends.
+
+An experiment is compiled once into arrays of opcodes, qubit indices and
+parameters. Running the program then only has to index a dispatch table,
+rather than compare the name of every instruction. A compiled program
+doesn't hold any state, so it can be run any number of times, and bound to
+new parameters when the same circuit is submitted again.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+
+import numpy as np
+
+from .fusion import (DiagonalRun, FusedGate, GlobalPhase, diagonal_plan, fusion_plan,
+                     global_phase_plan)
+
+logger = logging.getLogger(__name__)
+
+# Names of the instructions with an opcode, the opcode being the list index
+OPCODES = ['u3', 'u2', 'u1', 'cx', 'h', 'x', 'y', 'z', 's', 't',
+           'cz', 'cu1', 'swap', 'ccx', 'rz', 'rx', 'ry', 'unitary', 'diagonal']
+
+OPCODE_IDS = {name: opcode for opcode, name in enumerate(OPCODES)}
+
+UNITARY = OPCODE_IDS['unitary']
+DIAGONAL = OPCODE_IDS['diagonal']
+
+# Instructions which are dropped when compiling. Conditions are evaluated
+# by the trajectories, see ``trajectories``.
+IGNORED_INSTRUCTIONS = ['id', 'barrier', 'bfunc']
+
+MAX_QUBITS = 3
+MAX_PARAMS = 3
+
+# Calls the state method of every opcode, indexed by opcode
+DISPATCH_TABLE = [
+    lambda sim, qubits, params: sim.u(qubits[0], params[0], params[1], params[2]),
+    lambda sim, qubits, params: sim.u2(qubits[0], params[0], params[1]),
+    lambda sim, qubits, params: sim.u1(qubits[0], params[0]),
+    lambda sim, qubits, params: sim.cx(qubits[0], qubits[1]),
+    lambda sim, qubits, params: sim.h(qubits[0]),
+    lambda sim, qubits, params: sim.x(qubits[0]),
+    lambda sim, qubits, params: sim.y(qubits[0]),
+    lambda sim, qubits, params: sim.z(qubits[0]),
+    lambda sim, qubits, params: sim.s(qubits[0]),
+    lambda sim, qubits, params: sim.t(qubits[0]),
+    lambda sim, qubits, params: sim.cz(qubits[0], qubits[1]),
+    lambda sim, qubits, params: sim.cu1(qubits[0], qubits[1], params[0]),
+    lambda sim, qubits, params: sim.swap(qubits[0], qubits[1]),
+    lambda sim, qubits, params: sim.ccx(qubits[0], qubits[1], qubits[2]),
+    lambda sim, qubits, params: sim.rz(qubits[0], params[0]),
+    lambda sim, qubits, params: sim.rx(qubits[0], params[0]),
+    lambda sim, qubits, params: sim.ry(qubits[0], params[0]),
+    # A unitary gets all of its qubits, and its matrix as the parameters
+    lambda sim, qubits, params: sim.unitary(qubits, params),
+    # A diagonal gets all of its qubits, and its entries as the parameters
+    lambda sim, qubits, params: sim.diagonal(qubits, params),
+]
+
+
+def _complex_array(value, ndim):
+    """A complex array, whose entries may be serialized as ``[real, imag]`` pairs."""
+    array = np.array(value)
+    if not np.iscomplexobj(array) and array.ndim == ndim + 1:
+        array = array[..., 0] + 1j * array[..., 1]
+    return array.astype(np.complex128)
+
+
+def unitary_matrix(params):
+    """The matrix of a ``unitary`` instruction.
+
+    Args:
+        params (list): the parameters of the instruction, the matrix, where
+            complex entries may be serialized as ``[real, imag]`` pairs.
+
+    Returns:
+        ndarray: the complex matrix.
+    """
+    return _complex_array(params[0], 2)
+
+
+def diagonal_entries(params):
+    """The entries of a ``diagonal`` instruction.
+
+    Args:
+        params (list): the parameters of the instruction, the entries of
+            the diagonal, which may be serialized as ``[real, imag]`` pairs.
+
+    Returns:
+        ndarray: the complex entries.
+    """
+    return _complex_array(params, 1)
+
+
+class CompiledCircuit:
+    """An experiment compiled into arrays.
+
+    Attributes:
+        opcodes (ndarray): ``uint8`` opcode of every gate, see ``OPCODES``.
+        qubits (ndarray): ``int32`` array of shape ``(gates, MAX_QUBITS)``
+            with the qubits of every gate, padded with -1.
+        params (ndarray): ``float64`` array of shape ``(gates, MAX_PARAMS)``
+            with the parameters of every gate, padded with 0.
+        measurements (list): ``(qubit, clbit)`` pairs of the measurements.
+        ignored (set): names of the unsupported instructions which were dropped.
+        can_sample (bool): whether the measurements can all be sampled at the end.
+        param_sources (list): ``(gate, source)`` pairs for the gates with
+            parameters, where ``source`` is the index of the instruction the
+            parameters are taken from, or a ``FusedGate``, ``DiagonalRun``
+            or ``GlobalPhase``.
+        unitaries (dict): the ``(qubits, matrix)`` of every ``unitary`` gate,
+            by gate index, as they don't fit in ``qubits`` and ``params``.
+        diagonals (dict): the ``(qubits, entries)`` of every ``diagonal``
+            gate, by gate index.
+    """
+
+    def __init__(self, opcodes, qubits, params, measurements, ignored=None,
+                 can_sample=True, param_sources=None, unitaries=None, diagonals=None):
+        self.opcodes = opcodes
+        self.qubits = qubits
+        self.params = params
+        self.measurements = measurements
+        self.ignored = ignored or set()
+        self.can_sample = can_sample
+        self.param_sources = param_sources or []
+        self.unitaries = unitaries or {}
+        self.diagonals = diagonals or {}
+
+        # Plain lists are much faster to iterate over than arrays
+        self._steps = list(zip(opcodes.tolist(), qubits.tolist(), params.tolist()))
+        for gate, (gate_qubits, matrix) in self.unitaries.items():
+            self._steps[gate] = (UNITARY, list(gate_qubits), matrix)
+        for gate, (gate_qubits, entries) in self.diagonals.items():
+            self._steps[gate] = (DIAGONAL, list(gate_qubits), entries)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def bind(self, instructions):
+        """Bind the parameters of other instructions with the same structure.
+
+        Args:
+            instructions (list): instructions as dictionaries, with the same
+                structure as the ones the program was compiled from.
+
+        Returns:
+            CompiledCircuit: a program sharing everything but the parameters
+                with this one.
+        """
+        params = self.params.copy()
+        unitaries = dict(self.unitaries)
+        diagonals = dict(self.diagonals)
+        for gate, source in self.param_sources:
+            if isinstance(source, (DiagonalRun, GlobalPhase)):
+                diagonals[gate] = (source.qubits, source.phases(instructions))
+                continue
+            if isinstance(source, FusedGate):
+                values = source.params(instructions)
+            elif gate in unitaries:
+                unitaries[gate] = (unitaries[gate][0],
+                                   unitary_matrix(instructions[source]['params']))
+                continue
+            elif gate in diagonals:
+                diagonals[gate] = (diagonals[gate][0],
+                                   diagonal_entries(instructions[source]['params']))
+                continue
+            else:
+                values = instructions[source].get('params', [])
+            params[gate, :len(values)] = [float(value) for value in values]
+
+        return CompiledCircuit(self.opcodes, self.qubits, params, self.measurements,
+                               self.ignored, self.can_sample, self.param_sources,
+                               unitaries, diagonals)
+
+    def steps(self):
+        """The gates of the program, as run.
+
+        Returns:
+            list: ``(opcode, qubits, params)`` of every gate, where the qubits
+                are padded with -1, except for ``unitary`` and ``diagonal``
+                gates, which have all their qubits, and their matrix or
+                entries as the parameters.
+        """
+        return self._steps
+
+    def run(self, sim):
+        """Apply every gate of the program.
+
+        Args:
+            sim (qcgpu.State): the state to apply the gates to.
+        """
+        dispatch = DISPATCH_TABLE
+        for opcode, qubits, params in self._steps:
+            dispatch[opcode](sim, qubits, params)
+
+
+def structure_key(instructions, fusion=False):
+    """A hashable key describing the structure of some instructions.
+
+    Instructions with the same key only differ in their parameters, so they
+    can share a compiled program.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+        fusion (bool): whether the program is fused.
+
+    Returns:
+        tuple: the key.
+    """
+    return (fusion,) + tuple((instruction['name'],
+                              tuple(instruction.get('qubits', ())),
+                              tuple(instruction.get('memory', ())),
+                              _condition_key(instruction))
+                             for instruction in instructions)
+
+
+def _condition_key(instruction):
+    """The condition of an instruction, which decides ``can_sample``, or ``None``.
+
+    The condition is either the register bit set by a ``bfunc``, or a
+    dictionary of the mask and value of the register.
+    """
+    conditional = instruction.get('conditional')
+    if conditional is None or isinstance(conditional, int):
+        return conditional
+    return (conditional.get('type', 'equals'), conditional.get('mask'),
+            conditional.get('val'))
+
+
+def can_sample(instructions):
+    """Determine if sampling can be used for some instructions.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+
+    Returns:
+        bool: whether all measurements can be sampled at the end, which
+            isn't the case after a reset or with conditional operations.
+    """
+    measured = set()
+    for instruction in instructions:
+        name = instruction['name']
+        qubits = instruction.get('qubits', [])
+
+        if name in ['reset', 'bfunc'] or 'conditional' in instruction:
+            return False
+
+        if any(qubit in measured for qubit in qubits):
+            if name not in ['measure', 'barrier', 'id', 'u0']:
+                return False
+        elif name == 'measure':
+            measured.update(qubits)
+
+    return True
+
+
+def parameter_slots(instructions):
+    """Find where the parameters of some instructions are.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+
+    Returns:
+        list: ``(index, count)`` pairs, for every instruction with ``count``
+            parameters, in order.
+    """
+    return [(index, len(instruction['params']))
+            for index, instruction in enumerate(instructions)
+            if instruction.get('params')]
+
+
+def assign_parameters(instructions, slots, values):
+    """Replace the parameters of some instructions.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+        slots (list): the ``parameter_slots`` of the instructions.
+        values (list): the new parameters, flattened in instruction order.
+
+    Returns:
+        list: instructions with the new parameters. The instructions
+            without parameters are shared with ``instructions``.
+    """
+    bound = list(instructions)
+    position = 0
+    for index, count in slots:
+        bound[index] = dict(bound[index], params=values[position:position + count])
+        position += count
+    return bound
+
+
+def compile_instructions(instructions, fusion=False, global_phase=False):
+    """Compile a list of instructions.
+
+    Args:
+        instructions (list): instructions as dictionaries, with ``name``,
+            ``qubits`` and optionally ``params`` and ``memory`` keys.
+        fusion (bool): whether to fuse single qubit gates, and collect runs
+            of diagonal gates, see ``fusion``.
+        global_phase (bool): whether fused programs apply the global phase
+            the fused gates leave out, which only matters to statevectors.
+
+    Returns:
+        CompiledCircuit: the compiled program.
+    """
+    if fusion:
+        plan = diagonal_plan(instructions, fusion_plan(instructions))
+        if global_phase:
+            plan = global_phase_plan(plan)
+    else:
+        plan = range(len(instructions))
+
+    size = len(plan)
+    opcodes = np.empty(size, dtype=np.uint8)
+    qubits = np.full((size, MAX_QUBITS), -1, dtype=np.int32)
+    params = np.zeros((size, MAX_PARAMS), dtype=np.float64)
+    measurements = []
+    ignored = set()
+    param_sources = []
+    unitaries = {}
+    diagonals = {}
+
+    gates = 0
+    for entry in plan:
+        if isinstance(entry, FusedGate):
+            opcodes[gates] = OPCODE_IDS[entry.name]
+            qubits[gates, 0] = entry.qubit
+            gate_params = entry.params(instructions)
+            params[gates, :len(gate_params)] = gate_params
+            param_sources.append((gates, entry))
+            gates += 1
+            continue
+
+        if isinstance(entry, (DiagonalRun, GlobalPhase)):
+            opcodes[gates] = DIAGONAL
+            qubits[gates, :min(len(entry.qubits), MAX_QUBITS)] = entry.qubits[:MAX_QUBITS]
+            diagonals[gates] = (entry.qubits, entry.phases(instructions))
+            param_sources.append((gates, entry))
+            gates += 1
+            continue
+
+        instruction = instructions[entry]
+        name = instruction['name']
+
+        if name == 'measure':
+            measurements.append((instruction['qubits'][0], instruction['memory'][0]))
+            continue
+
+        opcode = OPCODE_IDS.get(name)
+        if opcode is None:
+            if name not in IGNORED_INSTRUCTIONS:
+                logger.warning('Unsupported instruction "%s" is ignored.', name)
+                ignored.add(name)
+            continue
+
+        opcodes[gates] = opcode
+        gate_qubits = instruction['qubits']
+        qubits[gates, :min(len(gate_qubits), MAX_QUBITS)] = gate_qubits[:MAX_QUBITS]
+        gate_params = instruction.get('params', [])
+        if opcode == UNITARY:
+            unitaries[gates] = (list(gate_qubits), unitary_matrix(gate_params))
+            param_sources.append((gates, entry))
+        elif opcode == DIAGONAL:
+            diagonals[gates] = (list(gate_qubits), diagonal_entries(gate_params))
+            param_sources.append((gates, entry))
+        elif gate_params:
+            params[gates, :len(gate_params)] = [float(param) for param in gate_params]
+            param_sources.append((gates, entry))
+        gates += 1
+
+    return CompiledCircuit(opcodes[:gates].copy(), qubits[:gates].copy(),
+                           params[:gates].copy(), measurements, ignored,
+                           can_sample(instructions), param_sources, unitaries, diagonals)
+
+
+class CompiledCircuitCache:
+    """A least recently used cache of compiled programs.
+
+    Programs are keyed by the structure of the instructions they were
+    compiled from, and the parameters are bound when they are looked up.
+    The cache can be used from several threads at once.
+
+    Attributes:
+        max_size (int): the maximum number of programs kept.
+        global_phase (bool): whether fused programs keep the global phase,
+            see ``compile_instructions``.
+        hits (int): number of lookups which found a program.
+        misses (int): number of lookups which compiled a new program.
+    """
+
+    def __init__(self, max_size=128, global_phase=False):
+        self.max_size = max_size
+        self.global_phase = global_phase
+        self.hits = 0
+        self.misses = 0
+        self._programs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._programs)
+
+    def get(self, instructions, fusion=False):
+        """Get the program of some instructions, compiling it if needed.
+
+        Args:
+            instructions (list): instructions as dictionaries.
+            fusion (bool): whether to fuse single qubit gates.
+
+        Returns:
+            tuple: the ``CompiledCircuit`` bound to the parameters of
+                ``instructions``, and whether it was found in the cache.
+        """
+        key = structure_key(instructions, fusion)
+
+        with self._lock:
+            program = self._programs.get(key)
+            if program is not None:
+                self._programs.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if program is not None:
+            return program.bind(instructions), True
+
+        program = compile_instructions(instructions, fusion, self.global_phase)
+
+        with self._lock:
+            self._programs[key] = program
+            while len(self._programs) > self.max_size:
+                self._programs.popitem(last=False)
+
+        return program, False
+
+    def info(self):
+        """Statistics of the cache.
+
+        Returns:
+            dict: the ``hits``, ``misses``, ``size`` and ``max_size`` of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._programs), 'max_size': self.max_size}
+
+    def clear(self):
+        """Remove every program from the cache."""
+        with self._lock:
+            self._programs.clear()
@@ -0,0 +1,335 @@
+"""
+Setup of the OpenCL device used by the QCGPU backends.
+
+qcgpu keeps a single OpenCL context, command queue and kernel program per
+process. Creating them, and building the kernels, is the slowest part of
+the first job, so it is done once here rather than on every ``run``.
+
+The module also has the kernels the backends run on qcgpu states
+themselves: the reduction of the probabilities onto measured qubits, and
+the collapse of a state after a measurement, the product with a diagonal,
+the expectation values of Pauli strings, and the state class with the
+gates ``qcgpu.State`` lacks.
+"""
+
+import cmath
+import threading
+
+import numpy as np
+
+try:
+    import qcgpu
+    import pyopencl
+    import pyopencl.array
+    _State = qcgpu.State
+except ImportError:
+    qcgpu = pyopencl = None
+    _State = object
+
+from .fusion import gate_matrix, u3_matrix
+from .numpy_state import NumpyState
+from .simulatorerror import QCGPUSimulatorError
+
+_lock = threading.Lock()
+_context_ready = False
+
+# Built programs, by context and amplitude type
+_programs = {}
+
+# Every outcome is summed over at most this many blocks, in parallel
+MARGINAL_BLOCKS = 256
+
+# Every Pauli string is summed over at most this many blocks, in parallel
+PAULI_BLOCKS = 1024
+
+_KERNEL_SOURCE = """
+{pragma}
+__kernel void marginal(__global const {real}2 *amplitudes,
+                       __global {real} *partial,
+                       __global const uint *measured, uint num_measured,
+                       __global const uint *unmeasured, uint num_unmeasured,
+                       ulong block_size)
+{{
+    uint outcome = get_global_id(0);
+    ulong block = get_global_id(1);
+
+    ulong base = 0;
+    for (uint k = 0; k < num_measured; k++)
+        base |= (ulong)((outcome >> k) & 1) << measured[k];
+
+    {real} total = 0;
+    ulong stop = (block + 1) * block_size;
+    for (ulong rest = block * block_size; rest < stop; rest++) {{
+        ulong index = base;
+        for (uint k = 0; k < num_unmeasured; k++)
+            index |= ((rest >> k) & 1) << unmeasured[k];
+        {real}2 amplitude = amplitudes[index];
+        total += amplitude.x * amplitude.x + amplitude.y * amplitude.y;
+    }}
+    partial[block * get_global_size(0) + outcome] = total;
+}}
+
+__kernel void pauli(__global const {real}2 *amplitudes, __global {real}2 *partial,
+                    ulong flip, __global const ulong *signs, ulong block_size)
+{{
+    uint term = get_global_id(0);
+    ulong block = get_global_id(1);
+    ulong sign = signs[term];
+
+    {real}2 total = ({real}2)(0, 0);
+    ulong stop = (block + 1) * block_size;
+    for (ulong index = block * block_size; index < stop; index++) {{
+        {real}2 amplitude = amplitudes[index];
+        {real}2 flipped = amplitudes[index ^ flip];
+        // conj(flipped) * amplitude
+        {real}2 product = ({real}2)(flipped.x * amplitude.x + flipped.y * amplitude.y,
+                                    flipped.x * amplitude.y - flipped.y * amplitude.x);
+        if (popcount(index & sign) & 1)
+            total -= product;
+        else
+            total += product;
+    }}
+    partial[block * get_global_size(0) + term] = total;
+}}
+
+__kernel void diagonal(__global {real}2 *amplitudes, __global const {real}2 *entries,
+                       __global const uint *qubits, uint num_qubits)
+{{
+    ulong index = get_global_id(0);
+    uint entry = 0;
+    for (uint k = 0; k < num_qubits; k++)
+        entry |= ((index >> qubits[k]) & 1) << k;
+
+    {real}2 amplitude = amplitudes[index];
+    {real}2 phase = entries[entry];
+    amplitudes[index] = ({real}2)(amplitude.x * phase.x - amplitude.y * phase.y,
+                                  amplitude.x * phase.y + amplitude.y * phase.x);
+}}
+
+__kernel void collapse(__global {real}2 *amplitudes, uint qubit, uint outcome, {real} scale)
+{{
+    ulong index = get_global_id(0);
+    if (((index >> qubit) & 1) == outcome)
+        amplitudes[index] *= scale;
+    else
+        amplitudes[index] = ({real}2)(0, 0);
+}}
+"""
+
+
+def ensure_context():
+    """Create the OpenCL context and build the kernels, if not done yet.
+
+    This is safe to call from several threads at once, and only the first
+    call does any work.
+
+    Raises:
+        QCGPUSimulatorError: if qcgpu isn't installed.
+    """
+    global _context_ready
+    if _context_ready:
+        return
+    if qcgpu is None:
+        raise QCGPUSimulatorError('qcgpu is not installed')
+
+    with _lock:
+        if not _context_ready:
+            qcgpu.backend._create_context()
+            _context_ready = True
+
+
+def warmup(num_qubits=2):
+    """Set up the device and run every kind of kernel once.
+
+    Some OpenCL drivers only compile kernels when they are first enqueued,
+    so running a small circuit moves that cost out of the first job.
+
+    Args:
+        num_qubits (int): the size of the warmup state.
+    """
+    ensure_context()
+
+    sim = DeviceState(num_qubits)
+    sim.u(0, 0.1, 0.2, 0.3)
+    sim.cx(0, 1)
+    sim.probabilities()
+    sim.amplitudes()
+
+
+class DeviceState(_State):
+    """A ``qcgpu.State``, with the gates of the compiled programs it lacks.
+
+    Controlled and single qubit gates run as ``qcgpu`` kernels. Unitaries
+    on several qubits have no kernel, so the amplitudes are copied to the
+    host, updated there, and copied back.
+    """
+
+    def u(self, target, theta, phi, lam):
+        # qcgpu.State.u, which u1, u2 and u3 call, is the SU(2) form of the
+        # qiskit gate, with another global phase
+        self.apply_gate(qcgpu.Gate(u3_matrix(theta, phi, lam)), target)
+
+    def cu1(self, control, target, lam):
+        # qcgpu.State.cu1 has a relative phase on the control
+        gate = qcgpu.Gate(np.diag([1, cmath.exp(1j * lam)]))
+        self.apply_controlled_gate(gate, control, target)
+
+    def swap(self, first, second):
+        self.cx(first, second)
+        self.cx(second, first)
+        self.cx(first, second)
+
+    def ccx(self, control, control2, target):
+        self.toffoli(control, control2, target)
+
+    def rz(self, target, phi):
+        self.apply_gate(qcgpu.Gate(gate_matrix('rz', [phi])), target)
+
+    def rx(self, target, theta):
+        self.apply_gate(qcgpu.Gate(gate_matrix('rx', [theta])), target)
+
+    def ry(self, target, theta):
+        self.apply_gate(qcgpu.Gate(gate_matrix('ry', [theta])), target)
+
+    def unitary(self, qubits, matrix):
+        if len(qubits) == 1:
+            self.apply_gate(qcgpu.Gate(matrix), qubits[0])
+            return
+
+        buffer = self.backend.buffer
+        amplitudes = buffer.reshape(buffer.size)
+        host = amplitudes.get().astype(np.complex128)
+        NumpyState(self.num_qubits, vector=host).apply_matrix(matrix, qubits)
+        amplitudes.set(host.astype(buffer.dtype))
+
+    def diagonal(self, qubits, entries):
+        apply_diagonal(self.backend.buffer, qubits, entries)
+
+
+def _get_program(context, dtype):
+    """Build the kernels of this module for a context, once."""
+    key = (context.int_ptr, dtype)
+    with _lock:
+        program = _programs.get(key)
+        if program is None:
+            double = dtype == np.complex128
+            source = _KERNEL_SOURCE.format(
+                real='double' if double else 'float',
+                pragma='#pragma OPENCL EXTENSION cl_khr_fp64 : enable' if double else '')
+            program = _programs[key] = pyopencl.Program(context, source).build()
+        return program
+
+
+def marginal_probabilities(buffer, qubits):
+    """Reduce the probabilities of a state onto some of its qubits, on the device.
+
+    Only the ``2 ** len(qubits)`` probabilities, times the number of blocks
+    every outcome is summed over, are copied back to the host.
+
+    Args:
+        buffer (pyopencl.array.Array): the amplitudes of the state.
+        qubits (list): the qubits to keep, where bit ``k`` of the outcomes
+            is ``qubits[k]``.
+
+    Returns:
+        ndarray: the ``float64`` probability of every outcome.
+    """
+    queue = buffer.queue
+    num_qubits = int(buffer.size).bit_length() - 1
+    measured = np.array(qubits, dtype=np.uint32)
+    unmeasured = np.array([qubit for qubit in range(num_qubits) if qubit not in qubits],
+                          dtype=np.uint32)
+
+    num_outcomes = 2 ** len(measured)
+    num_rest = 2 ** len(unmeasured)
+    blocks = min(num_rest, MARGINAL_BLOCKS)
+    real = np.float64 if buffer.dtype == np.complex128 else np.float32
+
+    partial = pyopencl.array.empty(queue, blocks * num_outcomes, dtype=real)
+    # Empty index arrays can't be allocated, so both get a dummy entry
+    measured_device = pyopencl.array.to_device(queue, np.append(measured, 0))
+    unmeasured_device = pyopencl.array.to_device(queue, np.append(unmeasured, 0))
+
+    program = _get_program(buffer.context, buffer.dtype.type)
+    program.marginal(queue, (num_outcomes, blocks), None,
+                     buffer.data, partial.data,
+                     measured_device.data, np.uint32(len(measured)),
+                     unmeasured_device.data, np.uint32(len(unmeasured)),
+                     np.uint64(num_rest // blocks))
+
+    return partial.get().reshape(blocks, num_outcomes).sum(axis=0, dtype=np.float64)
+
+
+def pauli_expectations(buffer, paulis):
+    """The expectation values of Pauli strings on a state, on the device.
+
+    Strings with the same X part are reduced by one kernel, and only the
+    sum of every block is copied back to the host.
+
+    Args:
+        buffer (pyopencl.array.Array): the amplitudes of the state.
+        paulis (list): the ``(x, z)`` bit masks of the strings, see
+            ``engines.pauli_expectations``.
+
+    Returns:
+        ndarray: the ``float64`` expectation value of every string.
+    """
+    queue = buffer.queue
+    size = int(buffer.size)
+    blocks = min(size, PAULI_BLOCKS)
+    program = _get_program(buffer.context, buffer.dtype.type)
+    values = np.empty(len(paulis))
+
+    groups = {}
+    for position, pauli in enumerate(paulis):
+        groups.setdefault(pauli[0], []).append(position)
+
+    for x, positions in groups.items():
+        signs = pyopencl.array.to_device(queue, np.array(
+            [paulis[position][1] for position in positions], dtype=np.uint64))
+        partial = pyopencl.array.empty(queue, blocks * len(positions), dtype=buffer.dtype)
+        program.pauli(queue, (len(positions), blocks), None, buffer.data, partial.data,
+                      np.uint64(x), signs.data, np.uint64(size // blocks))
+
+        totals = partial.get().reshape(blocks, len(positions)).sum(axis=0, dtype=np.complex128)
+        for position, total in zip(positions, totals):
+            # The phase of the Ys of the string
+            phase = 1j ** bin(x & paulis[position][1]).count('1')
+            values[position] = (phase * total).real
+
+    return values
+
+
+def apply_diagonal(buffer, qubits, entries):
+    """Multiply every amplitude of a state by an entry of a diagonal, in place.
+
+    Args:
+        buffer (pyopencl.array.Array): the amplitudes of the state.
+        qubits (list): the ``k`` qubits the diagonal acts on.
+        entries (ndarray): the ``2 ** k`` entries of the diagonal, where
+            ``qubits[0]`` is the least significant bit of the index.
+    """
+    queue = buffer.queue
+    entries_device = pyopencl.array.to_device(queue, np.asarray(entries, dtype=buffer.dtype))
+    # Empty index arrays can't be allocated, so there is a dummy entry
+    qubits_device = pyopencl.array.to_device(queue, np.append(
+        np.array(qubits, dtype=np.uint32), np.uint32(0)))
+
+    program = _get_program(buffer.context, buffer.dtype.type)
+    program.diagonal(queue, (int(buffer.size),), None, buffer.data, entries_device.data,
+                     qubits_device.data, np.uint32(len(qubits)))
+
+
+def collapse(buffer, qubit, outcome, probability):
+    """Project a state onto an outcome of a qubit, and renormalize it, in place.
+
+    Args:
+        buffer (pyopencl.array.Array): the amplitudes of the state.
+        qubit (int): the measured qubit.
+        outcome (int): the measured value, 0 or 1.
+        probability (float): the probability of the outcome.
+    """
+    real = np.float64 if buffer.dtype == np.complex128 else np.float32
+    program = _get_program(buffer.context, buffer.dtype.type)
+    program.collapse(buffer.queue, (int(buffer.size),), None, buffer.data,
+                     np.uint32(qubit), np.uint32(outcome), real(1 / np.sqrt(probability)))
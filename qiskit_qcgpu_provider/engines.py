@@ -0,0 +1,516 @@
+"""
+Engines the QCGPU backends simulate circuits with.
+
+An engine creates states which have the gate methods of ``qcgpu.State``
+(``u``, ``u2``, ``u1``, ``cx``, ``h``, ``x``, ``y``, ``z``, ``s``, ``t``,
+``amplitudes`` and ``probabilities``), and ``cz``, ``cu1``, ``swap``,
+``ccx``, ``rz``, ``rx``, ``ry`` and ``unitary``, so compiled programs run
+on any of them. Engines also reduce states to the expectation values of
+Pauli strings, without copying the amplitudes where they can.
+
+The ``qcgpu`` engine runs on an OpenCL device. The ``numpy`` engine keeps
+the state vector in host memory and applies gates with reshapes and
+``einsum``, which is faster for small circuits, and doesn't need OpenCL.
+The ``sharded`` engine splits the state vector across worker processes,
+to use every core of the host for large circuits.
+
+With the ``'auto'`` engine, every experiment runs on the engine with the
+lowest estimated run time. Engines which start processes or allocate
+shared memory, such as ``sharded``, are opt-in: they are only candidates,
+warmed up or calibrated when asked for. Each engine estimates the time of
+a gate as a fixed overhead, plus a time per amplitude of the state. The
+defaults can be tuned to the host by a short benchmark, see
+``calibrate``.
+"""
+
+from collections import OrderedDict
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import device, sharding
+from .numpy_state import NumpyState
+from .simulatorerror import QCGPUSimulatorError
+
+logger = logging.getLogger(__name__)
+
+
+def marginalize(probabilities, num_qubits, qubits):
+    """Sum the probabilities of a state onto some of its qubits.
+
+    Args:
+        probabilities (ndarray): the probabilities of the ``2 ** num_qubits``
+            basis states.
+        num_qubits (int): the number of qubits of the state.
+        qubits (list): the qubits to keep, where bit ``k`` of the outcomes
+            is ``qubits[k]``.
+
+    Returns:
+        ndarray: the ``float64`` probability of every outcome.
+    """
+    tensor = np.reshape(probabilities, num_qubits * [2])
+    # Axis 0 of the tensor is the most significant qubit
+    kept = [num_qubits - 1 - qubit for qubit in reversed(qubits)]
+    summed = tuple(axis for axis in range(num_qubits) if axis not in kept)
+    marginal = np.sum(tensor, axis=summed, dtype=np.float64)
+    return np.transpose(marginal, [sorted(kept).index(axis) for axis in kept]).reshape(-1)
+
+
+# The phase of a Pauli string with k Ys, i ** k
+_Y_PHASES = [1, 1j, -1, -1j]
+
+# The number of amplitudes reduced at a time by ``pauli_expectations``
+PAULI_BLOCK_SIZE = 2 ** 14
+
+
+def _parities(z, size):
+    """The parity of ``j & z`` for every ``j`` below ``size``, a power of two."""
+    parities = np.zeros(1, dtype=np.int8)
+    for qubit in range(size.bit_length() - 1):
+        parities = np.concatenate([parities, parities ^ ((z >> qubit) & 1)])
+    return parities
+
+
+def pauli_expectations(amplitudes, paulis):
+    """The expectation values of Pauli strings on a state.
+
+    A string with X part ``x`` and Z part ``z`` maps ``|j>`` to
+    ``i ** #Y * (-1) ** |j & z| * |j ^ x>``, so its expectation value is a
+    signed sum of the products ``conj(a[j ^ x]) * a[j]``. Strings with the
+    same X part share these products, which are reduced against the signs
+    of every string in one pass over the state, a block at a time. The
+    signs of a block only depend on its low bits, up to a sign for the
+    whole block, so they are computed once.
+
+    Args:
+        amplitudes (ndarray): the amplitudes of the state.
+        paulis (list): the ``(x, z)`` bit masks of the strings, where qubit
+            ``q`` has an X if bit ``q`` of ``x`` is set, a Z if bit ``q``
+            of ``z`` is set, and a Y if both are.
+
+    Returns:
+        ndarray: the ``float64`` expectation value of every string.
+    """
+    size = len(amplitudes)
+    block = min(size, PAULI_BLOCK_SIZE)
+    values = np.empty(len(paulis))
+
+    groups = OrderedDict()
+    for position, pauli in enumerate(paulis):
+        groups.setdefault(pauli[0], []).append(position)
+
+    for x, positions in groups.items():
+        zs = [paulis[position][1] for position in positions]
+        signs = 1.0 - 2.0 * np.array([_parities(z, block) for z in zs])
+        # j ^ x is in the block of start ^ x, at the low bits of j ^ x
+        permutation = np.arange(block) ^ (x & (block - 1))
+        totals = np.zeros(len(positions), dtype=np.complex128)
+
+        for start in range(0, size, block):
+            chunk = amplitudes[start:start + block]
+            if x:
+                partner = start ^ (x & ~(block - 1))
+                products = np.conj(amplitudes[partner:partner + block][permutation]) * chunk
+            else:
+                products = np.abs(chunk) ** 2
+            high_signs = [1 - 2 * (bin(start & z).count('1') & 1) for z in zs]
+            totals += np.multiply(high_signs, signs @ products)
+
+        for position, z, total in zip(positions, zs, totals):
+            values[position] = (_Y_PHASES[bin(x & z).count('1') % 4] * total).real
+
+    return values
+
+
+class BaseEngine:
+    """Interface of the simulation engines.
+
+    Attributes:
+        name (str): the name the engine is selected by.
+        opt_in (bool): whether the engine is only chosen by ``'auto'``
+            when opt-in engines are enabled.
+    """
+
+    name = None
+    opt_in = False
+
+    # Cost model, in seconds: a gate takes gate_overhead + amplitude_time * 2 ** n
+    gate_overhead = 0.0
+    amplitude_time = 0.0
+    calibrated = False
+
+    def estimate_time(self, num_qubits, num_gates):
+        """Estimate how long a circuit takes to run.
+
+        Args:
+            num_qubits (int): the width of the circuit.
+            num_gates (int): the number of gates.
+
+        Returns:
+            float: the estimated run time, in seconds.
+        """
+        return max(num_gates, 1) * (self.gate_overhead + self.amplitude_time * 2 ** num_qubits)
+
+    def available(self):
+        """Whether the engine can be used on this host."""
+        return True
+
+    def warmup(self):
+        """Do any setup needed before the first state is created."""
+
+    def create_state(self, num_qubits):
+        """Create a state in |0...0>.
+
+        Args:
+            num_qubits (int): the number of qubits.
+
+        Returns:
+            object: a state with the gate methods of ``qcgpu.State``.
+
+        Raises:
+            OverflowError: if the state is too large.
+        """
+        raise NotImplementedError
+
+    def reset_state(self, sim):
+        """Reset a state to |0...0> in place, without reallocating it."""
+        raise NotImplementedError
+
+    def state_nbytes(self, sim):
+        """The memory used by a state, in bytes."""
+        raise NotImplementedError
+
+    def amplitude_chunks(self, sim, chunk_size):
+        """Iterate over the amplitudes of a state, as host arrays.
+
+        Args:
+            sim (object): a state of this engine.
+            chunk_size (int): the number of amplitudes in every chunk.
+
+        Yields:
+            ndarray: consecutive chunks of amplitudes.
+        """
+        raise NotImplementedError
+
+    def copy_state(self, source, target):
+        """Copy the amplitudes of a state into another state of the same size."""
+        raise NotImplementedError
+
+    def collapse(self, sim, qubit, outcome, probability):
+        """Project a state onto an outcome of a qubit, and renormalize it.
+
+        Args:
+            sim (object): a state of this engine.
+            qubit (int): the measured qubit.
+            outcome (int): the measured value, 0 or 1.
+            probability (float): the probability of the outcome.
+        """
+        raise NotImplementedError
+
+    def marginal_probabilities(self, sim, qubits):
+        """The probabilities of the outcomes of measuring some qubits.
+
+        Args:
+            sim (object): a state of this engine.
+            qubits (list): the measured qubits, where bit ``k`` of the
+                outcomes is ``qubits[k]``.
+
+        Returns:
+            ndarray: the ``float64`` probability of every outcome.
+        """
+        return marginalize(sim.probabilities(), sim.num_qubits, qubits)
+
+    def pauli_expectations(self, sim, paulis):
+        """The expectation values of Pauli strings on a state.
+
+        Args:
+            sim (object): a state of this engine.
+            paulis (list): the ``(x, z)`` bit masks of the strings, see
+                ``pauli_expectations``.
+
+        Returns:
+            ndarray: the ``float64`` expectation value of every string.
+        """
+        return pauli_expectations(sim.amplitudes(), paulis)
+
+
+class QCGPUEngine(BaseEngine):
+    """Runs circuits on an OpenCL device with ``qcgpu``."""
+
+    name = 'qcgpu'
+
+    # Kernel launches are slow, but the device goes through amplitudes quickly
+    gate_overhead = 2e-5
+    amplitude_time = 1e-10
+
+    def __init__(self):
+        self._available = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        with self._lock:
+            if self._available is None:
+                try:
+                    device.ensure_context()
+                    self._available = True
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.info('The qcgpu engine is not available: %s', err)
+                    self._available = False
+            return self._available
+
+    def warmup(self):
+        device.warmup()
+
+    def create_state(self, num_qubits):
+        device.ensure_context()
+        return device.DeviceState(num_qubits)
+
+    def reset_state(self, sim):
+        amplitudes = self._flat_buffer(sim)
+        amplitudes.fill(0)
+        amplitudes[:1].fill(1)
+
+    def state_nbytes(self, sim):
+        return sim.backend.buffer.nbytes
+
+    def amplitude_chunks(self, sim, chunk_size):
+        amplitudes = self._flat_buffer(sim)
+        for start in range(0, amplitudes.size, chunk_size):
+            yield amplitudes[start:start + chunk_size].get()
+
+    def copy_state(self, source, target):
+        self._flat_buffer(target)[:] = self._flat_buffer(source)
+
+    def collapse(self, sim, qubit, outcome, probability):
+        device.collapse(sim.backend.buffer, qubit, outcome, probability)
+
+    def marginal_probabilities(self, sim, qubits):
+        if len(qubits) == sim.num_qubits:
+            return super().marginal_probabilities(sim, qubits)
+        # Only the marginal probabilities are copied from the device
+        return device.marginal_probabilities(sim.backend.buffer, qubits)
+
+    def pauli_expectations(self, sim, paulis):
+        # Only the sums of every block are copied from the device
+        return device.pauli_expectations(sim.backend.buffer, paulis)
+
+    @staticmethod
+    def _flat_buffer(sim):
+        buffer = sim.backend.buffer
+        return buffer.reshape(buffer.size)
+
+
+class NumpyEngine(BaseEngine):
+    """Runs circuits on the CPU with NumPy."""
+
+    name = 'numpy'
+
+    gate_overhead = 5e-6
+    amplitude_time = 5e-9
+
+    def create_state(self, num_qubits):
+        return NumpyState(num_qubits)
+
+    def reset_state(self, sim):
+        sim.vector.fill(0)
+        sim.vector[0] = 1
+
+    def state_nbytes(self, sim):
+        return sim.vector.nbytes
+
+    def amplitude_chunks(self, sim, chunk_size):
+        for start in range(0, sim.vector.size, chunk_size):
+            yield sim.vector[start:start + chunk_size]
+
+    def copy_state(self, source, target):
+        target.vector[...] = source.vector
+
+    def collapse(self, sim, qubit, outcome, probability):
+        sim.collapse(qubit, outcome, probability)
+
+    def pauli_expectations(self, sim, paulis):
+        return pauli_expectations(sim.vector, paulis)
+
+
+class ShardedEngine(BaseEngine):
+    """Runs circuits on several CPU cores, with the state in shared memory.
+
+    See ``sharding`` for how the gates are split across the workers.
+    """
+
+    name = 'sharded'
+    opt_in = True
+
+    # Every segment of gates is a round trip to the worker processes
+    gate_overhead = 5e-4
+
+    def __init__(self, processes=None):
+        """
+        Args:
+            processes (int): the number of worker processes, rounded down to
+                a power of two. Defaults to the number of CPUs.
+        """
+        processes = processes or os.cpu_count() or 1
+        self.processes = 2 ** int(math.log2(processes))
+        self.amplitude_time = NumpyEngine.amplitude_time / self.processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return sharding.shared_memory is not None
+
+    def warmup(self):
+        self._get_pool()
+
+    def close(self):
+        """Stop the worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = sharding.create_pool(self.processes)
+            return self._pool
+
+    def create_state(self, num_qubits):
+        return sharding.ShardedState(num_qubits, self._get_pool(), self.processes)
+
+    def reset_state(self, sim):
+        sim.reset()
+
+    def state_nbytes(self, sim):
+        return sim.vector.nbytes
+
+    def amplitude_chunks(self, sim, chunk_size):
+        sim.flush()
+        for start in range(0, sim.vector.size, chunk_size):
+            yield sim.vector[start:start + chunk_size]
+
+    def copy_state(self, source, target):
+        source.flush()
+        target.reset()
+        target.vector[...] = source.vector
+
+    def collapse(self, sim, qubit, outcome, probability):
+        sim.flush()
+        NumpyState(sim.num_qubits, vector=sim.vector).collapse(qubit, outcome, probability)
+
+    def pauli_expectations(self, sim, paulis):
+        sim.flush()
+        return pauli_expectations(sim.vector, paulis)
+
+
+ENGINES = OrderedDict((engine.name, engine)
+                      for engine in [QCGPUEngine(), NumpyEngine(), ShardedEngine()])
+
+
+def get_engine(name):
+    """Get an engine by name.
+
+    Args:
+        name (str): the name of the engine.
+
+    Returns:
+        BaseEngine: the engine.
+
+    Raises:
+        QCGPUSimulatorError: if there is no such engine, or it isn't available.
+    """
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise QCGPUSimulatorError('Unknown engine "{}", must be one of {}'.format(
+            name, ['auto'] + list(ENGINES)))
+    if not engine.available():
+        raise QCGPUSimulatorError('The "{}" engine is not available'.format(name))
+    return engine
+
+
+def candidate_engines(opt_in=False):
+    """The engines ``'auto'`` chooses from.
+
+    Args:
+        opt_in (bool): also include the available opt-in engines.
+
+    Returns:
+        list: the available engines.
+    """
+    return [engine for engine in ENGINES.values()
+            if engine.available() and (opt_in or not engine.opt_in)]
+
+
+def select_engine(name, num_qubits, num_gates=0, opt_in=False):
+    """Choose the engine an experiment runs on.
+
+    Args:
+        name (str): the ``engine`` option, the name of an engine or ``'auto'``.
+        num_qubits (int): the width of the experiment.
+        num_gates (int): the number of gates of the experiment.
+        opt_in (bool): whether ``'auto'`` may also choose opt-in engines.
+
+    Returns:
+        tuple: the ``BaseEngine``, and a dictionary recording why it was
+            chosen, which is added to the result metadata.
+
+    Raises:
+        QCGPUSimulatorError: if the engine doesn't exist or isn't available.
+    """
+    if name != 'auto':
+        return get_engine(name), {'option': name, 'reason': 'requested'}
+
+    estimates = OrderedDict((engine.name, engine.estimate_time(num_qubits, num_gates))
+                            for engine in candidate_engines(opt_in))
+    chosen = min(estimates, key=estimates.get)
+
+    reason = 'lowest estimated time for {} qubits and {} gates'.format(num_qubits, num_gates)
+    return ENGINES[chosen], {'option': name,
+                             'reason': reason,
+                             'estimates': estimates,
+                             'calibrated': ENGINES[chosen].calibrated}
+
+
+def calibrate(widths=(4, 10, 14), num_gates=32, opt_in=False):
+    """Tune the cost model of the available engines to this host.
+
+    Every engine applies ``num_gates`` gates to states of a few widths, and
+    its ``gate_overhead`` and ``amplitude_time`` are fitted to the times.
+
+    Args:
+        widths (tuple): the widths of the benchmark states.
+        num_gates (int): the number of gates applied to every state.
+        opt_in (bool): also calibrate the opt-in engines.
+
+    Returns:
+        dict: the fitted ``(gate_overhead, amplitude_time)`` of every engine.
+    """
+    fitted = {}
+    for engine in candidate_engines(opt_in):
+        sizes = []
+        gate_times = []
+        for width in widths:
+            sim = engine.create_state(width)
+            start = time.perf_counter()
+            for gate in range(num_gates):
+                sim.h(gate % width)
+            # Reading the state waits for queued kernels to finish
+            sim.probabilities()
+            gate_times.append((time.perf_counter() - start) / num_gates)
+            sizes.append(2 ** width)
+
+        matrix = np.column_stack([np.ones(len(sizes)), sizes])
+        coefficients = np.linalg.lstsq(matrix, gate_times, rcond=None)[0]
+        engine.gate_overhead, engine.amplitude_time = [
+            float(max(coefficient, 0)) for coefficient in coefficients]
+        engine.calibrated = True
+
+        fitted[engine.name] = (engine.gate_overhead, engine.amplitude_time)
+        logger.info('Calibrated the %s engine: %.3g s per gate, %.3g s per amplitude',
+                    engine.name, engine.gate_overhead, engine.amplitude_time)
+
+    return fitted
@@ -0,0 +1,496 @@
+"""
+Gate fusion for the QCGPU backends.
+
+Every gate sent to ``qcgpu.State`` is a full pass over the state vector, so
+runs of single-qubit gates on the same qubit are multiplied together and
+sent as a single ``u3`` gate. Diagonal gates commute with the control of a
+``cx``, so they are carried across it and merged with the gates that follow.
+
+Runs of diagonal gates, on any qubits, only multiply every amplitude by a
+phase, so they are collected into a single diagonal applied in one pass,
+see ``diagonal_plan``. This turns the ``n`` controlled phases of every
+step of a QFT into one pass over the state.
+
+The fused gates are equal to the original ones up to a global phase. The
+counts of qasm runs don't depend on it, but for statevectors the phases
+they leave out are added up and applied once at the end of the program,
+see ``GlobalPhase``, which keeps fused statevectors equal to the unfused
+ones. The phases are those of the qiskit gates, which every engine
+applies, see ``device.DeviceState``.
+"""
+
+import cmath
+import math
+
+import numpy as np
+
+# Gates that are multiplied together by the fusion pass
+SINGLE_QUBIT_GATES = ['u1', 'u2', 'u3', 'id', 'x', 'y', 'z', 'h', 's', 't', 'rz', 'rx', 'ry']
+
+# Single qubit gates which take parameters
+PARAMETERIZED_GATES = ['u1', 'u2', 'u3', 'rz', 'rx', 'ry']
+
+# Single qubit gates which are diagonal in the computational basis
+DIAGONAL_GATES = ['u1', 'id', 'z', 's', 't', 'rz']
+
+# Diagonal gates with a first entry of 1, whose products have no global phase
+PHASE_FREE_GATES = ['u1', 'id', 'z', 's', 't']
+
+# Instructions which don't touch the state vector
+NON_GATES = ['id', 'barrier', 'measure', 'bfunc']
+
+# Gates which only multiply the amplitudes where some qubits are 1 by a phase,
+# with the phase of the ones without parameters
+DIAGONAL_PHASES = {'u1': None, 'rz': None, 'cu1': None,
+                   'z': math.pi, 's': math.pi / 2, 't': math.pi / 4, 'cz': math.pi}
+
+# Maximum number of qubits of a collected diagonal, which has 2 ** n entries
+DIAGONAL_MAX_QUBITS = 16
+
+_TOLERANCE = 1e-12
+
+
+def u3_matrix(theta, phi, lam):
+    """The matrix of a ``u3`` gate.
+
+    Args:
+        theta (float): the theta angle.
+        phi (float): the phi angle.
+        lam (float): the lambda angle.
+
+    Returns:
+        ndarray: a 2x2 complex matrix.
+    """
+    cos = math.cos(theta / 2)
+    sin = math.sin(theta / 2)
+    return np.array([[cos, -cmath.exp(1j * lam) * sin],
+                     [cmath.exp(1j * phi) * sin, cmath.exp(1j * (phi + lam)) * cos]])
+
+
+def gate_matrix(name, params):
+    """The matrix of a single qubit gate.
+
+    Args:
+        name (str): the name of the gate, one of ``SINGLE_QUBIT_GATES``.
+        params (list): the parameters of the gate.
+
+    Returns:
+        ndarray: a 2x2 complex matrix.
+    """
+    params = [float(param) for param in params]
+    if name == 'u3':
+        return u3_matrix(*params)
+    if name == 'u2':
+        return u3_matrix(math.pi / 2, *params)
+    if name == 'u1':
+        return np.diag([1, cmath.exp(1j * params[0])])
+    if name == 'id':
+        return np.eye(2, dtype=complex)
+    if name == 'x':
+        return np.array([[0, 1], [1, 0]], dtype=complex)
+    if name == 'y':
+        return np.array([[0, -1j], [1j, 0]])
+    if name == 'z':
+        return np.diag([1, -1]).astype(complex)
+    if name == 'h':
+        return np.array([[1, 1], [1, -1]], dtype=complex) / math.sqrt(2)
+    if name == 's':
+        return np.diag([1, 1j])
+    if name == 't':
+        return np.diag([1, cmath.exp(1j * math.pi / 4)])
+    if name == 'rz':
+        return np.diag([cmath.exp(-0.5j * params[0]), cmath.exp(0.5j * params[0])])
+    if name == 'rx':
+        cos, sin = math.cos(params[0] / 2), math.sin(params[0] / 2)
+        return np.array([[cos, -1j * sin], [-1j * sin, cos]])
+    if name == 'ry':
+        cos, sin = math.cos(params[0] / 2), math.sin(params[0] / 2)
+        return np.array([[cos, -sin], [sin, cos]], dtype=complex)
+    raise ValueError('"{}" is not a single qubit gate'.format(name))
+
+
+def matrix_to_u3(matrix):
+    """Find the ``u3`` angles of a single qubit unitary.
+
+    Args:
+        matrix (ndarray): a 2x2 unitary matrix.
+
+    Returns:
+        tuple: the ``(theta, phi, lambda)`` angles, such that
+            ``u3(theta, phi, lambda)`` equals ``matrix`` up to a global phase.
+    """
+    theta = 2 * math.atan2(abs(matrix[1, 0]), abs(matrix[0, 0]))
+
+    if abs(matrix[0, 0]) > _TOLERANCE:
+        phase = cmath.phase(matrix[0, 0])
+    else:
+        # cos(theta / 2) is zero, so only phi - lambda is defined
+        phase = cmath.phase(matrix[1, 0])
+
+    if abs(matrix[1, 0]) > _TOLERANCE:
+        phi = cmath.phase(matrix[1, 0]) - phase
+        lam = cmath.phase(-matrix[0, 1]) - phase
+    else:
+        # sin(theta / 2) is zero, so only phi + lambda is defined
+        phi = 0.0
+        lam = cmath.phase(matrix[1, 1]) - phase
+
+    return theta, phi, lam
+
+
+def is_diagonal(matrix):
+    """Whether a 2x2 matrix is diagonal."""
+    return abs(matrix[0, 1]) < _TOLERANCE and abs(matrix[1, 0]) < _TOLERANCE
+
+
+class FusedGate:
+    """Consecutive single qubit gates on one qubit, applied as one gate.
+
+    Which gates are fused only depends on the names and qubits of the
+    instructions, so a fused gate can be bound to new parameter values.
+
+    Attributes:
+        qubit (int): the qubit the gates act on.
+        indices (list): indices of the fused instructions, in order.
+        diagonal (bool): whether the product is diagonal for any parameters.
+    """
+
+    def __init__(self, qubit, index, name):
+        self.qubit = qubit
+        self.indices = [index]
+        self.diagonal = name in DIAGONAL_GATES
+        self._phase_free = name in PHASE_FREE_GATES
+        # The product is only known in advance if no gate has parameters
+        self._product = None if name in PARAMETERIZED_GATES else gate_matrix(name, [])
+
+    @property
+    def name(self):
+        """The name of the gate the product is applied as."""
+        return 'u1' if self.diagonal else 'u3'
+
+    def merge(self, index, name):
+        """Apply another gate after the ones already fused."""
+        self.indices.append(index)
+        self._phase_free = self._phase_free and name in PHASE_FREE_GATES
+        if self._product is not None and name not in PARAMETERIZED_GATES:
+            self._product = gate_matrix(name, []) @ self._product
+            # Products like h.h can become diagonal again
+            self.diagonal = is_diagonal(self._product)
+        else:
+            self._product = None
+            self.diagonal = self.diagonal and name in DIAGONAL_GATES
+
+    def is_identity(self):
+        """Whether the gates cancel out for any parameters."""
+        if self._product is None:
+            return False
+        return np.allclose(self._product, np.eye(2), rtol=0, atol=_TOLERANCE)
+
+    def has_global_phase(self):
+        """Whether the fused gate may leave out a global phase."""
+        if self._phase_free:
+            return False
+        return self._product is None or abs(self.global_phase([])) > _TOLERANCE
+
+    def matrix(self, instructions):
+        """The product of the gates.
+
+        Args:
+            instructions (list): the instructions the gate was planned from,
+                or instructions with the same structure and new parameters.
+
+        Returns:
+            ndarray: a 2x2 complex matrix.
+        """
+        if self._product is not None:
+            return self._product
+
+        matrix = np.eye(2, dtype=complex)
+        for index in self.indices:
+            instruction = instructions[index]
+            matrix = gate_matrix(instruction['name'], instruction.get('params', [])) @ matrix
+        return matrix
+
+    def params(self, instructions):
+        """The parameters of the fused gate.
+
+        Args:
+            instructions (list): the instructions the gate was planned from,
+                or instructions with the same structure and new parameters.
+
+        Returns:
+            list: the ``u1`` or ``u3`` parameters.
+        """
+        matrix = self.matrix(instructions)
+        if self.diagonal:
+            return [cmath.phase(matrix[1, 1] / matrix[0, 0])]
+        return list(matrix_to_u3(matrix))
+
+    def global_phase(self, instructions):
+        """The angle of the global phase the fused gate leaves out.
+
+        Args:
+            instructions (list): the instructions the gate was planned from,
+                or instructions with the same structure and new parameters.
+
+        Returns:
+            float: the angle ``a`` such that the product of the gates is
+                ``exp(i a)`` times the ``u1`` or ``u3`` gate.
+        """
+        matrix = self.matrix(instructions)
+        if self.diagonal:
+            return cmath.phase(matrix[0, 0])
+        # The trace of u3^dagger . matrix is 2 exp(i a)
+        return cmath.phase(np.vdot(u3_matrix(*matrix_to_u3(matrix)), matrix))
+
+    def to_instruction(self, instructions):
+        """The fused gate as an instruction dictionary."""
+        return {'name': self.name, 'qubits': [self.qubit],
+                'params': self.params(instructions)}
+
+
+class DiagonalRun:
+    """Consecutive diagonal gates, on any qubits, applied as one diagonal.
+
+    Attributes:
+        qubits (list): the qubits of the diagonal, in the order of its index
+            bits, ``qubits[0]`` being the least significant.
+        entries (list): the plan entries of the gates, instruction indices
+            or diagonal ``FusedGate``.
+    """
+
+    def __init__(self):
+        self.qubits = []
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def can_add(self, qubits):
+        """Whether a gate on some qubits fits in the diagonal."""
+        return len(set(self.qubits).union(qubits)) <= DIAGONAL_MAX_QUBITS
+
+    def add(self, entry, qubits):
+        """Apply another diagonal gate after the ones already collected."""
+        self.entries.append(entry)
+        self.qubits.extend(qubit for qubit in qubits if qubit not in self.qubits)
+
+    def _terms(self, instructions):
+        """The ``(qubits, angle)`` terms of the gates, and their global phase.
+
+        Every amplitude is multiplied by the phases of the terms whose qubits
+        are all 1.
+        """
+        terms = []
+        global_angle = 0.0
+        for entry in self.entries:
+            if isinstance(entry, FusedGate):
+                terms.append(([entry.qubit], entry.params(instructions)[0]))
+                global_angle += entry.global_phase(instructions)
+                continue
+
+            instruction = instructions[entry]
+            name = instruction['name']
+            angle = DIAGONAL_PHASES[name]
+            if angle is None:
+                angle = float(instruction['params'][0])
+            if name == 'rz':
+                global_angle -= angle / 2
+            terms.append((instruction['qubits'], angle))
+        return terms, global_angle
+
+    def phases(self, instructions):
+        """The entries of the diagonal.
+
+        Args:
+            instructions (list): the instructions the run was planned from,
+                or instructions with the same structure and new parameters.
+
+        Returns:
+            ndarray: the ``2 ** len(qubits)`` complex phases.
+        """
+        size = len(self.qubits)
+        terms, global_angle = self._terms(instructions)
+        angles = np.full((2,) * size, global_angle)
+        # Axis 0 of the table is the most significant qubit
+        for qubits, angle in terms:
+            index = [slice(None)] * size
+            for qubit in qubits:
+                index[size - 1 - self.qubits.index(qubit)] = 1
+            angles[tuple(index)] += angle
+        return np.exp(1j * angles).reshape(-1)
+
+
+class GlobalPhase:
+    """The global phase left out by the fused gates of a plan.
+
+    It is applied as a diagonal with two equal entries on qubit 0, after
+    the other gates.
+
+    Attributes:
+        qubits (list): the qubit of the diagonal, ``[0]``.
+        gates (list): the ``FusedGate`` whose phases are added up.
+    """
+
+    def __init__(self, gates):
+        self.qubits = [0]
+        self.gates = gates
+
+    def phases(self, instructions):
+        """The entries of the diagonal.
+
+        Args:
+            instructions (list): the instructions the plan was made from,
+                or instructions with the same structure and new parameters.
+
+        Returns:
+            ndarray: the two equal complex entries.
+        """
+        angle = sum(gate.global_phase(instructions) for gate in self.gates)
+        return np.full(2, cmath.exp(1j * angle))
+
+
+def global_phase_plan(plan):
+    """Add the global phase the fused gates of a plan leave out.
+
+    The fused gates in a ``DiagonalRun`` are left out, as the run keeps
+    their phase.
+
+    Args:
+        plan (list): instruction indices, ``FusedGate`` and ``DiagonalRun``.
+
+    Returns:
+        list: the plan, with a ``GlobalPhase`` at the end if a fused gate
+            may leave out a phase.
+    """
+    gates = [entry for entry in plan
+             if isinstance(entry, FusedGate) and entry.has_global_phase()]
+    if not gates:
+        return plan
+    return list(plan) + [GlobalPhase(gates)]
+
+
+def diagonal_plan(instructions, plan):
+    """Collect the runs of diagonal gates of a plan.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+        plan (list): instruction indices and ``FusedGate``, as returned by
+            ``fusion_plan``.
+
+    Returns:
+        list: the plan, where runs of two or more diagonal gates are
+            replaced by a ``DiagonalRun``.
+    """
+    result = []
+    run = DiagonalRun()
+
+    def flush():
+        if len(run) > 1:
+            result.append(run)
+        else:
+            result.extend(run.entries)
+
+    for entry in plan:
+        if isinstance(entry, FusedGate):
+            qubits = [entry.qubit] if entry.diagonal else None
+        else:
+            instruction = instructions[entry]
+            diagonal = (instruction['name'] in DIAGONAL_PHASES and
+                        'conditional' not in instruction)
+            qubits = instruction['qubits'] if diagonal else None
+
+        if qubits is None or not run.can_add(qubits):
+            flush()
+            run = DiagonalRun()
+        if qubits is None:
+            result.append(entry)
+        else:
+            run.add(entry, qubits)
+    flush()
+
+    return result
+
+
+def count_gates(instructions):
+    """Count the instructions which are applied to the state vector.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+
+    Returns:
+        int: the number of gates.
+    """
+    return sum(1 for instruction in instructions if instruction['name'] not in NON_GATES)
+
+
+def fusion_plan(instructions):
+    """Decide which instructions are fused together.
+
+    Args:
+        instructions (list): instructions as dictionaries, with ``name``,
+            ``qubits`` and optionally ``params`` keys.
+
+    Returns:
+        list: for every instruction to apply, either the index of an
+            instruction which is kept as it is, or a ``FusedGate``.
+    """
+    plan = []
+    pending = {}
+
+    def flush(qubit):
+        gate = pending.pop(qubit, None)
+        if gate is None or gate.is_identity():
+            return
+        if len(gate.indices) == 1:
+            # A lone gate is kept as it was
+            plan.append(gate.indices[0])
+        else:
+            plan.append(gate)
+
+    for index, instruction in enumerate(instructions):
+        name = instruction['name']
+        qubits = instruction.get('qubits', [])
+
+        if name in SINGLE_QUBIT_GATES and 'conditional' not in instruction:
+            qubit = qubits[0]
+            if qubit in pending:
+                pending[qubit].merge(index, name)
+            else:
+                pending[qubit] = FusedGate(qubit, index, name)
+            continue
+
+        if name == 'cx':
+            control, target = qubits
+            # Diagonal gates commute with the control of a cx
+            if control in pending and not pending[control].diagonal:
+                flush(control)
+            flush(target)
+        else:
+            for qubit in qubits:
+                flush(qubit)
+
+        plan.append(index)
+
+    for qubit in sorted(pending):
+        flush(qubit)
+
+    return plan
+
+
+def fuse_instructions(instructions):
+    """Merge consecutive single qubit gates on the same qubit.
+
+    The fused instructions are equal to the original ones up to a global
+    phase.
+
+    Args:
+        instructions (list): instructions as dictionaries, with ``name``,
+            ``qubits`` and optionally ``params`` keys.
+
+    Returns:
+        list: the fused instructions, as dictionaries.
+    """
+    return [entry.to_instruction(instructions) if isinstance(entry, FusedGate)
+            else instructions[entry]
+            for entry in fusion_plan(instructions)]
@@ -0,0 +1,343 @@
+"""
+Noise models, simulated with batches of Monte Carlo trajectories.
+
+A noisy circuit is run as many trajectories: pure states where the errors
+of every gate either happened or not, at random. The trajectories are
+stacked into one array, so every gate is applied to all of them with the
+reshapes of a single ``NumpyState``, and the errors of a gate are drawn for
+all of them at once. The shots are spread evenly across the trajectories,
+and each trajectory samples its share from its own final state.
+
+Readout errors don't need trajectories: they flip the bits of the sampled
+outcomes, with array operations over all the shots.
+"""
+
+import math
+
+import numpy as np
+
+from .compiler import DISPATCH_TABLE, OPCODES
+from .numpy_state import NumpyState
+from .simulatorerror import QCGPUSimulatorError
+
+# Number of trajectories a noisy experiment is run with, by default
+DEFAULT_TRAJECTORIES = 256
+
+
+class NoiseModel:
+    """Errors of the gates and of the measurements.
+
+    Gate errors hit every qubit a gate acts on, after the gate. They are
+    either given for all gates, or per gate name, in which case the gates
+    without an entry are ideal.
+
+    Attributes:
+        depolarizing (dict): probability of a depolarizing error, that is
+            of an ``x``, ``y`` or ``z`` error with equal probabilities, by
+            gate name, where ``'all'`` applies to every gate.
+        amplitude_damping (dict): damping probability ``gamma`` of the
+            amplitude damping channel, by gate name.
+        readout (tuple): the probabilities of reading 1 when the qubit is 0,
+            and 0 when it is 1, or ``None``.
+    """
+
+    def __init__(self, depolarizing=None, amplitude_damping=None, readout=None):
+        """
+        Args:
+            depolarizing (float or dict): the probability for every gate, or
+                a dictionary of probabilities by gate name.
+            amplitude_damping (float or dict): the damping probability for
+                every gate, or a dictionary of them by gate name.
+            readout (list): ``[p(1|0), p(0|1)]``, or ``None``.
+
+        Raises:
+            QCGPUSimulatorError: if a probability isn't between 0 and 1.
+        """
+        self.depolarizing = self._by_gate(depolarizing)
+        self.amplitude_damping = self._by_gate(amplitude_damping)
+        self.readout = tuple(float(value) for value in readout) if readout else None
+
+        probabilities = (list(self.depolarizing.values()) +
+                         list(self.amplitude_damping.values()) +
+                         list(self.readout or ()))
+        if not all(0 <= probability <= 1 for probability in probabilities):
+            raise QCGPUSimulatorError('Noise probabilities must be between 0 and 1')
+
+    @staticmethod
+    def _by_gate(errors):
+        if not errors:
+            return {}
+        if isinstance(errors, dict):
+            return {name: float(value) for name, value in errors.items() if value}
+        return {'all': float(errors)}
+
+    @classmethod
+    def from_dict(cls, noise):
+        """Create a noise model from a dictionary, as given in the options.
+
+        Args:
+            noise (dict): the ``depolarizing``, ``amplitude_damping`` and
+                ``readout`` arguments of the model.
+
+        Returns:
+            NoiseModel: the noise model.
+        """
+        return cls(noise.get('depolarizing'), noise.get('amplitude_damping'),
+                   noise.get('readout'))
+
+    def to_dict(self):
+        """The noise model as a dictionary, see ``from_dict``."""
+        return {'depolarizing': dict(self.depolarizing),
+                'amplitude_damping': dict(self.amplitude_damping),
+                'readout': list(self.readout) if self.readout else None}
+
+    @property
+    def has_gate_errors(self):
+        """Whether any gate has an error, so trajectories are needed."""
+        return bool(self.depolarizing or self.amplitude_damping)
+
+    def gate_errors(self, name):
+        """The errors of a gate.
+
+        Args:
+            name (str): the gate name.
+
+        Returns:
+            tuple: the depolarizing and damping probabilities.
+        """
+        return (self.depolarizing.get(name, self.depolarizing.get('all', 0.0)),
+                self.amplitude_damping.get(name, self.amplitude_damping.get('all', 0.0)))
+
+
+def get_noise_model(noise):
+    """Get the noise model of the ``noise_model`` option.
+
+    Args:
+        noise (NoiseModel or dict): the option value, or ``None``.
+
+    Returns:
+        NoiseModel: the noise model, or ``None`` if there is no noise.
+
+    Raises:
+        QCGPUSimulatorError: if the option isn't a noise model.
+    """
+    if noise is None or isinstance(noise, NoiseModel):
+        return noise
+    if isinstance(noise, dict):
+        return NoiseModel.from_dict(noise)
+    raise QCGPUSimulatorError('Unsupported noise model of type "{}"'.format(
+        type(noise).__name__))
+
+
+class TrajectoryBatch:
+    """A batch of trajectories, each a state vector.
+
+    Attributes:
+        num_qubits (int): the number of qubits.
+        size (int): the number of trajectories.
+        vectors (ndarray): the amplitudes, of shape ``(size, 2 ** num_qubits)``.
+        state (NumpyState): the gate methods, applied to every trajectory.
+    """
+
+    def __init__(self, num_qubits, size):
+        """
+        Args:
+            num_qubits (int): the number of qubits.
+            size (int): the number of trajectories.
+
+        Raises:
+            OverflowError: if the batch is too large.
+        """
+        self.num_qubits = num_qubits
+        self.size = size
+        try:
+            self.vectors = np.zeros((size, 2 ** num_qubits), dtype=np.complex128)
+        except (MemoryError, ValueError):
+            raise OverflowError('cannot allocate {} qubits'.format(num_qubits))
+        self.vectors[:, 0] = 1
+        self.state = NumpyState(num_qubits, vector=self.vectors.reshape(-1))
+
+    def _qubit_view(self, qubit):
+        """A view of the amplitudes, with the value of a qubit on axis 2."""
+        return self.vectors.reshape(self.size, -1, 2, 2 ** qubit)
+
+    def depolarize(self, qubit, probability, generator):
+        """Apply a random Pauli error to a qubit of some trajectories.
+
+        Args:
+            qubit (int): the qubit.
+            probability (float): the probability of an error.
+            generator (numpy.random.Generator): the source of randomness.
+        """
+        # Draws below the probability pick x, y or z, the others no error
+        errors = np.floor(generator.random(self.size) * 3 / probability)
+        view = self._qubit_view(qubit)
+
+        for error in range(3):
+            rows = np.flatnonzero(errors == error)
+            if not rows.size:
+                continue
+            zero = view[rows, :, 0]
+            one = view[rows, :, 1]
+            if error == 0:
+                view[rows, :, 0], view[rows, :, 1] = one, zero
+            elif error == 1:
+                view[rows, :, 0], view[rows, :, 1] = -1j * one, 1j * zero
+            else:
+                view[rows, :, 1] = -one
+
+    def damp(self, qubit, gamma, generator):
+        """Apply the amplitude damping channel to a qubit of every trajectory.
+
+        A trajectory decays to 0 with probability ``gamma`` times the
+        probability of the qubit being 1, and is otherwise renormalized
+        with less weight on 1.
+
+        Args:
+            qubit (int): the qubit.
+            gamma (float): the damping probability.
+            generator (numpy.random.Generator): the source of randomness.
+        """
+        view = self._qubit_view(qubit)
+        excited = np.sum(np.abs(view[:, :, 1]) ** 2, axis=(1, 2))
+        decayed = generator.random(self.size) < gamma * excited
+
+        rows = np.flatnonzero(decayed)
+        if rows.size:
+            norms = np.sqrt(excited[rows])[:, None, None]
+            view[rows, :, 0] = view[rows, :, 1] / norms
+            view[rows, :, 1] = 0
+
+        rows = np.flatnonzero(~decayed)
+        if rows.size:
+            view[rows, :, 1] *= math.sqrt(1 - gamma)
+            view[rows] /= np.sqrt(1 - gamma * excited[rows])[:, None, None, None]
+
+    def run(self, program, noise_model, generator):
+        """Apply a program to every trajectory, with the errors of its gates.
+
+        Args:
+            program (CompiledCircuit): the program, compiled without fusion,
+                so that the errors follow the gates of the circuit.
+            noise_model (NoiseModel): the errors.
+            generator (numpy.random.Generator): the source of randomness.
+        """
+        for opcode, qubits, params in program.steps():
+            DISPATCH_TABLE[opcode](self.state, qubits, params)
+
+            depolarizing, damping = noise_model.gate_errors(OPCODES[opcode])
+            for qubit in qubits:
+                if qubit < 0:
+                    break
+                if depolarizing:
+                    self.depolarize(qubit, depolarizing, generator)
+                if damping:
+                    self.damp(qubit, damping, generator)
+
+    def marginal_probabilities(self, qubits):
+        """The probabilities of the outcomes of measuring some qubits.
+
+        Args:
+            qubits (list): the measured qubits, where bit ``k`` of the
+                outcomes is ``qubits[k]``.
+
+        Returns:
+            ndarray: the ``float64`` probabilities, of shape
+                ``(size, 2 ** len(qubits))``.
+        """
+        num_qubits = self.num_qubits
+        tensor = (np.abs(self.vectors) ** 2).reshape((self.size,) + (2,) * num_qubits)
+        # Axis 0 is the trajectory, then the most significant qubit
+        kept = [num_qubits - qubit for qubit in reversed(qubits)]
+        summed = tuple(axis for axis in range(1, num_qubits + 1) if axis not in kept)
+        marginal = np.sum(tensor, axis=summed, dtype=np.float64)
+        order = [0] + [sorted(kept).index(axis) + 1 for axis in kept]
+        return np.transpose(marginal, order).reshape(self.size, -1)
+
+
+def sample_rows(probabilities, shares, generator):
+    """Draw outcomes from every row of a batch of distributions.
+
+    Args:
+        probabilities (ndarray): distributions of shape ``(rows, outcomes)``,
+            which are normalized.
+        shares (ndarray): the number of outcomes drawn from every row.
+        generator (numpy.random.Generator): the source of randomness.
+
+    Returns:
+        ndarray: the ``int64`` outcomes, the ones of row 0 first.
+    """
+    rows, num_outcomes = probabilities.shape
+    cdf = np.cumsum(probabilities / probabilities.sum(axis=1, keepdims=True), axis=1)
+    cdf[:, -1] = 1
+
+    # Row ``r`` covers [r, r + 1) of one sorted array, so all the rows are
+    # searched at once
+    flat = (cdf + np.arange(rows)[:, None]).reshape(-1)
+    drawn = np.repeat(np.arange(rows), shares)
+    positions = np.searchsorted(flat, drawn + generator.random(drawn.size), side='right')
+    return np.minimum(positions - drawn * num_outcomes, num_outcomes - 1).astype(np.int64)
+
+
+def apply_readout_error(outcomes, num_bits, readout, generator):
+    """Flip the bits of sampled outcomes with the readout error probabilities.
+
+    Args:
+        outcomes (ndarray): the ``int64`` outcomes.
+        num_bits (int): the number of measured bits of every outcome.
+        readout (tuple): the probabilities of reading 1 when the bit is 0,
+            and 0 when it is 1.
+        generator (numpy.random.Generator): the source of randomness.
+
+    Returns:
+        ndarray: the outcomes as read out.
+    """
+    positions = np.arange(num_bits, dtype=np.int64)
+    bits = (outcomes[:, None] >> positions) & 1
+    flips = generator.random(bits.shape) < np.where(bits, readout[1], readout[0])
+    return outcomes ^ np.sum(flips.astype(np.int64) << positions, axis=1)
+
+
+def sample_noisy(program, noise_model, num_qubits, qubits, shots, num_trajectories,
+                 generator, max_batch_memory):
+    """Sample the measurements of a noisy circuit from its trajectories.
+
+    Args:
+        program (CompiledCircuit): the program, compiled without fusion.
+        noise_model (NoiseModel): the errors.
+        num_qubits (int): the number of qubits.
+        qubits (list): the measured qubits, where bit ``k`` of the outcomes
+            is ``qubits[k]``.
+        shots (int): the number of shots.
+        num_trajectories (int): the number of trajectories, at most ``shots``.
+        generator (numpy.random.Generator): the source of randomness.
+        max_batch_memory (int): the memory of a batch of trajectories, in
+            bytes. Larger runs are split into several batches.
+
+    Returns:
+        ndarray: the ``int64`` outcome of every shot, in random order, with
+            readout errors.
+
+    Raises:
+        OverflowError: if a single trajectory doesn't fit in memory.
+    """
+    num_trajectories = max(1, min(num_trajectories, shots))
+    trajectory_bytes = 2 ** num_qubits * np.dtype(np.complex128).itemsize
+    batch_size = max(1, min(num_trajectories, max_batch_memory // trajectory_bytes))
+
+    shares = np.full(num_trajectories, shots // num_trajectories, dtype=np.int64)
+    shares[:shots % num_trajectories] += 1
+
+    samples = []
+    for start in range(0, num_trajectories, batch_size):
+        batch = TrajectoryBatch(num_qubits, min(batch_size, num_trajectories - start))
+        batch.run(program, noise_model, generator)
+        samples.append(sample_rows(batch.marginal_probabilities(qubits),
+                                   shares[start:start + batch.size], generator))
+    # The shots of a trajectory shouldn't be listed together in the memory
+    samples = np.concatenate(samples)
+    generator.shuffle(samples)
+
+    if noise_model.readout:
+        samples = apply_readout_error(samples, len(qubits), noise_model.readout, generator)
+    return samples
@@ -0,0 +1,204 @@
+"""
+A state vector in host memory, updated with NumPy.
+
+The state has the gate methods of ``qcgpu.State``, so compiled programs
+can run on it. It is the state of the numpy engine, and of every shard of
+the sharded engine.
+"""
+
+import cmath
+import math
+
+import numpy as np
+
+from .fusion import gate_matrix, u3_matrix
+
+_X = gate_matrix('x', [])
+_Y = gate_matrix('y', [])
+_H = gate_matrix('h', [])
+_S_PHASE = 1j
+_T_PHASE = cmath.exp(1j * math.pi / 4)
+
+# The Toffoli gate, with the target as the least significant qubit
+_CCX = np.eye(8, dtype=complex)[[0, 1, 2, 3, 4, 5, 7, 6]]
+
+
+class NumpyState:
+    """A state vector in host memory, with the gate methods of ``qcgpu.State``.
+
+    Qubit ``q`` is bit ``q`` of the amplitude index, as in ``qcgpu``. The
+    vector may also hold a batch of states one after the other, and every
+    gate is then applied to all of them at once.
+
+    Attributes:
+        num_qubits (int): the number of qubits.
+        vector (ndarray): the ``2 ** num_qubits`` amplitudes, or a multiple
+            of them for a batch of states.
+    """
+
+    def __init__(self, num_qubits, dtype=np.complex128, vector=None):
+        """
+        Args:
+            num_qubits (int): the number of qubits.
+            dtype (type): the type of the amplitudes.
+            vector (ndarray): if given, the state works on these amplitudes
+                in place, instead of allocating new ones in |0...0>.
+
+        Raises:
+            OverflowError: if the state is too large.
+        """
+        self.num_qubits = num_qubits
+        if vector is not None:
+            self.vector = vector
+            return
+
+        try:
+            self.vector = np.zeros(2 ** num_qubits, dtype=dtype)
+        except (MemoryError, ValueError):
+            raise OverflowError('cannot allocate {} qubits'.format(num_qubits))
+        self.vector[0] = 1
+
+    def apply_single(self, matrix, qubit):
+        """Apply a 2x2 matrix to a qubit."""
+        view = self.vector.reshape(-1, 2, 2 ** qubit)
+        view[...] = np.einsum('ij,ajb->aib', matrix, view)
+
+    def apply_phase(self, phase, qubit):
+        """Multiply the amplitudes where a qubit is 1 by a phase."""
+        self.vector.reshape(-1, 2, 2 ** qubit)[:, 1, :] *= phase
+
+    def apply_matrix(self, matrix, qubits):
+        """Apply a matrix to any number of qubits.
+
+        Args:
+            matrix (ndarray): a ``2 ** k`` square matrix, where ``qubits[0]``
+                is the least significant bit of the row and column indices.
+            qubits (list): the ``k`` qubits the matrix acts on.
+        """
+        num_qubits = self.num_qubits
+        count = len(qubits)
+        tensor = self.vector.reshape((-1,) + (2,) * num_qubits)
+        # Axis 0 of the tensor is the batch, then the most significant qubit
+        axes = [num_qubits - qubit for qubit in reversed(qubits)]
+
+        matrix = np.asarray(matrix).reshape((2,) * (2 * count))
+        result = np.tensordot(matrix, tensor, axes=(list(range(count, 2 * count)), axes))
+        tensor[...] = np.moveaxis(result, list(range(count)), axes)
+
+    def apply_diagonal(self, entries, qubits):
+        """Multiply every amplitude by an entry of a diagonal, in one pass.
+
+        Args:
+            entries (ndarray): the ``2 ** k`` entries of the diagonal, where
+                ``qubits[0]`` is the least significant bit of the index.
+            qubits (list): the ``k`` qubits the diagonal acts on.
+        """
+        num_qubits = self.num_qubits
+        count = len(qubits)
+        # Axis 0 of the tensor is the batch, then the most significant qubit
+        axes = [num_qubits - qubit for qubit in reversed(qubits)]
+        order = np.argsort(axes)
+
+        shape = [1] * (num_qubits + 1)
+        for axis in axes:
+            shape[axis] = 2
+        table = np.transpose(np.reshape(entries, (2,) * count), order).reshape(shape)
+        self.vector.reshape((-1,) + (2,) * num_qubits)[...] *= table
+
+    def collapse(self, qubit, outcome, probability):
+        """Project the state onto an outcome of a qubit, and renormalize it.
+
+        Args:
+            qubit (int): the measured qubit.
+            outcome (int): the measured value, 0 or 1.
+            probability (float): the probability of the outcome.
+        """
+        view = self.vector.reshape(-1, 2, 2 ** qubit)
+        view[:, 1 - outcome, :] = 0
+        view[:, outcome, :] /= math.sqrt(probability)
+
+    def _pair_view(self, first, second):
+        """A view of the amplitudes, with the values of two qubits on axes 1 and 3."""
+        high, low = max(first, second), min(first, second)
+        return self.vector.reshape(-1, 2, 2 ** (high - low - 1), 2, 2 ** low)
+
+    def _controlled_view(self, control, target):
+        """A view of the amplitudes where ``control`` is 1, and the target axis."""
+        view = self._pair_view(control, target)
+        if control > target:
+            return view[:, 1], 2
+        return view[:, :, :, 1], 1
+
+    def apply_controlled_phase(self, phase, control, target):
+        """Multiply the amplitudes where both qubits are 1 by a phase."""
+        self._pair_view(control, target)[:, 1, :, 1, :] *= phase
+
+    def u(self, target, theta, phi, lam):
+        self.apply_single(u3_matrix(theta, phi, lam), target)
+
+    def u2(self, target, phi, lam):
+        self.apply_single(u3_matrix(math.pi / 2, phi, lam), target)
+
+    def u1(self, target, lam):
+        self.apply_phase(cmath.exp(1j * lam), target)
+
+    def cx(self, control, target):
+        view, axis = self._controlled_view(control, target)
+        view[...] = np.flip(view, axis=axis).copy()
+
+    def cz(self, control, target):
+        self.apply_controlled_phase(-1, control, target)
+
+    def cu1(self, control, target, lam):
+        self.apply_controlled_phase(cmath.exp(1j * lam), control, target)
+
+    def swap(self, first, second):
+        view = self._pair_view(first, second)
+        view[:, 0, :, 1], view[:, 1, :, 0] = view[:, 1, :, 0].copy(), view[:, 0, :, 1].copy()
+
+    def ccx(self, control, control2, target):
+        self.apply_matrix(_CCX, [target, control, control2])
+
+    def rz(self, target, phi):
+        self.apply_single(gate_matrix('rz', [phi]), target)
+
+    def rx(self, target, theta):
+        self.apply_single(gate_matrix('rx', [theta]), target)
+
+    def ry(self, target, theta):
+        self.apply_single(gate_matrix('ry', [theta]), target)
+
+    def unitary(self, qubits, matrix):
+        if len(qubits) == 1:
+            self.apply_single(matrix, qubits[0])
+        else:
+            self.apply_matrix(matrix, qubits)
+
+    def diagonal(self, qubits, entries):
+        self.apply_diagonal(entries, qubits)
+
+    def h(self, target):
+        self.apply_single(_H, target)
+
+    def x(self, target):
+        self.apply_single(_X, target)
+
+    def y(self, target):
+        self.apply_single(_Y, target)
+
+    def z(self, target):
+        self.apply_phase(-1, target)
+
+    def s(self, target):
+        self.apply_phase(_S_PHASE, target)
+
+    def t(self, target):
+        self.apply_phase(_T_PHASE, target)
+
+    def amplitudes(self):
+        """A copy of the amplitudes."""
+        return self.vector.copy()
+
+    def probabilities(self):
+        """The probability of every basis state."""
+        return np.abs(self.vector) ** 2
@@ -0,0 +1,125 @@
+"""
+Expectation values of observables.
+
+An observable is a sum of Pauli strings, given as a list of
+``[coefficient, label]`` pairs. A label has one of ``I``, ``X``, ``Y`` and
+``Z`` for every qubit, with qubit 0 last, as in qiskit. Strings are kept as
+a pair of bit masks ``(x, z)``, see ``engines.pauli_expectations``.
+
+The expectation values are reduced by the engine, where the state is, so
+only a few numbers are copied back rather than the amplitudes. Every
+distinct string of a list of observables is reduced once, and strings
+with the same X part, such as all the diagonal strings of ``I`` and ``Z``,
+are reduced together in one pass over the state.
+"""
+
+from .simulatorerror import QCGPUSimulatorError
+
+# The (x, z) bits of every single qubit Pauli
+PAULI_BITS = {'I': (0, 0), 'X': (1, 0), 'Y': (1, 1), 'Z': (0, 1)}
+
+
+def parse_pauli(label, num_qubits):
+    """Get the bit masks of a Pauli string.
+
+    Args:
+        label (str): the Pauli of every qubit, qubit 0 last.
+        num_qubits (int): the width of the experiment.
+
+    Returns:
+        tuple: the ``(x, z)`` bit masks of the string.
+
+    Raises:
+        QCGPUSimulatorError: if the label isn't a Pauli string on the qubits
+            of the experiment.
+    """
+    if len(label) != num_qubits or any(pauli not in PAULI_BITS for pauli in label):
+        raise QCGPUSimulatorError(
+            'Invalid Pauli string "{}" on {} qubits'.format(label, num_qubits))
+
+    x = z = 0
+    for qubit, pauli in enumerate(reversed(label)):
+        x_bit, z_bit = PAULI_BITS[pauli]
+        x |= x_bit << qubit
+        z |= z_bit << qubit
+    return x, z
+
+
+def parse_observables(observables, num_qubits):
+    """Parse the ``observables`` option.
+
+    Args:
+        observables (list): the observables, each a list of
+            ``[coefficient, label]`` pairs.
+        num_qubits (int): the width of the experiment.
+
+    Returns:
+        list: the observables, each a list of ``(coefficient, (x, z))``.
+
+    Raises:
+        QCGPUSimulatorError: if a label isn't a Pauli string on the qubits
+            of the experiment.
+    """
+    return [[(complex(coefficient), parse_pauli(label, num_qubits))
+             for coefficient, label in observable]
+            for observable in observables]
+
+
+def restrict_pauli(pauli, qubit_map):
+    """Restrict a Pauli string to some of its qubits.
+
+    Args:
+        pauli (tuple): the ``(x, z)`` bit masks of the string.
+        qubit_map (dict): the position of every kept qubit.
+
+    Returns:
+        tuple: the ``(x, z)`` bit masks of the string on the kept qubits.
+    """
+    x, z = pauli
+    local_x = local_z = 0
+    for qubit, position in qubit_map.items():
+        local_x |= ((x >> qubit) & 1) << position
+        local_z |= ((z >> qubit) & 1) << position
+    return local_x, local_z
+
+
+def expectation_values(engine, sims, clusters, observables):
+    """Compute the expectation values of observables.
+
+    The expectation value of a string on a product of cluster states is
+    the product of the expectation values of its restrictions to every
+    cluster, so the product state is never formed.
+
+    Args:
+        engine (BaseEngine): the engine of the states.
+        sims (list): the state of the experiment, or of every cluster.
+        clusters (list): the ``RegisterReduction`` of every cluster, or an
+            empty list if the experiment isn't split.
+        observables (list): the parsed observables, see
+            ``parse_observables``.
+
+    Returns:
+        list: the real part of the expectation value of every observable,
+            which is the expectation value of a Hermitian observable.
+    """
+    paulis = sorted(set(pauli for observable in observables for _, pauli in observable))
+    values = dict.fromkeys(paulis, 1.0)
+
+    for index, sim in enumerate(sims):
+        if clusters:
+            local = {pauli: restrict_pauli(pauli, clusters[index].qubit_map)
+                     for pauli in paulis}
+        else:
+            local = {pauli: pauli for pauli in paulis}
+
+        # The identity has an expectation value of 1
+        distinct = sorted(set(local.values()) - {(0, 0)})
+        if not distinct:
+            continue
+        local_values = dict(zip(distinct, engine.pauli_expectations(sim, distinct)))
+        for pauli in paulis:
+            if local[pauli] != (0, 0):
+                values[pauli] *= local_values[local[pauli]]
+
+    return [float(sum(coefficient * values[pauli] for coefficient, pauli in observable).real)
+            for observable in observables]
@@ -9,7 +9,8 @@ Advantages:
    to parallel computation.
 2. This backend works on every device that has an OpenCL implementation,
    which includes Macbooks, gaming computers, Nvidia and AMD cards etc.
-3. Supports u gates.
+3. Supports u gates, and controlled-phase, swap, Toffoli, rotation and
+   unitary gates without decomposing them.
 
 Limitations:
 1. Memory on the GPU is usually a lot less than that of a full machine,
@@ -23,7 +24,6 @@ Limitations:
 import uuid
 import logging
 import time
-from collections import Counter
 
 import numpy as np
 
@@ -31,10 +31,19 @@ from qiskit.providers import BaseBackend
 from qiskit.result import Result
 from qiskit.providers.models import BackendConfiguration
 
-import qcgpu
-
 from .job import QCGPUJob
+from .engines import ENGINES, candidate_engines, select_engine, calibrate
+from .compiler import CompiledCircuitCache, can_sample, parameter_slots, assign_parameters
+from .fusion import count_gates
+from .noise import DEFAULT_TRAJECTORIES, apply_readout_error, get_noise_model, sample_noisy
+from .reduction import combine_counts, combine_samples, reduce_register, split_clusters
 from .simulatorerror import QCGPUSimulatorError
+from .sampler import Sampler, choose_method
+from .states import StatePool
+from .trajectories import (get_bfunc, get_condition, merge_samples, run_trajectories,
+                           split_instructions)
+from .utils import (set_backend_options, get_option, run_experiments, worker_timing,
+                    get_parameter_sweep)
 
 logger = logging.getLogger(__name__)
 
@@ -52,7 +61,7 @@ class QCGPUQasmSimulator(BaseBackend):
                              'url': 'https://qcgpu.github.io',
                              'simulator': True,
                              'local': True,
-                             'conditional': False,
+                             'conditional': True,
                              'open_pulse': False,
                              'memory': True,
                              'max_shots': 65536,
@@ -68,7 +77,15 @@ class QCGPUQasmSimulator(BaseBackend):
                                              'z',
                                              'h',
                                              's',
-                                             't'],
+                                             't',
+                                             'cz',
+                                             'cu1',
+                                             'swap',
+                                             'ccx',
+                                             'rz',
+                                             'rx',
+                                             'ry',
+                                             'unitary'],
                              'gates': [{'name': 'u1',
                                         'parameters': ['lambda'],
                                         'qasm_def': 'gate u1(lambda) q { U(0,0,lambda) q; }'},
@@ -106,57 +123,112 @@ class QCGPUQasmSimulator(BaseBackend):
                                        {'name': 't',
                                         'parameters': ['a'],
                                         'qasm_def': 'gate t a { u1(pi/4) a; }'},
+                                       {'name': 'cz',
+                                        'parameters': ['a',
+                                                       'b'],
+                                        'qasm_def': 'gate cz a,b { h b; cx a,b; h b; }'},
+                                       {'name': 'cu1',
+                                        'parameters': ['lambda'],
+                                        'qasm_def': 'gate cu1(lambda) a,b { u1(lambda/2) a; '
+                                                    'cx a,b; u1(-lambda/2) b; cx a,b; '
+                                                    'u1(lambda/2) b; }'},
+                                       {'name': 'swap',
+                                        'parameters': ['a',
+                                                       'b'],
+                                        'qasm_def': 'gate swap a,b { cx a,b; cx b,a; cx a,b; }'},
+                                       {'name': 'ccx',
+                                        'parameters': ['a',
+                                                       'b',
+                                                       'c'],
+                                        'qasm_def': 'gate ccx a,b,c { h c; cx b,c; tdg c; '
+                                                    'cx a,c; t c; cx b,c; tdg c; cx a,c; t b; '
+                                                    't c; h c; cx a,b; t a; tdg b; cx a,b; }'},
+                                       {'name': 'rz',
+                                        'parameters': ['phi'],
+                                        'qasm_def': 'gate rz(phi) a { u1(phi) a; }'},
+                                       {'name': 'rx',
+                                        'parameters': ['theta'],
+                                        'qasm_def': 'gate rx(theta) a { u3(theta,-pi/2,pi/2) a; }'},
+                                       {'name': 'ry',
+                                        'parameters': ['theta'],
+                                        'qasm_def': 'gate ry(theta) a { u3(theta,0,0) a; }'},
+                                       {'name': 'unitary',
+                                        'parameters': ['matrix'],
+                                        'qasm_def': 'unitary(matrix) q1, q2,...'},
                                        ]}
 
+    COMPILED_CACHE_SIZE = 128  # Number of compiled experiments kept
+    STATE_POOL_MAX_MEMORY = 2 ** 30  # Bytes of idle device states kept for reuse
+    NOISE_BATCH_MAX_MEMORY = 2 ** 28  # Bytes of a batch of noisy trajectories
+
+    DEFAULT_OPTIONS = {'engine': 'auto',
+                       'max_parallel_experiments': 1,
+                       'fusion_enable': False,
+                       'sharded_enable': False,
+                       'parameter_sweep': None,
+                       'noise_model': None,
+                       'noise_trajectories': DEFAULT_TRAJECTORIES}
+
     def __init__(self, configuration=None, provider=None):
         configuration = configuration or BackendConfiguration.from_dict(
             self.DEFAULT_CONFIGURATION)
         super().__init__(configuration=configuration, provider=provider)
 
         self._configuration = configuration
-        self._number_of_qubits = None
-        self._number_of_cbits = None
-        self._statevector = None
-        self._results = {}
-        self._shots = {}
-        self._local_random = np.random.RandomState()
-        self._sample_measure = False
         self._chop_threshold = 15  # chop to 10^-15
+        self._compiled_cache = CompiledCircuitCache(self.COMPILED_CACHE_SIZE)
+        self._state_pool = StatePool(self.STATE_POOL_MAX_MEMORY)
 
     #@profile
-    def run(self, qobj):
+    def run(self, qobj, backend_options=None):
         """Run qobj asynchronously.
 
         Args:
             qobj (Qobj): payload of the experiment
+            backend_options (dict): options for the backend, added to the
+                qobj config. See ``DEFAULT_OPTIONS`` for the supported options.
 
         Returns:
             QCGPUJob: derived from BaseJob
         """
-        qcgpu.backend._create_context()
+        set_backend_options(qobj, backend_options)
 
         job_id = str(uuid.uuid4())
-        job = QCGPUJob(self, job_id, self._run_job(job_id, qobj), qobj)
+        job = QCGPUJob(self, job_id, self._run_job, qobj)
+        job.submit()
         return job
+
     #@profile
-    def _run_job(self, job_id, qobj):
+    def _run_job(self, job_id, qobj, cancel_event=None):
         """Run experiments in qobj
 
+        Up to ``max_parallel_experiments`` experiments are run at once.
+
         Args:
             job_id (str): unique id for the job.
             qobj (Qobj): job description
+            cancel_event (threading.Event): when set, the job stops before
+                running the next experiment.
 
         Returns:
             Result: Result object
+
+        Raises:
+            CancelledError: if the job was cancelled while running.
         """
-        self._shots = qobj.config.shots
-        self._memory = qobj.config.memory
-        self._qobj_config = qobj.config
-        results = []
+        max_parallel = get_option(qobj.config, 'max_parallel_experiments',
+                                  self.DEFAULT_OPTIONS)
+
+        # Seeds are picked in experiment order, so they don't depend on
+        # which worker runs first
+        seeds = [self._get_seed(experiment, qobj.config)
+                 for experiment in qobj.experiments]
 
         start = time.time()
-        for experiment in qobj.experiments:
-            results.append(self.run_experiment(experiment))
+        results = run_experiments(
+            lambda index, experiment: self.run_experiment(experiment, qobj.config,
+                                                          seeds[index]),
+            qobj.experiments, max_parallel, cancel_event)
         end = time.time()
 
         result = {
@@ -174,196 +246,438 @@ class QCGPUQasmSimulator(BaseBackend):
         return Result.from_dict(result)
 
     #@profile
-    def run_experiment(self, experiment):
+    def run_experiment(self, experiment, qobj_config, seed=None):
         """Run an experiment (circuit) and return a single experiment result.
 
+        All of the experiment state is kept local, so that several jobs can
+        run on the same backend at once.
+
+        When the ``parameter_sweep`` option is set, the experiment is run
+        once for every row of parameter values, and the result holds the
+        ``sweep_counts`` (and ``sweep_memory``) of every row instead of
+        ``counts`` and ``memory``.
+
+        Experiments with measurements or resets before their last gate, or
+        with conditional operations, are run as trajectories, see
+        ``trajectories``, and the number of distinct trajectories of every
+        run is added to the metadata.
+
+        The experiment is run on the qubits its counts depend on, see
+        ``reduction``, and the size of the reduction is added to the metadata.
+        When all the measurements are at the end, clusters of qubits which
+        never share a gate are simulated apart and their samples combined,
+        and the width of every cluster is added to the metadata.
+
+        With a ``noise_model`` option with gate errors, the experiment is
+        run as ``noise_trajectories`` Monte Carlo trajectories in host
+        memory, see ``noise``. Readout errors are applied to the samples.
+
         Args:
             experiment (QobjExperiment): experiment from qobj experiments list
+            qobj_config (QobjConfig): configuration of the qobj the
+                experiment belongs to
+            seed (int): seed for sampling, taken from the configs when not given
 
         Returns:
-            dict: A dictionary of results.
             dict: A result dictionary
 
         Raises:
             QCGPUSimulatorError: If the number of qubits is too large, or another
                 error occurs during execution.
         """
-        self._number_of_qubits = experiment.header.n_qubits
-        self._number_of_cbits = experiment.header.memory_slots
-        self._classical_state = 0
-        self._statevector = 0
-
-        if hasattr(experiment.config, 'seed'):
-            seed = experiment.config.seed
-        elif hasattr(self._qobj_config, 'seed'):
-            seed = self._qobj_config.seed
-        else:
-            # For compatibility on Windows force dyte to be int32
-            # and set the maximum value to be (2 ** 31) - 1
-            seed = np.random.randint(2147483647, dtype='int32')
-        self._local_random.seed(seed)
-
-        self._can_sample(experiment)
+        number_of_cbits = experiment.header.memory_slots
+        shots = qobj_config.shots
+        memory = getattr(qobj_config, 'memory', False)
 
-        if not self._sample_measure:
-            raise QCGPUSimulatorError('Measurements are only supported at the end')
+        if seed is None:
+            seed = self._get_seed(experiment, qobj_config)
+        local_random = np.random.default_rng(seed)
 
+        qobj_experiment = experiment
         experiment = experiment.to_dict()
-        # qcgpu.backend.create_context()
-
-        samples = []
+        # Idle qubits, and gates outside the light cone of the measurements,
+        # are dropped. Sweeps are bound to the original instructions.
+        original_instructions = experiment['instructions']
+        reduction = reduce_register(original_instructions, experiment['header']['n_qubits'],
+                                    light_cone=can_sample(original_instructions))
+        instructions = reduction.apply(original_instructions)
+        number_of_qubits = reduction.num_qubits
+
+        noise_model = get_noise_model(get_option(qobj_config, 'noise_model',
+                                                 self.DEFAULT_OPTIONS))
+        noisy = noise_model is not None and noise_model.has_gate_errors
+
+        # Errors follow the gates of the circuit, so they aren't fused
+        fusion = {'enabled': get_option(qobj_config, 'fusion_enable',
+                                        self.DEFAULT_OPTIONS) and not noisy,
+                  'gates_before': count_gates(instructions)}
+        program, cache_hit = self._compiled_cache.get(instructions, fusion['enabled'])
+        fusion['gates_after'] = len(program)
+
+        # Circuits with measurements or resets before their last gate, or
+        # with conditional operations, are run as grouped trajectories
+        branched = not self._can_sample(experiment, program)
+        if branched and noise_model is not None:
+            raise QCGPUSimulatorError(
+                'Noise models need all measurements at the end, in circuit "{}"'.format(
+                    experiment['header']['name']))
+
+        slots = parameter_slots(original_instructions)
+        sweep = get_parameter_sweep(qobj_experiment, qobj_config, slots)
+
+        # Qubits which never interact are sampled independently
+        clusters = []
+        cluster_programs = []
+        if not branched and not noisy:
+            clusters = split_clusters(instructions, number_of_qubits)
+            if len(clusters) > 1:
+                cluster_programs = [
+                    self._compiled_cache.get(cluster.apply(instructions), fusion['enabled'])[0]
+                    for cluster in clusters]
+                fusion['gates_after'] = sum(len(cluster_program)
+                                            for cluster_program in cluster_programs)
+            else:
+                clusters = []
 
         start = time.time()
 
-        try:
-            sim = qcgpu.State(self._number_of_qubits)
-        except OverflowError:
-            raise QCGPUSimulatorError('too many qubits')
-
-        for operation in experiment['instructions']:
-            params = operation.get('params', [])
-            name = operation['name']
-
-            if name == 'id':
-                logger.info('Identity gates are ignored.')
-            elif name == 'barrier':
-                logger.info('Barrier gates are ignored.')
-            elif name == 'u3':
-                sim.u(operation['qubits'][0], *params)
-            elif name == 'u2':
-                sim.u2(operation['qubits'][0], *params)
-            elif name == 'u1':
-                sim.u1(operation['qubits'][0], *params)
-            elif name == 'cx':
-                sim.cx(*operation['qubits'])
-            elif name == 'h':
-                sim.h(operation['qubits'][0])
-            elif name == 'x':
-                sim.x(operation['qubits'][0])
-            elif name == 'y':
-                sim.y(operation['qubits'][0])
-            elif name == 'z':
-                sim.z(operation['qubits'][0])
-            elif name == 's':
-                sim.s(operation['qubits'][0])
-            elif name == 't':
-                sim.t(operation['qubits'][0])
-            elif name == 'measure':
-                samples.append((operation['qubits'][0], operation['memory'][0]))
-
-        if self._number_of_cbits > 0:
-            memory = self._add_sample_measure(samples, sim, self._shots)
+        engine_option = get_option(qobj_config, 'engine', self.DEFAULT_OPTIONS)
+        if noisy:
+            # The trajectories are batched in host memory
+            engine = ENGINES['numpy']
+            engine_selection = {'option': engine_option,
+                                'reason': 'noisy trajectories are batched on the host'}
+            sims = []
         else:
-            memory = []
+            widths = [cluster.num_qubits for cluster in clusters] or [number_of_qubits]
+            engine, engine_selection = select_engine(
+                engine_option, max(widths), len(program),
+                get_option(qobj_config, 'sharded_enable', self.DEFAULT_OPTIONS))
+            sims = []
+            try:
+                for width in widths:
+                    sims.append(self._state_pool.acquire(engine, width))
+            except OverflowError:
+                for state in sims:
+                    self._state_pool.release(engine, state)
+                raise QCGPUSimulatorError('too many qubits')
+        sim = sims[0] if sims else None
+
+        readout = noise_model.readout if noise_model is not None else None
+
+        def measure(state, measure_params, count, register=0):
+            if number_of_cbits == 0:
+                return {}, []
+            measured_qubits = sorted(set(qubit for qubit, _ in measure_params))
+            probabilities = engine.marginal_probabilities(state, measured_qubits)
+            sampler = Sampler(probabilities, choose_method(len(probabilities), count))
+            samples = None
+            if readout:
+                samples = apply_readout_error(sampler.sample(local_random, count),
+                                              len(measured_qubits), readout, local_random)
+            return self._add_sample_measure(measure_params, sampler, number_of_cbits,
+                                            count, local_random, memory, register, samples)
+
+        def sample_clusters(bound_instructions, measure_params):
+            if number_of_cbits == 0:
+                return {}, []
+            samplers = []
+            widths = []
+            for cluster, cluster_program, state in zip(clusters, cluster_programs, sims):
+                if sweep is not None:
+                    cluster_program = cluster_program.bind(cluster.apply(bound_instructions))
+                cluster_program.run(state)
+                measured_qubits = sorted(set(qubit for qubit, _ in cluster_program.measurements))
+                probabilities = engine.marginal_probabilities(state, measured_qubits)
+                samplers.append(Sampler(probabilities, choose_method(len(probabilities), shots)))
+                widths.append(len(measured_qubits))
+            measured_qubits = sorted(set(qubit for qubit, _ in measure_params))
+
+            if not memory and not readout:
+                return self._add_sample_measure(
+                    measure_params, None, number_of_cbits, shots, local_random, memory,
+                    drawn_counts=combine_counts(clusters, samplers, measured_qubits, shots,
+                                                local_random))
+
+            samples = []
+            for sampler, width in zip(samplers, widths):
+                cluster_samples = sampler.sample(local_random, shots)
+                if readout:
+                    cluster_samples = apply_readout_error(cluster_samples, width, readout,
+                                                          local_random)
+                samples.append(cluster_samples)
+            return self._add_sample_measure(measure_params, None, number_of_cbits, shots,
+                                            local_random, memory,
+                                            samples=combine_samples(clusters, samples,
+                                                                    measured_qubits))
+
+        trajectories = []
+        num_trajectories = get_option(qobj_config, 'noise_trajectories', self.DEFAULT_OPTIONS)
+
+        def execute(bound_instructions, bound_program):
+            if noisy:
+                if number_of_cbits == 0:
+                    return {}, []
+                measure_params = bound_program.measurements
+                measured_qubits = sorted(set(qubit for qubit, _ in measure_params))
+                try:
+                    samples = sample_noisy(bound_program, noise_model, number_of_qubits,
+                                           measured_qubits, shots, num_trajectories,
+                                           local_random, self.NOISE_BATCH_MAX_MEMORY)
+                except OverflowError:
+                    raise QCGPUSimulatorError('too many qubits')
+                return self._add_sample_measure(measure_params, None, number_of_cbits,
+                                                shots, local_random, memory, samples=samples)
+
+            if clusters:
+                return sample_clusters(bound_instructions, bound_program.measurements)
+
+            if not branched:
+                bound_program.run(sim)
+                return measure(sim, bound_program.measurements, shots)
+
+            operations, final = self._trajectory_operations(bound_instructions,
+                                                            fusion['enabled'])
+            final_measurements = [(instruction['qubits'][0], instruction['memory'][0])
+                                  for instruction in final]
+            # The register bits of the conditions come after the memory
+            memory_mask = (1 << number_of_cbits) - 1
+            samples = run_trajectories(
+                engine, self._state_pool, sim, operations, shots, local_random,
+                lambda state, count, register: measure(state, final_measurements,
+                                                       count, register & memory_mask))
+            trajectories.append(len(samples))
+            return merge_samples(samples, memory, local_random)
 
-        end = time.time()
-
-        # amps = sim.amplitudes().round(self._chop_threshold)
-        # amps = np.stack((amps.real, amps.imag), axis=-1)
-
-        data = {'counts': dict(Counter(memory))}
+        try:
+            if sweep is None:
+                counts, memory_values = execute(instructions, program)
+
+                data = {'counts': counts}
+                if memory:
+                    data['memory'] = memory_values
+            else:
+                # The template is rebound for every row, reusing the same state
+                data = {'sweep_counts': []}
+                if memory:
+                    data['sweep_memory'] = []
+
+                for row, values in enumerate(sweep):
+                    if row:
+                        for state in sims:
+                            engine.reset_state(state)
+                    bound_instructions = reduction.apply(
+                        assign_parameters(original_instructions, slots, values))
+                    counts, memory_values = execute(bound_instructions,
+                                                    program.bind(bound_instructions))
+
+                    data['sweep_counts'].append(counts)
+                    if memory:
+                        data['sweep_memory'].append(memory_values)
+        finally:
+            for state in sims:
+                self._state_pool.release(engine, state)
 
-        if self._memory:
-            data['memory'] = memory
+        end = time.time()
 
         return {
             'name': experiment['header']['name'],
-            'shots': self._shots,
+            'shots': shots,
             'data': data,
             'seed': seed,
             'status': 'DONE',
             'success': True,
             'time_taken': (end - start),
-            'header': experiment['header']
+            'header': experiment['header'],
+            'metadata': dict(worker_timing(start, end), fusion=fusion,
+                             compiled_cache_hit=cache_hit, engine=engine.name,
+                             engine_selection=engine_selection,
+                             reduction=reduction.info(),
+                             clusters=[cluster.num_qubits for cluster in clusters] or None,
+                             trajectories=trajectories or None,
+                             noise_trajectories=(min(num_trajectories, shots)
+                                                 if noisy else None))
         }
 
+    @staticmethod
+    def _get_seed(experiment, qobj_config):
+        """Get the sampling seed of an experiment.
+
+        Args:
+            experiment (QobjExperiment): a qobj experiment
+            qobj_config (QobjConfig): configuration of the qobj
+
+        Returns:
+            int: the seed from the experiment or qobj config, or a random one.
+        """
+        if hasattr(experiment.config, 'seed'):
+            return experiment.config.seed
+        if hasattr(qobj_config, 'seed'):
+            return qobj_config.seed
+        # For compatibility on Windows force dyte to be int32
+        # and set the maximum value to be (2 ** 31) - 1
+        return np.random.randint(2147483647, dtype='int32')
+
     #@profile
-    def _add_sample_measure(self, measure_params, sim, num_samples):
+    @staticmethod
+    def _add_sample_measure(measure_params, sampler, number_of_cbits, num_samples,
+                            local_random, memory, register=0, samples=None,
+                            drawn_counts=None):
         """Generate memory samples from current statevector.
-        Taken almost straight from the terra source code.
+        Taken almost straight from the terra source code, but with the
+        per-shot conversion to classical registers done with array operations.
+        When memory is not requested, counts are drawn directly from a
+        multinomial distribution over the measured outcomes.
 
         Args:
             measure_params (list): List of (qubit, clbit) values for
                                    measure instructions to sample.
+            sampler (Sampler): sampler of the outcomes of the measured
+                qubits, where bit ``k`` of an outcome is the k-th smallest
+                measured qubit.
+            number_of_cbits (int): The number of classical memory slots.
             num_samples (int): The number of memory samples to generate.
+            local_random (Generator): seeded generator of the experiment.
+            memory (bool): whether per-shot memory should be returned.
+            register (int): value of the classical register before the
+                measurements, from earlier measurements.
+            samples (ndarray): outcomes which were already drawn, for
+                instance with readout errors, used instead of ``sampler``.
+            drawn_counts (tuple): the distinct outcomes and their counts,
+                which were already drawn, used instead of ``sampler`` when
+                memory is not requested.
+        Returns:
+            tuple: The counts dictionary, and a list of memory values in hex
+                format (``None`` if memory was not requested).
+        """
+        measured_qubits = sorted(set(qubit for qubit, clbit in measure_params))
+
+        if drawn_counts is not None:
+            outcomes, outcome_counts = drawn_counts
+        elif memory or samples is not None:
+            # Generate samples on measured qubits
+            if samples is None:
+                samples = sampler.sample(local_random, num_samples)
+
+            # Only the distinct outcomes are converted to classical registers
+            outcomes, inverse, outcome_counts = np.unique(samples, return_inverse=True,
+                                                          return_counts=True)
+        else:
+            # Without memory the counts can be drawn in one go, which costs
+            # O(2 ** num_measured) instead of O(num_samples)
+            outcome_counts = sampler.counts(local_random, num_samples)
+            outcomes = np.flatnonzero(outcome_counts)
+            outcome_counts = outcome_counts[outcomes]
+
+        # Registers wider than an int64 fall back to Python integers
+        dtype = np.int64 if number_of_cbits < 63 else object
+        outcomes = outcomes.astype(dtype)
+        registers = np.full(outcomes.shape, register, dtype=dtype)
+
+        for qubit, cbit in measure_params:
+            # Bit ``k`` of a sample is the k-th smallest measured qubit
+            position = measured_qubits.index(qubit)
+            qubit_outcome = (outcomes >> position) & 1
+            registers = (registers & ~(1 << cbit)) | (qubit_outcome << cbit)
+
+        hex_outcomes = [hex(int(register)) for register in registers]
+
+        counts = {}
+        for key, count in zip(hex_outcomes, outcome_counts.tolist()):
+            counts[key] = counts.get(key, 0) + count
+
+        memory_values = None
+        if memory:
+            memory_values = np.array(hex_outcomes, dtype=object)[inverse.ravel()].tolist()
+
+        return counts, memory_values
+
+    def _trajectory_operations(self, instructions, fusion):
+        """Compile the operations of an experiment run as trajectories.
+
+        Args:
+            instructions (list): instructions as dictionaries.
+            fusion (bool): whether to fuse the gates.
+
         Returns:
-            list: A list of memory values in hex format.
+            tuple: the operations for ``run_trajectories``, and the final
+                measurement instructions.
         """
-        probabilities = np.reshape(sim.probabilities(), self._number_of_qubits * [2])
-
-        # Get unique qubits that are actually measured
-        measured_qubits = list(set([qubit for qubit, clbit in measure_params]))
-        num_measured = len(measured_qubits)
-
-
-        # Axis for numpy.sum to compute probabilities
-        axis = list(range(self._number_of_qubits))
-
-        for qubit in reversed(measured_qubits):
-            # Remove from largest qubit to smallest so list position is correct
-            # with respect to position from end of the list
-            axis.remove(self._number_of_qubits - 1 - qubit)
-        
-        
-        probabilities = np.reshape(np.sum(probabilities,
-                                          axis=tuple(axis)),
-                                   2 ** num_measured)
-
-        # Normalize probabilities when the ammount do not sum 1 because of numeric error
-        normalized_probabilitites = []
-        prob_sum = sum(probabilities)
-
-        for i in probabilities:
-            normalized_probabilitites.append(i/prob_sum)
-
-        # Generate samples on measured qubits
-        samples = self._local_random.choice(range(2 ** num_measured),
-                                            num_samples, p=normalized_probabilitites)
-        # Convert to bit-strings
-        memory = []
-        for sample in samples:
-            classical_state = self._classical_state
-            for qubit, cbit in measure_params:
-                qubit_outcome = int((sample & (1 << qubit)) >> qubit)
-                bit = 1 << cbit
-                classical_state = (classical_state & (~bit)) | (qubit_outcome << cbit)
-            value = bin(classical_state)[2:]
-            memory.append(hex(int(value, 2)))
-        return memory
+        operations, final = split_instructions(instructions)
+
+        compiled = []
+        for name, operation in operations:
+            if name == 'gates':
+                segment, _ = self._compiled_cache.get(operation, fusion)
+                compiled.append(('program', segment))
+                continue
+
+            if name == 'gate':
+                gate, _ = self._compiled_cache.get([operation], False)
+                step = ('program', gate)
+            elif name == 'measure':
+                step = (name, operation['qubits'][0], operation['memory'][0])
+            elif name == 'bfunc':
+                step = (name,) + get_bfunc(operation)
+            else:
+                step = (name, operation['qubits'][0])
+
+            if 'conditional' in operation:
+                step = ('if',) + get_condition(operation) + (step,)
+            compiled.append(step)
+
+        return compiled, final
 
     #@profile
-    def _can_sample(self, experiment):
+    @staticmethod
+    def _can_sample(experiment, program):
         """Determine if sampling can be used for an experiment
 
         Args:
-            experiment (QobjExperiment): a qobj experiment
+            experiment (dict): a qobj experiment, as a dictionary
+            program (CompiledCircuit): the compiled experiment
+
+        Returns:
+            bool: whether all measurements can be sampled at the end.
         """
-        measure_flags = {}
-        if hasattr(experiment.config, 'allows_measure_sampling'):
-            self._sample_measure = experiment.config.allows_measure_sampling
-        else:
+        config = experiment.get('config', {})
+        if 'allows_measure_sampling' in config:
+            return config['allows_measure_sampling']
+        return program.can_sample
 
-            for instruction in experiment.instructions:
-                if instruction.name == "reset":
-                    measure_flags[instruction.qubits[0]] = False
-                    self._sample_measure = False
-                    return
-
-                if measure_flags.get(instruction.qubits[0], False):
-                    if instruction.name not in ["measure", "barrier", "id", "u0"]:
-                        for qubit in instruction.qubits:
-                            measure_flags[qubit] = False
-                            return
-                elif instruction.name == "measure":
-                     for qubit in instruction.qubits:
-                            measure_flags[qubit] = True
-        
-        self._sample_measure = True
-
-        for key, value in measure_flags.items():
-            if value == False:
-                self._sample_measure = False
-                return
+    def warmup(self, calibrate_engines=False, sharded_enable=False):
+        """Set up the available engines ahead of the first job.
+
+        The OpenCL context and kernels are shared by every backend in the
+        process, so a long running service can call this once when it
+        starts, and the first job won't pay for setting up the device.
+
+        Args:
+            calibrate_engines (bool): also benchmark the engines, to tune
+                the cost model the ``'auto'`` engine is chosen by.
+            sharded_enable (bool): also start the workers of the opt-in
+                ``sharded`` engine, and calibrate it.
+        """
+        for engine in candidate_engines(sharded_enable):
+            engine.warmup()
+        if calibrate_engines:
+            calibrate(opt_in=sharded_enable)
+
+    def compiled_cache_info(self):
+        """Statistics of the cache of compiled experiments.
+
+        Returns:
+            dict: the ``hits``, ``misses``, ``size`` and ``max_size`` of the cache.
+        """
+        return self._compiled_cache.info()
+
+    def state_pool_info(self):
+        """Statistics of the pool of reusable device states.
+
+        Returns:
+            dict: see ``StatePool.info``.
+        """
+        return self._state_pool.info()
 
     @staticmethod
     def name():
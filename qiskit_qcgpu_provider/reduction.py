@@ -0,0 +1,243 @@
+"""
+Reduction of experiments to the qubits their results depend on.
+
+Transpiled circuits keep the width of the device they were mapped to, so
+some qubits may never be touched. And the counts of a qasm experiment only
+depend on the gates in the causal cone of its measurements: going back from
+the end, a gate matters if it acts on a qubit which is measured, or which a
+gate that matters acts on. Every qubit which is dropped halves the memory
+and the time of the simulation.
+
+Qubits which never share a gate, directly or through other qubits, can
+also be simulated apart: an experiment on clusters of ``k`` qubits costs
+``2 ** k`` per cluster instead of ``2 ** n``. Samples of the clusters are
+independent, so they are drawn separately and put together bit by bit.
+Without memory, the counts of every cluster are drawn from multinomials,
+one for every distinct outcome of the clusters before it.
+
+The classical bits are left as they are, so results are already in the
+layout of the original experiment.
+"""
+
+import numpy as np
+
+# Instructions which don't make a qubit used
+SPECTATOR_INSTRUCTIONS = ['barrier', 'id']
+
+
+class RegisterReduction:
+    """Which instructions of an experiment are kept, and where their qubits go.
+
+    Attributes:
+        kept (list): indices of the kept instructions.
+        qubit_map (dict): the index of every kept qubit in the reduced register.
+        num_qubits (int): the width of the reduced register.
+        original_qubits (int): the width of the experiment.
+        original_instructions (int): the number of instructions of the experiment.
+    """
+
+    def __init__(self, kept, qubit_map, original_qubits, original_instructions):
+        self.kept = kept
+        self.qubit_map = qubit_map
+        # States have at least one qubit
+        self.num_qubits = max(len(qubit_map), 1)
+        self.original_qubits = original_qubits
+        self.original_instructions = original_instructions
+
+    def apply(self, instructions):
+        """Reduce instructions.
+
+        Args:
+            instructions (list): the instructions the reduction was found
+                for, or instructions with the same structure and other
+                parameters.
+
+        Returns:
+            list: the kept instructions, on the qubits of the reduced register.
+        """
+        qubit_map = self.qubit_map
+        reduced = []
+        for index in self.kept:
+            instruction = instructions[index]
+            if 'qubits' in instruction:
+                instruction = dict(instruction, qubits=[qubit_map[qubit]
+                                                        for qubit in instruction['qubits']])
+            reduced.append(instruction)
+        return reduced
+
+    def info(self):
+        """The size of the reduction, which is added to the result metadata.
+
+        Returns:
+            dict: the ``qubits_before``, ``qubits_after`` and
+                ``instructions_dropped``.
+        """
+        return {'qubits_before': self.original_qubits,
+                'qubits_after': self.num_qubits,
+                'instructions_dropped': self.original_instructions - len(self.kept)}
+
+
+def reduce_register(instructions, num_qubits, light_cone=False):
+    """Find the instructions and qubits an experiment depends on.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+        num_qubits (int): the width of the experiment.
+        light_cone (bool): also drop the gates outside the causal cone of
+            the measurements. Only valid if every measurement is at the end
+            of its qubit, and there are no resets or conditional operations.
+
+    Returns:
+        RegisterReduction: the reduction.
+    """
+    if light_cone:
+        relevant = set()
+        kept = []
+        for index in reversed(range(len(instructions))):
+            instruction = instructions[index]
+            name = instruction['name']
+            qubits = instruction.get('qubits', [])
+            if name in SPECTATOR_INSTRUCTIONS:
+                continue
+            if name == 'measure' or relevant.intersection(qubits):
+                relevant.update(qubits)
+                kept.append(index)
+        kept.reverse()
+    else:
+        kept = [index for index, instruction in enumerate(instructions)
+                if instruction['name'] not in SPECTATOR_INSTRUCTIONS]
+
+    used = set()
+    for index in kept:
+        used.update(instructions[index].get('qubits', []))
+    qubit_map = {qubit: position for position, qubit in enumerate(sorted(used))}
+
+    return RegisterReduction(kept, qubit_map, num_qubits, len(instructions))
+
+
+def split_clusters(instructions, num_qubits):
+    """Split an experiment into clusters of qubits which don't interact.
+
+    Two qubits are in the same cluster if an instruction acts on both of
+    them, or on both of them through other qubits. Qubits which no
+    instruction acts on are in clusters of their own, without instructions.
+
+    Args:
+        instructions (list): instructions as dictionaries, without
+            conditional operations.
+        num_qubits (int): the width of the experiment.
+
+    Returns:
+        list: the ``RegisterReduction`` of every cluster, ordered by their
+            smallest qubit.
+    """
+    parents = list(range(num_qubits))
+
+    def find(qubit):
+        while parents[qubit] != qubit:
+            parents[qubit] = parents[parents[qubit]]
+            qubit = parents[qubit]
+        return qubit
+
+    acting = [index for index, instruction in enumerate(instructions)
+              if instruction['name'] not in SPECTATOR_INSTRUCTIONS and instruction.get('qubits')]
+    for index in acting:
+        qubits = instructions[index]['qubits']
+        for qubit in qubits[1:]:
+            parents[find(qubit)] = find(qubits[0])
+
+    members = {}
+    for qubit in range(num_qubits):
+        members.setdefault(find(qubit), []).append(qubit)
+    kept = {root: [] for root in members}
+    for index in acting:
+        kept[find(instructions[index]['qubits'][0])].append(index)
+
+    return [RegisterReduction(kept[root],
+                              {qubit: position for position, qubit in enumerate(qubits)},
+                              num_qubits, len(instructions))
+            for root, qubits in sorted(members.items(), key=lambda item: item[1][0])]
+
+
+def combine_samples(clusters, samples, qubits):
+    """Put the outcomes sampled from clusters together.
+
+    Args:
+        clusters (list): the ``RegisterReduction`` of the clusters.
+        samples (list): the ``int64`` outcomes of every cluster, where bit
+            ``k`` is its k-th smallest measured qubit.
+        qubits (list): the measured qubits of the experiment, sorted.
+
+    Returns:
+        ndarray: the outcomes, where bit ``k`` is ``qubits[k]``, as Python
+            integers if they don't fit in an ``int64``.
+    """
+    dtype = np.int64 if len(qubits) < 63 else object
+    combined = np.zeros(len(samples[0]), dtype=dtype)
+    for cluster, cluster_samples in zip(clusters, samples):
+        measured = [qubit for qubit in qubits if qubit in cluster.qubit_map]
+        for bit, qubit in enumerate(measured):
+            combined |= ((cluster_samples >> bit) & 1).astype(dtype) << qubits.index(qubit)
+    return combined
+
+
+def combine_counts(clusters, samplers, qubits, shots, generator):
+    """Draw the counts of the outcomes of clusters.
+
+    The shots of every outcome of the clusters drawn so far are split
+    between the outcomes of the next cluster by a multinomial, which gives
+    the counts of the joint outcomes without drawing every shot. Clusters
+    with the most outcomes are drawn first, when there are few outcomes to
+    split.
+
+    Args:
+        clusters (list): the ``RegisterReduction`` of the clusters.
+        samplers (list): the ``Sampler`` of the outcomes of every cluster,
+            where bit ``k`` is its k-th smallest measured qubit.
+        qubits (list): the measured qubits of the experiment, sorted.
+        shots (int): the number of shots.
+        generator (numpy.random.Generator): the source of randomness.
+
+    Returns:
+        tuple: the distinct outcomes, where bit ``k`` is ``qubits[k]``, as
+            Python integers if they don't fit in an ``int64``, and the
+            ``int64`` number of times each was drawn.
+    """
+    dtype = np.int64 if len(qubits) < 63 else object
+    outcomes = np.zeros(1, dtype=dtype)
+    counts = np.array([shots], dtype=np.int64)
+    order = sorted(range(len(clusters)), key=lambda index: -len(samplers[index].probabilities))
+    for index in order:
+        # One row of counts for every outcome drawn so far
+        cluster_counts = samplers[index].counts(generator, counts)
+        rows, cluster_outcomes = np.nonzero(cluster_counts)
+        counts = cluster_counts[rows, cluster_outcomes]
+        outcomes = outcomes[rows]
+        measured = [qubit for qubit in qubits if qubit in clusters[index].qubit_map]
+        for bit, qubit in enumerate(measured):
+            outcomes |= ((cluster_outcomes >> bit) & 1).astype(dtype) << qubits.index(qubit)
+    return outcomes, counts
+
+
+def combine_statevectors(clusters, statevectors, num_qubits):
+    """Form the tensor product of the statevectors of clusters.
+
+    Args:
+        clusters (list): the ``RegisterReduction`` of the clusters, which
+            together hold every qubit of the experiment.
+        statevectors (list): the amplitudes of every cluster.
+        num_qubits (int): the width of the experiment.
+
+    Returns:
+        ndarray: the ``2 ** num_qubits`` amplitudes of the experiment.
+    """
+    product = np.ones((), dtype=np.result_type(*statevectors))
+    # The axes of the product are the qubits of every cluster, most significant first
+    axis_qubits = []
+    for cluster, statevector in zip(clusters, statevectors):
+        cluster_qubits = sorted(cluster.qubit_map, reverse=True)
+        product = np.multiply.outer(product,
+                                    np.asarray(statevector).reshape((2,) * len(cluster_qubits)))
+        axis_qubits.extend(cluster_qubits)
+    order = [axis_qubits.index(qubit) for qubit in reversed(range(num_qubits))]
+    return np.ascontiguousarray(product.transpose(order)).reshape(-1)
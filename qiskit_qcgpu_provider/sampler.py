@@ -0,0 +1,138 @@
+"""
+Sampling of measurement outcomes.
+
+A ``Sampler`` normalizes a distribution once, and builds a table to draw
+from it, so the same distribution can be sampled any number of times
+without validating or normalizing it again. Samples are drawn from a
+``numpy.random.Generator``, so a seeded generator gives the same samples.
+"""
+
+import numpy as np
+
+# Sampling methods, see ``Sampler``
+METHODS = ['cdf', 'alias']
+
+# The alias method is chosen when at least this many samples per outcome are drawn
+ALIAS_MIN_SAMPLES_PER_OUTCOME = 64
+
+
+def alias_table(probabilities):
+    """Build Walker's alias table of a distribution, with Vose's method.
+
+    Args:
+        probabilities (ndarray): a normalized distribution over ``n`` outcomes.
+
+    Returns:
+        tuple: the ``float64`` probability of keeping every outcome, and the
+            ``int64`` outcome drawn instead of it otherwise.
+    """
+    size = len(probabilities)
+    keep = probabilities * size
+    alias = np.arange(size, dtype=np.int64)
+
+    small = np.flatnonzero(keep < 1).tolist()
+    large = np.flatnonzero(keep >= 1).tolist()
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        alias[less] = more
+        keep[more] -= 1 - keep[less]
+        if keep[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # Only rounding errors are left over
+    keep[small + large] = 1
+    return keep, alias
+
+
+def choose_method(num_outcomes, num_samples):
+    """Choose the cheapest sampling method.
+
+    Args:
+        num_outcomes (int): the size of the distribution.
+        num_samples (int): the number of outcomes which will be drawn.
+
+    Returns:
+        str: one of ``METHODS``.
+    """
+    if num_samples >= ALIAS_MIN_SAMPLES_PER_OUTCOME * num_outcomes:
+        return 'alias'
+    return 'cdf'
+
+
+class Sampler:
+    """Draws outcomes from a discrete distribution.
+
+    The ``'cdf'`` method inverts the cumulative distribution with a binary
+    search, which costs ``O(log n)`` per sample. The ``'alias'`` method uses
+    an alias table, which costs ``O(1)`` per sample but ``O(n)`` Python
+    operations to build, so it pays off when many samples are drawn from a
+    small distribution.
+
+    Attributes:
+        probabilities (ndarray): the normalized ``float64`` distribution.
+        method (str): the sampling method, one of ``METHODS``.
+    """
+
+    def __init__(self, probabilities, method='cdf'):
+        """
+        Args:
+            probabilities (ndarray): the weights of the outcomes, which are
+                normalized, as they may not sum to 1 because of rounding.
+            method (str): the sampling method, one of ``METHODS``.
+
+        Raises:
+            ValueError: if the method is unknown.
+        """
+        if method not in METHODS:
+            raise ValueError('Unknown sampling method "{}", must be one of {}'.format(
+                method, METHODS))
+
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.probabilities = probabilities / probabilities.sum()
+        self.method = method
+
+        if method == 'cdf':
+            self._cdf = np.cumsum(self.probabilities)
+        else:
+            self._keep, self._alias = alias_table(self.probabilities)
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def sample(self, generator, size):
+        """Draw outcomes.
+
+        Args:
+            generator (numpy.random.Generator): the source of randomness.
+            size (int): the number of outcomes.
+
+        Returns:
+            ndarray: the ``int64`` outcomes, indices into ``probabilities``.
+        """
+        if self.method == 'cdf':
+            # Outcomes with a probability of 0 can't be drawn with side='right'
+            uniform = generator.random(size) * self._cdf[-1]
+            return np.searchsorted(self._cdf, uniform, side='right').astype(np.int64)
+
+        outcomes = generator.integers(len(self), size=size)
+        kept = generator.random(size) < self._keep[outcomes]
+        return np.where(kept, outcomes, self._alias[outcomes])
+
+    def counts(self, generator, size):
+        """Draw outcomes, only keeping how many times each was drawn.
+
+        This costs ``O(n)`` whatever the number of outcomes drawn.
+
+        Args:
+            generator (numpy.random.Generator): the source of randomness.
+            size (int or ndarray): the number of outcomes, or an array of
+                numbers of outcomes drawn apart.
+
+        Returns:
+            ndarray: the ``int64`` number of times every outcome was drawn,
+                with a row for every entry of ``size`` if it is an array.
+        """
+        return generator.multinomial(size, self.probabilities)
@@ -0,0 +1,333 @@
+"""
+A state vector split across worker processes.
+
+The ``2 ** n`` amplitudes live in a shared memory block, split into
+``2 ** k`` shards of ``2 ** (n - k)`` amplitudes. The low ``n - k`` qubits
+are local: a gate on them only mixes amplitudes within a shard, so every
+worker applies it to its own shard. Consecutive local gates are queued and
+sent to the workers together, as a segment.
+
+The high ``k`` qubits are global, and select the shard. A gate on a global
+qubit mixes amplitudes of pairs of shards, so the pending segment is run
+first, then the pairs are split across the workers. As the block is shared,
+the workers exchange chunks by reading and writing each other's shards in
+place, without copying them. Gates on several global qubits, other than
+controlled gates, are applied by the main process.
+
+``multiprocessing.shared_memory`` needs Python 3.8 or later.
+"""
+
+import math
+import multiprocessing
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    resource_tracker = shared_memory = None
+
+from .fusion import gate_matrix
+from .numpy_state import NumpyState
+
+# Names of the state methods, as given to ``fusion.gate_matrix``
+_MATRIX_NAMES = {'u': 'u3'}
+
+# The ``NumpyState`` methods of the gates which can be controlled
+_CONTROLLED_METHODS = {'x': 'cx', 'z': 'cz', 'u1': 'cu1'}
+
+
+def create_pool(processes):
+    """Start the worker processes.
+
+    Args:
+        processes (int): the number of workers.
+
+    Returns:
+        multiprocessing.pool.Pool: the workers.
+    """
+    # The workers must share the resource tracker of this process, or
+    # theirs would unlink the shared memory they attached to when exiting
+    resource_tracker.ensure_running()
+    return multiprocessing.Pool(processes)
+
+
+def _run_task(task):
+    """Run a task on a shared state vector, in a worker process.
+
+    Args:
+        task (tuple): ``(memory_name, size, operation, args)``, where
+            ``operation`` is ``_apply_segment`` or ``_apply_pair``.
+    """
+    memory_name, size, operation, args = task
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        operation(np.ndarray((size,), dtype=np.complex128, buffer=memory.buf), *args)
+    finally:
+        memory.close()
+
+
+def _apply_segment(vector, start, stop, gates):
+    """Apply local gates to a shard.
+
+    Args:
+        vector (ndarray): the whole state vector.
+        start (int): the first amplitude of the shard.
+        stop (int): the end of the shard.
+        gates (list): ``(method, args)`` pairs, calling the gate methods of a
+            ``NumpyState`` with the local qubits.
+    """
+    shard = vector[start:stop]
+    state = NumpyState(int(math.log2(stop - start)), vector=shard)
+    for method, args in gates:
+        getattr(state, method)(*args)
+
+
+def _apply_pair(vector, first, second, matrix, control):
+    """Apply a gate on a global qubit to a range of a pair of shards.
+
+    Args:
+        vector (ndarray): the whole state vector.
+        first (slice): the amplitudes where the target is 0.
+        second (slice): the matching amplitudes where the target is 1.
+        matrix (ndarray): the 2x2 matrix of the gate.
+        control (int): a local control qubit, or ``None``.
+    """
+    zero = vector[first]
+    one = vector[second]
+    if control is not None:
+        offsets = np.arange(first.start, first.stop)
+        selected = ((offsets >> control) & 1).astype(bool)
+        old_zero = zero[selected]
+        old_one = one[selected]
+        zero[selected] = matrix[0, 0] * old_zero + matrix[0, 1] * old_one
+        one[selected] = matrix[1, 0] * old_zero + matrix[1, 1] * old_one
+    else:
+        old_zero = zero.copy()
+        zero *= matrix[0, 0]
+        zero += matrix[0, 1] * one
+        one *= matrix[1, 1]
+        one += matrix[1, 0] * old_zero
+
+
+class ShardedState:
+    """A state vector in shared memory, updated by a pool of processes.
+
+    The state has the gate methods of ``qcgpu.State``.
+
+    Attributes:
+        num_qubits (int): the number of qubits.
+        num_shards (int): the number of shards, a power of two.
+        num_local (int): the number of local qubits.
+        vector (ndarray): the amplitudes, in shared memory. Gates may still
+            be queued, see ``flush``.
+    """
+
+    def __init__(self, num_qubits, pool, num_workers):
+        """
+        Args:
+            num_qubits (int): the number of qubits.
+            pool (multiprocessing.pool.Pool): the workers.
+            num_workers (int): the number of workers, a power of two.
+
+        Raises:
+            OverflowError: if the state is too large.
+        """
+        self.num_qubits = num_qubits
+        self.num_shards = min(num_workers, 2 ** max(num_qubits - 1, 0))
+        self.num_local = num_qubits - int(math.log2(self.num_shards))
+        self._pool = pool
+        self._num_workers = num_workers
+        self._segments = [[] for _ in range(self.num_shards)]
+
+        size = 2 ** num_qubits
+        try:
+            self._memory = shared_memory.SharedMemory(
+                create=True, size=size * np.dtype(np.complex128).itemsize)
+        except (OSError, ValueError):
+            raise OverflowError('cannot allocate {} qubits'.format(num_qubits))
+        self.vector = np.ndarray((size,), dtype=np.complex128, buffer=self._memory.buf)
+        self.reset()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Free the shared memory."""
+        memory = getattr(self, '_memory', None)
+        if memory is None:
+            return
+        self._memory = None
+        self.vector = None
+        memory.close()
+        memory.unlink()
+
+    def reset(self):
+        """Reset the state to |0...0>, dropping the queued gates."""
+        for segment in self._segments:
+            del segment[:]
+        self.vector.fill(0)
+        self.vector[0] = 1
+
+    def flush(self):
+        """Apply the queued local gates."""
+        shard_size = 2 ** self.num_local
+        tasks = [(self._memory.name, self.vector.size, _apply_segment,
+                  (shard * shard_size, (shard + 1) * shard_size, list(segment)))
+                 for shard, segment in enumerate(self._segments) if segment]
+        if tasks:
+            self._pool.map(_run_task, tasks)
+        for segment in self._segments:
+            del segment[:]
+
+    def _gate(self, method, target, params=(), control=None):
+        """Apply a single qubit gate, with an optional control.
+
+        Args:
+            method (str): the name of the ``NumpyState`` method of the gate.
+            target (int): the target qubit.
+            params (tuple): the parameters of the gate.
+            control (int): the control qubit, or ``None``. Only the gates of
+                ``_CONTROLLED_METHODS`` are controlled.
+        """
+        num_local = self.num_local
+        global_control = control is not None and control >= num_local
+
+        def is_selected(shard):
+            # Shards where a global control is 0 are left as they are
+            return not global_control or (shard >> (control - num_local)) & 1
+
+        if target < num_local:
+            if control is None or global_control:
+                gate = (method, (target,) + tuple(params))
+            else:
+                gate = (_CONTROLLED_METHODS[method], (control, target) + tuple(params))
+
+            for shard, segment in enumerate(self._segments):
+                if is_selected(shard):
+                    segment.append(gate)
+            return
+
+        self.flush()
+
+        matrix = gate_matrix(_MATRIX_NAMES.get(method, method), params)
+        bit = 1 << (target - num_local)
+        shard_size = 2 ** num_local
+        pairs = [(shard, shard | bit) for shard in range(self.num_shards)
+                 if not shard & bit and is_selected(shard)]
+
+        # Split the pairs, so that every worker has a range to update
+        splits = max(1, self._num_workers // max(len(pairs), 1))
+        step = -(-shard_size // splits)
+        tasks = []
+        for first, second in pairs:
+            for offset in range(0, shard_size, step):
+                stop = min(offset + step, shard_size)
+                tasks.append((self._memory.name, self.vector.size, _apply_pair,
+                              (slice(first * shard_size + offset, first * shard_size + stop),
+                               slice(second * shard_size + offset, second * shard_size + stop),
+                               matrix, None if global_control else control)))
+        self._pool.map(_run_task, tasks)
+
+    def _multi_qubit_gate(self, method, qubits, args):
+        """Apply a gate on any qubits.
+
+        The gate is queued if all of its qubits are local, and otherwise
+        applied to the whole state by this process.
+
+        Args:
+            method (str): the name of the ``NumpyState`` method of the gate.
+            qubits (list): the qubits the gate acts on.
+            args (tuple): the arguments of the method.
+        """
+        if max(qubits) < self.num_local:
+            for segment in self._segments:
+                segment.append((method, args))
+            return
+
+        self.flush()
+        getattr(NumpyState(self.num_qubits, vector=self.vector), method)(*args)
+
+    def u(self, target, theta, phi, lam):
+        self._gate('u', target, (theta, phi, lam))
+
+    def u2(self, target, phi, lam):
+        self._gate('u2', target, (phi, lam))
+
+    def u1(self, target, lam):
+        self._gate('u1', target, (lam,))
+
+    def cx(self, control, target):
+        self._gate('x', target, control=control)
+
+    def cz(self, control, target):
+        self._gate('z', target, control=control)
+
+    def cu1(self, control, target, lam):
+        self._gate('u1', target, (lam,), control)
+
+    def swap(self, first, second):
+        if max(first, second) < self.num_local:
+            self._multi_qubit_gate('swap', [first, second], (first, second))
+            return
+        # Three cx gates are still split across the workers
+        self.cx(first, second)
+        self.cx(second, first)
+        self.cx(first, second)
+
+    def ccx(self, control, control2, target):
+        self._multi_qubit_gate('ccx', [control, control2, target], (control, control2, target))
+
+    def rz(self, target, phi):
+        self._gate('rz', target, (phi,))
+
+    def rx(self, target, theta):
+        self._gate('rx', target, (theta,))
+
+    def ry(self, target, theta):
+        self._gate('ry', target, (theta,))
+
+    def unitary(self, qubits, matrix):
+        self._multi_qubit_gate('unitary', qubits, (qubits, matrix))
+
+    def diagonal(self, qubits, entries):
+        # The global qubits are fixed in every shard, so every shard applies
+        # the part of the diagonal on its local qubits
+        num_local = self.num_local
+        count = len(qubits)
+        table = np.reshape(entries, (2,) * count)
+        local = [qubit for qubit in qubits if qubit < num_local]
+
+        for shard, segment in enumerate(self._segments):
+            # Axis 0 of the table is the most significant qubit
+            index = tuple((shard >> (qubit - num_local)) & 1 if qubit >= num_local
+                          else slice(None) for qubit in reversed(qubits))
+            segment.append(('diagonal', (local, table[index].reshape(-1))))
+
+    def h(self, target):
+        self._gate('h', target)
+
+    def x(self, target):
+        self._gate('x', target)
+
+    def y(self, target):
+        self._gate('y', target)
+
+    def z(self, target):
+        self._gate('z', target)
+
+    def s(self, target):
+        self._gate('s', target)
+
+    def t(self, target):
+        self._gate('t', target)
+
+    def amplitudes(self):
+        """A copy of the amplitudes."""
+        self.flush()
+        return self.vector.copy()
+
+    def probabilities(self):
+        """The probability of every basis state."""
+        self.flush()
+        return np.abs(self.vector) ** 2
@@ -0,0 +1,105 @@
+"""
+Reuse of engine states across experiments.
+
+Creating a state allocates a whole state vector, and for the qcgpu engine
+uploads it to the OpenCL device. When a state of the right size already
+exists it is cheaper to reset it in place, so the backends keep a pool of
+idle states.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class StatePool:
+    """A pool of idle states, which are reset and handed out again.
+
+    The idle states are kept up to a total of ``max_memory`` bytes. When
+    a released state doesn't fit, the states which have been idle the
+    longest are evicted first. The pool can be used from several threads
+    at once.
+
+    Attributes:
+        max_memory (int): maximum size of the idle states, in bytes.
+        hits (int): number of states handed out from the pool.
+        misses (int): number of states which had to be created.
+        evictions (int): number of idle states dropped from the pool.
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # id(state) -> (engine, state), least recently released first
+        self._idle = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, engine, num_qubits):
+        """Get a state in |0...0>.
+
+        Args:
+            engine (BaseEngine): the engine the state belongs to.
+            num_qubits (int): the number of qubits of the state.
+
+        Returns:
+            object: a state from the pool, or a new one.
+
+        Raises:
+            OverflowError: if the state is too large to be created.
+        """
+        sim = None
+        with self._lock:
+            for key, (idle_engine, idle) in self._idle.items():
+                if idle_engine is engine and idle.num_qubits == num_qubits:
+                    del self._idle[key]
+                    sim = idle
+                    self._memory -= engine.state_nbytes(sim)
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+
+        if sim is None:
+            return engine.create_state(num_qubits)
+
+        engine.reset_state(sim)
+        return sim
+
+    def release(self, engine, sim):
+        """Give a state back to the pool once it isn't used anymore.
+
+        Args:
+            engine (BaseEngine): the engine the state belongs to.
+            sim (object): a state from ``acquire``.
+        """
+        size = engine.state_nbytes(sim)
+        if size > self.max_memory:
+            return
+
+        with self._lock:
+            while self._idle and self._memory + size > self.max_memory:
+                _, (evicted_engine, evicted) = self._idle.popitem(last=False)
+                self._memory -= evicted_engine.state_nbytes(evicted)
+                self.evictions += 1
+            self._idle[id(sim)] = (engine, sim)
+            self._memory += size
+
+    def info(self):
+        """Statistics of the pool.
+
+        Returns:
+            dict: the ``hits``, ``misses``, ``evictions``, number of ``idle``
+                states, and the ``memory`` and ``max_memory`` of the pool.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'idle': len(self._idle),
+                    'memory': self._memory, 'max_memory': self.max_memory}
+
+    def clear(self):
+        """Drop every idle state."""
+        with self._lock:
+            self._idle.clear()
+            self._memory = 0
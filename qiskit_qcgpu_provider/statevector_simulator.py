@@ -9,7 +9,8 @@ Advantages:
    to parallel computation.
 2. This backend works on every device that has an OpenCL implementation,
    which includes Macbooks, gaming computers, Nvidia and AMD cards etc.
-3. Supports u gates.
+3. Supports u gates, and controlled-phase, swap, Toffoli, rotation and
+   unitary gates without decomposing them.
 
 Limitations:
 1. Memory on the GPU is usually a lot less than that of a full machine,
@@ -20,9 +21,11 @@ Limitations:
    using floats.
 """
 
+import os
 import uuid
 import logging
 import time
+
 import numpy as np
 
 from qiskit.providers import BaseBackend
@@ -31,14 +34,34 @@ from qiskit.result.models import ExperimentResult, ExperimentResultData
 from qiskit.providers.models import BackendConfiguration
 from qiskit.validation.base import Obj
 
-import qcgpu
-
 from .job import QCGPUJob
+from .engines import ENGINES, candidate_engines, select_engine, calibrate
+from .compiler import CompiledCircuitCache, parameter_slots, assign_parameters
+from .fusion import count_gates
+from .numpy_state import NumpyState
+from .observables import expectation_values, parse_observables
+from .reduction import combine_statevectors, split_clusters
 from .simulatorerror import QCGPUSimulatorError
+from .states import StatePool
+from .storage import write_statevector
+from .utils import (set_backend_options, get_option, run_experiments, worker_timing,
+                    get_parameter_sweep)
 
 logger = logging.getLogger(__name__)
 
 
+def _statevector_path(file_prefix, row=None, cluster=None):
+    """The file a statevector is written to, if any."""
+    if file_prefix is None:
+        return None
+    path = file_prefix
+    if row is not None:
+        path += '-{}'.format(row)
+    if cluster is not None:
+        path += '-cluster{}'.format(cluster)
+    return path + '.npy'
+
+
 class QCGPUStatevectorSimulator(BaseBackend):
     """Contains an OpenCL based backend"""
 
@@ -68,7 +91,15 @@ class QCGPUStatevectorSimulator(BaseBackend):
                                              'z',
                                              'h',
                                              's',
-                                             't'],
+                                             't',
+                                             'cz',
+                                             'cu1',
+                                             'swap',
+                                             'ccx',
+                                             'rz',
+                                             'rx',
+                                             'ry',
+                                             'unitary'],
                              'gates': [{'name': 'u1',
                                         'parameters': ['lambda'],
                                         'qasm_def': 'gate u1(lambda) q { U(0,0,lambda) q; }'},
@@ -106,52 +137,111 @@ class QCGPUStatevectorSimulator(BaseBackend):
                                        {'name': 't',
                                         'parameters': ['a'],
                                         'qasm_def': 'gate t a { u1(pi/4) a; }'},
+                                       {'name': 'cz',
+                                        'parameters': ['a',
+                                                       'b'],
+                                        'qasm_def': 'gate cz a,b { h b; cx a,b; h b; }'},
+                                       {'name': 'cu1',
+                                        'parameters': ['lambda'],
+                                        'qasm_def': 'gate cu1(lambda) a,b { u1(lambda/2) a; '
+                                                    'cx a,b; u1(-lambda/2) b; cx a,b; '
+                                                    'u1(lambda/2) b; }'},
+                                       {'name': 'swap',
+                                        'parameters': ['a',
+                                                       'b'],
+                                        'qasm_def': 'gate swap a,b { cx a,b; cx b,a; cx a,b; }'},
+                                       {'name': 'ccx',
+                                        'parameters': ['a',
+                                                       'b',
+                                                       'c'],
+                                        'qasm_def': 'gate ccx a,b,c { h c; cx b,c; tdg c; '
+                                                    'cx a,c; t c; cx b,c; tdg c; cx a,c; t b; '
+                                                    't c; h c; cx a,b; t a; tdg b; cx a,b; }'},
+                                       {'name': 'rz',
+                                        'parameters': ['phi'],
+                                        'qasm_def': 'gate rz(phi) a { u1(phi) a; }'},
+                                       {'name': 'rx',
+                                        'parameters': ['theta'],
+                                        'qasm_def': 'gate rx(theta) a { u3(theta,-pi/2,pi/2) a; }'},
+                                       {'name': 'ry',
+                                        'parameters': ['theta'],
+                                        'qasm_def': 'gate ry(theta) a { u3(theta,0,0) a; }'},
+                                       {'name': 'unitary',
+                                        'parameters': ['matrix'],
+                                        'qasm_def': 'unitary(matrix) q1, q2,...'},
                                        ]}
 
+    COMPILED_CACHE_SIZE = 128  # Number of compiled experiments kept
+    STATE_POOL_MAX_MEMORY = 2 ** 30  # Bytes of idle device states kept for reuse
+
+    DEFAULT_OPTIONS = {'engine': 'auto',
+                       'max_parallel_experiments': 1,
+                       'fusion_enable': False,
+                       'sharded_enable': False,
+                       'parameter_sweep': None,
+                       'statevector_dtype': None,
+                       'statevector_dir': None,
+                       'statevector_clusters': False,
+                       'observables': None}
+
+    # NumPy types the statevector can be returned as
+    STATEVECTOR_DTYPES = ['complex64', 'complex128']
+
     def __init__(self, configuration=None, provider=None):
         configuration = configuration or BackendConfiguration.from_dict(
             self.DEFAULT_CONFIGURATION)
         super().__init__(configuration=configuration, provider=provider)
 
         self._configuration = configuration
-        self._number_of_qubits = None
-        self._statevector = None
-        self._results = {}
         self._chop_threshold = 15  # chop to 10^-15
+        # Statevectors keep the global phase of fused gates
+        self._compiled_cache = CompiledCircuitCache(self.COMPILED_CACHE_SIZE, global_phase=True)
+        self._state_pool = StatePool(self.STATE_POOL_MAX_MEMORY)
 
-    def run(self, qobj):
+    def run(self, qobj, backend_options=None):
         """Run qobj asynchronously.
 
         Args:
             qobj (Qobj): payload of the experiment
+            backend_options (dict): options for the backend, added to the
+                qobj config. See ``DEFAULT_OPTIONS`` for the supported options.
 
         Returns:
             QCGPUJob: derived from BaseJob
         """
-
-        qcgpu.backend._create_context()
+        set_backend_options(qobj, backend_options)
+        self._validate(qobj)
 
         job_id = str(uuid.uuid4())
-        job = QCGPUJob(self, job_id, self._run_job(job_id, qobj), qobj)
+        job = QCGPUJob(self, job_id, self._run_job, qobj)
+        job.submit()
         return job
 
     # @profile
-    def _run_job(self, job_id, qobj):
+    def _run_job(self, job_id, qobj, cancel_event=None):
         """Run experiments in qobj
 
+        Up to ``max_parallel_experiments`` experiments are run at once.
+
         Args:
             job_id (str): unique id for the job.
             qobj (Qobj): job description
+            cancel_event (threading.Event): when set, the job stops before
+                running the next experiment.
 
         Returns:
             Result: Result object
+
+        Raises:
+            CancelledError: if the job was cancelled while running.
         """
-        self._validate(qobj)
-        results = []
+        max_parallel = get_option(qobj.config, 'max_parallel_experiments',
+                                  self.DEFAULT_OPTIONS)
 
         start = time.time()
-        for experiment in qobj.experiments:
-            results.append(self.run_experiment(experiment))
+        results = run_experiments(
+            lambda index, experiment: self.run_experiment(experiment, qobj.config),
+            qobj.experiments, max_parallel, cancel_event)
         end = time.time()
 
         result = Result(
@@ -167,83 +257,216 @@ class QCGPUStatevectorSimulator(BaseBackend):
         return result
 
     # @profile
-    def run_experiment(self, experiment):
+    def run_experiment(self, experiment, qobj_config):
         """Run an experiment (circuit) and return a single experiment result.
 
+        When the ``parameter_sweep`` option is set, the experiment is run
+        once for every row of parameter values, and the result holds the
+        ``statevectors`` of every row instead of a single ``statevector``.
+
+        When the ``statevector_dtype`` option is set, statevectors are
+        returned as NumPy arrays of that type rather than lists of Python
+        complex numbers, which avoids boxing every amplitude. The array is
+        held as the ``statevector_array`` of the result, which isn't
+        validated, so it isn't copied into a list by the result schema.
+
+        When the ``statevector_dir`` option is set, statevectors are copied
+        from the device into ``.npy`` files in that directory, and the
+        result holds the ``statevector_file`` instead, a dictionary of the
+        path, shape and type of the file, which
+        ``StatevectorFile.from_dict`` opens.
+
+        Clusters of qubits which never share a gate are simulated apart,
+        and the statevector is their tensor product. When the
+        ``statevector_clusters`` option is set, the product isn't formed:
+        the result holds the ``cluster_statevectors`` (or the
+        ``sweep_cluster_statevectors`` of every row), a list of the
+        ``qubits`` and the ``statevector`` of every cluster. The width of
+        every cluster is added to the metadata.
+
+        When the ``observables`` option is set, to a list of observables
+        which are each a list of ``[coefficient, label]`` Pauli strings, the
+        statevector isn't returned: the result holds the
+        ``expectation_values`` of the observables (or the
+        ``sweep_expectation_values`` of every row), which are reduced where
+        the state is, see ``observables``.
+
         Args:
             experiment (QobjExperiment): experiment from qobj experiments list
+            qobj_config (QobjConfig): configuration of the qobj the
+                experiment belongs to
 
         Returns:
-            dict: A dictionary of results.
-            dict: A result dictionary
+            ExperimentResult: The result of the experiment.
 
         Raises:
             QCGPUSimulatorError: If the number of qubits is too large, or another
                 error occurs during execution.
         """
-        self._number_of_qubits = experiment.header.n_qubits
-        self._statevector = 0
-
         start = time.time()
 
+        dtype = get_option(qobj_config, 'statevector_dtype', self.DEFAULT_OPTIONS)
+        if dtype is not None and dtype not in self.STATEVECTOR_DTYPES:
+            raise QCGPUSimulatorError(
+                'statevector_dtype must be one of {}, not "{}"'.format(
+                    self.STATEVECTOR_DTYPES, dtype))
+
+        directory = get_option(qobj_config, 'statevector_dir', self.DEFAULT_OPTIONS)
+        if directory is not None:
+            file_prefix = os.path.join(directory, uuid.uuid4().hex)
+        else:
+            file_prefix = None
+
+        instructions = [instruction.to_dict() for instruction in experiment.instructions]
+
+        fusion = {'enabled': get_option(qobj_config, 'fusion_enable', self.DEFAULT_OPTIONS),
+                  'gates_before': count_gates(instructions)}
+        program, cache_hit = self._compiled_cache.get(instructions, fusion['enabled'])
+        fusion['gates_after'] = len(program)
+
+        if program.measurements or 'reset' in program.ignored:
+            raise QCGPUSimulatorError(
+                'Unsupported "{}" instruction "{}" in circuit "{}"'.format(
+                    self.name(),
+                    'measure' if program.measurements else 'reset',
+                    experiment.header.name))
+        if any('conditional' in instruction for instruction in instructions):
+            raise QCGPUSimulatorError(
+                'Unsupported "{}" conditional instructions in circuit "{}"'.format(
+                    self.name(), experiment.header.name))
+
+        num_qubits = experiment.header.n_qubits
+        observables = get_option(qobj_config, 'observables', self.DEFAULT_OPTIONS)
+        if observables is not None:
+            observables = parse_observables(observables, num_qubits)
+
+        clusters = split_clusters(instructions, num_qubits)
+        if len(clusters) > 1:
+            programs = [self._compiled_cache.get(cluster.apply(instructions), fusion['enabled'])[0]
+                        for cluster in clusters]
+            fusion['gates_after'] = sum(len(cluster_program) for cluster_program in programs)
+        else:
+            clusters = []
+            programs = [program]
+        return_clusters = bool(clusters) and get_option(qobj_config, 'statevector_clusters',
+                                                        self.DEFAULT_OPTIONS)
+
+        widths = [cluster.num_qubits for cluster in clusters] or [num_qubits]
+        engine, engine_selection = select_engine(
+            get_option(qobj_config, 'engine', self.DEFAULT_OPTIONS),
+            max(widths), len(program),
+            get_option(qobj_config, 'sharded_enable', self.DEFAULT_OPTIONS))
+
+        sims = []
         try:
-            sim = qcgpu.State(self._number_of_qubits)
+            for width in widths:
+                sims.append(self._state_pool.acquire(engine, width))
         except OverflowError:
+            for sim in sims:
+                self._state_pool.release(engine, sim)
             raise QCGPUSimulatorError('too many qubits')
 
-        for operation in experiment.instructions:
-            name = operation.name
-            qubits = operation.qubits
-            params = [float(param)
-                      for param in getattr(operation, 'params', [])]
-
-            if name == 'id':
-                logger.info('Identity gates are ignored.')
-            elif name == 'barrier':
-                logger.info('Barrier gates are ignored.')
-            elif name == 'u3':
-                sim.u(qubits[0], *params)
-            elif name == 'u2':
-                sim.u2(qubits[0], *params)
-            elif name == 'u1':
-                sim.u1(qubits[0], *params)
-            elif name == 'cx':
-                sim.cx(*qubits)
-            elif name == 'h':
-                sim.h(qubits[0])
-            elif name == 'x':
-                sim.x(qubits[0])
-            elif name == 'y':
-                sim.y(qubits[0])
-            elif name == 'z':
-                sim.z(qubits[0])
-            elif name == 's':
-                sim.s(qubits[0])
-            elif name == 't':
-                sim.t(qubits[0])
-
-        amps = [complex(z)
-                for z in sim.amplitudes().round(self._chop_threshold)]
+        def run(row=None, bound_instructions=None):
+            for index, (cluster_program, sim) in enumerate(zip(programs, sims)):
+                if bound_instructions is not None:
+                    cluster_program = cluster_program.bind(
+                        clusters[index].apply(bound_instructions) if clusters
+                        else bound_instructions)
+                cluster_program.run(sim)
+
+            if observables is not None:
+                return expectation_values(engine, sims, clusters, observables)
+            if return_clusters:
+                return [{'qubits': sorted(cluster.qubit_map),
+                         'statevector': self._get_statevector(
+                             engine, sim, dtype, _statevector_path(file_prefix, row, index))}
+                        for index, (cluster, sim) in enumerate(zip(clusters, sims))]
+            path = _statevector_path(file_prefix, row)
+            if not clusters:
+                return self._get_statevector(engine, sims[0], dtype, path)
+            statevector = combine_statevectors(clusters, [sim.amplitudes() for sim in sims],
+                                               num_qubits)
+            return self._get_statevector(ENGINES['numpy'],
+                                         NumpyState(num_qubits, vector=statevector), dtype, path)
 
-        end = time.time()
+        try:
+            slots = parameter_slots(instructions)
+            sweep = get_parameter_sweep(experiment, qobj_config, slots)
+
+            if observables is not None:
+                key = 'expectation_values'
+            elif return_clusters:
+                key = 'cluster_statevectors'
+            elif file_prefix is not None:
+                key = 'statevector_file'
+            elif dtype is not None:
+                key = 'statevector_array'
+            else:
+                key = 'statevector'
+
+            if sweep is None:
+                data = ExperimentResultData(**{key: run()})
+            else:
+                # The template is rebound for every row, reusing the same states
+                rows = []
+                for row, values in enumerate(sweep):
+                    if row:
+                        for sim in sims:
+                            engine.reset_state(sim)
+                    rows.append(run(row, assign_parameters(instructions, slots, values)))
+                sweep_key = 'statevectors' if key.startswith('statevector') else 'sweep_' + key
+                data = ExperimentResultData(**{sweep_key: rows})
+        finally:
+            for sim in sims:
+                self._state_pool.release(engine, sim)
 
-        # amps = np.stack((amps.real, amps.imag), axis=-1)
+        end = time.time()
 
         return ExperimentResult(
             name=experiment.header.name,
             shots=1,
             success=True,
-            data=ExperimentResultData(statevector=amps),
+            data=data,
             time_taken=(end - start),
-            header=Obj(name=experiment.header.name))
+            header=Obj(name=experiment.header.name),
+            metadata=dict(worker_timing(start, end), fusion=fusion,
+                          compiled_cache_hit=cache_hit, engine=engine.name,
+                          engine_selection=engine_selection,
+                          clusters=widths if clusters else None))
+
+    def _get_statevector(self, engine, sim, dtype=None, path=None):
+        """Get the chopped amplitudes of a state.
+
+        Args:
+            engine (BaseEngine): the engine the state belongs to.
+            sim (object): the state.
+            dtype (str): the NumPy type to return the amplitudes as, or
+                ``None`` for a list of Python complex numbers.
+            path (str): if given, the amplitudes are written to this
+                ``.npy`` file rather than returned.
+
+        Returns:
+            list or ndarray or dict: the amplitudes, or the dictionary of
+                the ``StatevectorFile`` they were written to.
+        """
+        if path is not None:
+            return write_statevector(engine, sim, path, dtype, self._chop_threshold).to_dict()
+
+        amplitudes = sim.amplitudes()
+        if dtype is None:
+            return [complex(z)
+                    for z in amplitudes.round(self._chop_threshold)]
+
+        # The amplitudes are already a host copy, so they are chopped in place
+        statevector = np.ascontiguousarray(amplitudes, dtype=dtype)
+        return statevector.round(self._chop_threshold, out=statevector)
 
     # @profile
 
     def _validate(self, qobj):
         """
-        Make sure that there is:
-        1. No shots
-        2. No measurements until the end
+        Make sure that there is only 1 shot. Measurements and resets are
+        rejected when the experiments are compiled.
         """
         if qobj.config.shots != 1:
             logger.info('"%s" only supports 1 shot. Setting shots=1.',
@@ -259,13 +482,39 @@ class QCGPUStatevectorSimulator(BaseBackend):
                     self.name(), name)
                 experiment.config.shots = 1
 
-            for operation in experiment.instructions:
-                if operation.name in ['measure', 'reset']:
-                    raise QCGPUSimulatorError(
-                        'Unsupported "{}" instruction "{}" in circuit "{}"'.format(
-                            self.name(),
-                            operation.name,
-                            name))
+    def warmup(self, calibrate_engines=False, sharded_enable=False):
+        """Set up the available engines ahead of the first job.
+
+        The OpenCL context and kernels are shared by every backend in the
+        process, so a long running service can call this once when it
+        starts, and the first job won't pay for setting up the device.
+
+        Args:
+            calibrate_engines (bool): also benchmark the engines, to tune
+                the cost model the ``'auto'`` engine is chosen by.
+            sharded_enable (bool): also start the workers of the opt-in
+                ``sharded`` engine, and calibrate it.
+        """
+        for engine in candidate_engines(sharded_enable):
+            engine.warmup()
+        if calibrate_engines:
+            calibrate(opt_in=sharded_enable)
+
+    def compiled_cache_info(self):
+        """Statistics of the cache of compiled experiments.
+
+        Returns:
+            dict: the ``hits``, ``misses``, ``size`` and ``max_size`` of the cache.
+        """
+        return self._compiled_cache.info()
+
+    def state_pool_info(self):
+        """Statistics of the pool of reusable device states.
+
+        Returns:
+            dict: see ``StatePool.info``.
+        """
+        return self._state_pool.info()
 
     @staticmethod
     def name():
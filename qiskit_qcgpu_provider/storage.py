@@ -0,0 +1,109 @@
+"""
+Writing statevectors to disk.
+
+Large statevectors are copied from the engine straight into a ``.npy``
+file, one chunk at a time, so the host never holds a full copy of the
+amplitudes. The result only holds the dictionary of a ``StatevectorFile``,
+which maps the file back into memory when it is used.
+"""
+
+import itertools
+import os
+
+import numpy as np
+
+# Number of amplitudes copied from the state at once
+CHUNK_SIZE = 2 ** 20
+
+
+class StatevectorFile:
+    """A statevector saved in a ``.npy`` file, loaded on demand.
+
+    The handle can be passed wherever an array is expected, in which case
+    the file is memory mapped rather than read.
+
+    Attributes:
+        path (str): the path of the ``.npy`` file.
+        shape (tuple): the shape of the statevector.
+        dtype (numpy.dtype): the type of the amplitudes.
+    """
+
+    def __init__(self, path, shape, dtype):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        statevector = self.load()
+        if dtype is not None:
+            return statevector.astype(dtype)
+        return statevector
+
+    def __repr__(self):
+        return '{}({!r}, shape={}, dtype={})'.format(
+            type(self).__name__, self.path, self.shape, self.dtype)
+
+    def load(self, mmap_mode='r'):
+        """Load the statevector.
+
+        Args:
+            mmap_mode (str): how the file is memory mapped, see ``numpy.load``.
+                ``None`` reads the whole file into memory.
+
+        Returns:
+            ndarray: the amplitudes.
+        """
+        return np.load(self.path, mmap_mode=mmap_mode)
+
+    def to_dict(self):
+        """The handle as a serializable dictionary."""
+        return {'path': self.path, 'shape': list(self.shape), 'dtype': self.dtype.name}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Open a handle from its dictionary, see ``to_dict``."""
+        return cls(data['path'], data['shape'], data['dtype'])
+
+
+def write_statevector(engine, sim, path, dtype=None, decimals=None, chunk_size=CHUNK_SIZE):
+    """Copy the amplitudes of a state into a ``.npy`` file.
+
+    Args:
+        engine (BaseEngine): the engine the state belongs to.
+        sim (object): the state.
+        path (str): the path of the file, which is overwritten.
+        dtype (str): the type to save the amplitudes as, by default the
+            type of the state.
+        decimals (int): if given, the amplitudes are rounded to this many
+            decimals.
+        chunk_size (int): number of amplitudes copied from the state at once.
+
+    Returns:
+        StatevectorFile: a handle to the file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    size = 2 ** sim.num_qubits
+    chunks = engine.amplitude_chunks(sim, chunk_size)
+    first = next(chunks)
+    dtype = np.dtype(dtype or first.dtype)
+
+    output = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(size,))
+    try:
+        start = 0
+        for chunk in itertools.chain([first], chunks):
+            block = output[start:start + len(chunk)]
+            block[:] = chunk
+            if decimals is not None:
+                block.round(decimals, out=block)
+            start += len(chunk)
+        output.flush()
+    finally:
+        del output
+
+    return StatevectorFile(path, (size,), dtype)
@@ -0,0 +1,260 @@
+"""
+Execution of circuits with measurements or resets before their last gates.
+
+Such circuits can't be sampled from their final state. Instead, all the
+shots go through the circuit together. At every measurement or reset the
+shots are split between the two outcomes with a binomial draw, and the
+state is collapsed onto every outcome that was drawn, after copying it if
+both were. Shots with the same outcomes share a trajectory, so the cost
+grows with the number of distinct trajectories rather than with the number
+of shots, and the gates before the first measurement are applied once.
+
+The classical register of a trajectory is kept as an integer, so the
+condition of a conditional (``c_if``) operation is checked with a mask and
+a comparison, and the operation is applied once for all the shots of the
+trajectory. Qiskit assembles a condition as a ``bfunc`` instruction, which
+compares the masked memory to a value and stores the result in a register
+bit after the memory bits, and the operation is conditioned on that bit.
+"""
+
+import operator
+
+from .simulatorerror import QCGPUSimulatorError
+
+# Instructions which may follow the final measurements
+FINAL_INSTRUCTIONS = ['measure', 'barrier', 'id']
+
+# Instructions which split the shots between their outcomes
+BRANCHING_INSTRUCTIONS = ['measure', 'reset']
+
+# Instructions which only update the classical register
+CLASSICAL_INSTRUCTIONS = ['bfunc']
+
+# The relations a bfunc compares the masked register to its value with
+BFUNC_RELATIONS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+                   '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def get_condition(instruction):
+    """Get the condition of a conditional instruction.
+
+    Args:
+        instruction (dict): an instruction with a ``conditional`` entry,
+            either the index of the register bit set by a ``bfunc``, or a
+            dictionary with hexadecimal ``mask`` and ``val`` strings.
+
+    Returns:
+        tuple: the integer ``(mask, value)``, such that the instruction is
+            applied when ``register & mask == value``.
+
+    Raises:
+        QCGPUSimulatorError: if the condition isn't an equality.
+    """
+    conditional = instruction['conditional']
+    if isinstance(conditional, int):
+        return 1 << conditional, 1 << conditional
+    if conditional.get('type', 'equals') != 'equals':
+        raise QCGPUSimulatorError('Unsupported conditional type "{}"'.format(
+            conditional['type']))
+    return int(conditional['mask'], 16), int(conditional['val'], 16)
+
+
+def get_bfunc(instruction):
+    """Get the comparison of a ``bfunc`` instruction.
+
+    Args:
+        instruction (dict): a ``bfunc`` instruction, with hexadecimal
+            ``mask`` and ``val`` strings, a ``relation`` and the index of
+            the ``register`` bit the result is stored in.
+
+    Returns:
+        tuple: the integer ``(mask, value)``, the relation as a function,
+            and the register bit, such that the bit is set to
+            ``relation(register & mask, value)``.
+
+    Raises:
+        QCGPUSimulatorError: if the relation isn't supported.
+    """
+    relation = instruction.get('relation', '==')
+    if relation not in BFUNC_RELATIONS:
+        raise QCGPUSimulatorError('Unsupported bfunc relation "{}"'.format(relation))
+    return (int(instruction['mask'], 16), int(instruction['val'], 16),
+            BFUNC_RELATIONS[relation], int(instruction['register']))
+
+
+def split_instructions(instructions):
+    """Split instructions at the measurements, resets and conditional gates.
+
+    Args:
+        instructions (list): instructions as dictionaries.
+
+    Returns:
+        tuple: the list of operations, each either ``('gates', instructions)``
+            for a run of unconditional gates, or ``(name, instruction)`` for
+            a measurement, a reset, a ``bfunc``, or a conditional ``'gate'``,
+            and the list of the final measurement instructions, which are
+            sampled at the end of every trajectory.
+    """
+    end = len(instructions)
+    while (end and instructions[end - 1]['name'] in FINAL_INSTRUCTIONS and
+           'conditional' not in instructions[end - 1]):
+        end -= 1
+    final = [instruction for instruction in instructions[end:]
+             if instruction['name'] == 'measure']
+
+    operations = []
+    gates = []
+    for instruction in instructions[:end]:
+        name = instruction['name']
+        classical = name in BRANCHING_INSTRUCTIONS or name in CLASSICAL_INSTRUCTIONS
+        if classical or 'conditional' in instruction:
+            if gates:
+                operations.append(('gates', gates))
+                gates = []
+            operations.append((name if classical else 'gate', instruction))
+        else:
+            gates.append(instruction)
+    if gates:
+        operations.append(('gates', gates))
+
+    return operations, final
+
+
+def _take_outcome(engine, sim, operation, outcome, probability, register):
+    """Collapse a state onto the outcome of a measurement or reset.
+
+    Args:
+        engine (BaseEngine): the engine of the state.
+        sim (object): the state.
+        operation (tuple): ``('measure', qubit, clbit)`` or ``('reset', qubit)``.
+        outcome (int): the outcome, 0 or 1.
+        probability (float): the probability of the outcome.
+        register (int): the classical register before the operation.
+
+    Returns:
+        int: the classical register after the operation.
+    """
+    qubit = operation[1]
+    engine.collapse(sim, qubit, outcome, probability)
+
+    if operation[0] == 'measure':
+        clbit = operation[2]
+        return (register & ~(1 << clbit)) | (outcome << clbit)
+
+    if outcome:
+        sim.x(qubit)
+    return register
+
+
+def run_trajectories(engine, pool, sim, operations, shots, generator, finish):
+    """Run the shots of a circuit, branching at every measurement and reset.
+
+    Trajectories are run depth first, so only one state per pending branch
+    is alive at once. The copies are taken from, and given back to, the
+    state pool.
+
+    Args:
+        engine (BaseEngine): the engine of the state.
+        pool (StatePool): the pool the copies of the state are taken from.
+        sim (object): the state, in its initial state.
+        operations (list): ``('program', CompiledCircuit)``,
+            ``('measure', qubit, clbit)`` or ``('reset', qubit)`` tuples,
+            ``('bfunc', mask, value, relation, bit)`` setting a register bit
+            to ``relation(register & mask, value)``, or
+            ``('if', mask, value, operation)`` for an operation only applied
+            when ``register & mask == value``.
+        shots (int): the number of shots.
+        generator (numpy.random.Generator): the source of randomness.
+        finish (callable): called as ``finish(sim, shots, register)`` at the
+            end of every trajectory, with the classical register of its
+            measurements, and the register bits of its ``bfunc``.
+
+    Returns:
+        list: the return values of ``finish``, for every trajectory.
+
+    Raises:
+        QCGPUSimulatorError: if a copy of the state doesn't fit in memory.
+    """
+    results = []
+    pending = [(sim, 0, 0, shots)]
+    state = sim
+
+    try:
+        while pending:
+            state, position, register, count = pending.pop()
+
+            for position in range(position, len(operations)):
+                operation = operations[position]
+                if operation[0] == 'if':
+                    _, mask, value, operation = operation
+                    if register & mask != value:
+                        continue
+
+                if operation[0] == 'program':
+                    operation[1].run(state)
+                    continue
+
+                if operation[0] == 'bfunc':
+                    _, mask, value, relation, bit = operation
+                    if relation(register & mask, value):
+                        register |= 1 << bit
+                    else:
+                        register &= ~(1 << bit)
+                    continue
+
+                probabilities = engine.marginal_probabilities(state, [operation[1]])
+                one = float(probabilities[1] / probabilities.sum())
+                ones = int(generator.binomial(count, one))
+
+                if 0 < ones < count:
+                    branch = pool.acquire(engine, state.num_qubits)
+                    engine.copy_state(state, branch)
+                    branch_register = _take_outcome(engine, branch, operation, 1, one,
+                                                    register)
+                    pending.append((branch, position + 1, branch_register, ones))
+                    count -= ones
+                    outcome = 0
+                else:
+                    outcome = 1 if ones else 0
+
+                register = _take_outcome(engine, state, operation, outcome,
+                                         one if outcome else 1 - one, register)
+
+            results.append(finish(state, count, register))
+            if state is not sim:
+                pool.release(engine, state)
+    except OverflowError:
+        # The copies which were taken go back to the pool
+        for branch in [state] + [entry[0] for entry in pending]:
+            if branch is not sim:
+                pool.release(engine, branch)
+        raise QCGPUSimulatorError('too many qubits')
+
+    return results
+
+
+def merge_samples(samples, memory, generator):
+    """Merge the counts and memory of several trajectories.
+
+    Args:
+        samples (list): ``(counts, memory_values)`` of every trajectory.
+        memory (bool): whether per-shot memory was requested.
+        generator (numpy.random.Generator): shuffles the memory, so that
+            the shots of a trajectory aren't listed together.
+
+    Returns:
+        tuple: the merged counts, and memory values (``None`` if memory was
+            not requested).
+    """
+    counts = {}
+    memory_values = [] if memory else None
+    for trajectory_counts, trajectory_memory in samples:
+        for key, count in trajectory_counts.items():
+            counts[key] = counts.get(key, 0) + count
+        if memory:
+            memory_values.extend(trajectory_memory)
+
+    if memory:
+        memory_values = [memory_values[index]
+                         for index in generator.permutation(len(memory_values))]
+    return counts, memory_values
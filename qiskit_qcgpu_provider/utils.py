@@ -0,0 +1,128 @@
+"""
+Helpers shared by the QCGPU backends.
+"""
+
+from concurrent import futures
+import os
+import threading
+
+import numpy as np
+
+from .simulatorerror import QCGPUSimulatorError
+
+
+def set_backend_options(qobj, backend_options):
+    """Copy backend options into the qobj config.
+
+    The backends read all of their options from the qobj config, so options
+    can either be passed to ``run`` or set on the qobj directly.
+
+    Args:
+        qobj (Qobj): the qobj being run.
+        backend_options (dict): options to add to ``qobj.config``.
+    """
+    for key, value in (backend_options or {}).items():
+        setattr(qobj.config, key, value)
+
+
+def get_option(qobj_config, name, default_options):
+    """Get a backend option from a qobj config, falling back to the default.
+
+    Args:
+        qobj_config (QobjConfig): the config of the qobj being run.
+        name (str): the option name.
+        default_options (dict): the defaults of the backend.
+
+    Returns:
+        object: the value of the option.
+    """
+    value = getattr(qobj_config, name, None)
+    if value is None:
+        value = default_options[name]
+    return value
+
+
+def run_experiments(func, experiments, max_parallel, cancel_event=None):
+    """Run ``func`` on every experiment, using up to ``max_parallel`` workers.
+
+    Results are returned in the order of ``experiments``, whatever order the
+    workers finish in.
+
+    Args:
+        func (callable): called as ``func(index, experiment)``.
+        experiments (list): the experiments to run.
+        max_parallel (int): maximum number of experiments run at once, or 0
+            to use one worker per CPU.
+        cancel_event (threading.Event): when set, experiments that haven't
+            started yet are not run.
+
+    Returns:
+        list: the return values of ``func``.
+
+    Raises:
+        CancelledError: if ``cancel_event`` was set before every experiment
+            was started.
+    """
+    def _run(index):
+        if cancel_event is not None and cancel_event.is_set():
+            raise futures.CancelledError('Job was cancelled')
+        return func(index, experiments[index])
+
+    indices = range(len(experiments))
+    if max_parallel == 0:
+        max_parallel = os.cpu_count() or 1
+    if max_parallel <= 1 or len(experiments) <= 1:
+        return [_run(index) for index in indices]
+
+    with futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        return list(executor.map(_run, indices))
+
+
+def worker_timing(start, end):
+    """Timing metadata of an experiment, including the worker that ran it.
+
+    Args:
+        start (float): time the experiment started, from ``time.time()``.
+        end (float): time the experiment finished, from ``time.time()``.
+
+    Returns:
+        dict: metadata to add to the experiment result.
+    """
+    return {'worker': threading.current_thread().name,
+            'time_started': start,
+            'time_finished': end}
+
+
+def get_parameter_sweep(experiment, qobj_config, slots):
+    """Get the parameter values an experiment is swept over, if any.
+
+    The values are given by the ``parameter_sweep`` option of the experiment
+    or qobj config, as a 2-D array with a row for every binding. The columns
+    are the parameters of the experiment's instructions, in order.
+
+    Args:
+        experiment (QobjExperiment): a qobj experiment.
+        qobj_config (QobjConfig): configuration of the qobj.
+        slots (list): the ``parameter_slots`` of the experiment.
+
+    Returns:
+        ndarray: ``float64`` array of shape ``(bindings, parameters)``, or
+            ``None`` if the experiment isn't swept.
+
+    Raises:
+        QCGPUSimulatorError: if the values don't fit the parameters of the
+            experiment.
+    """
+    values = getattr(getattr(experiment, 'config', None), 'parameter_sweep', None)
+    if values is None:
+        values = getattr(qobj_config, 'parameter_sweep', None)
+    if values is None:
+        return None
+
+    values = np.asarray(values, dtype=np.float64)
+    num_parameters = sum(count for _, count in slots)
+    if values.ndim != 2 or values.shape[1] != num_parameters:
+        raise QCGPUSimulatorError(
+            'parameter_sweep must have shape (bindings, {}), not {}'.format(
+                num_parameters, values.shape))
+    return values
@@ -0,0 +1,130 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider.compiler import (compile_instructions, CompiledCircuitCache,
+                                            parameter_slots, assign_parameters, can_sample,
+                                            structure_key, OPCODES)
+
+from .case import MyTestCase
+
+
+class RecordingState:
+    """Records the calls made to a state."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class TestCompiler(MyTestCase):
+    """Test the compiled instruction table"""
+
+    def setUp(self):
+        self.instructions = [{'name': 'h', 'qubits': [0]},
+                             {'name': 'barrier', 'qubits': [0, 1]},
+                             {'name': 'cx', 'qubits': [0, 1]},
+                             {'name': 'id', 'qubits': [1]},
+                             {'name': 'u3', 'qubits': [1], 'params': [0.1, 0.2, 0.3]},
+                             {'name': 'u1', 'qubits': [0], 'params': [0.5]},
+                             {'name': 'measure', 'qubits': [1], 'memory': [0]}]
+
+    def test_arrays(self):
+        program = compile_instructions(self.instructions)
+        self.assertEqual(len(program), 4)
+        self.assertEqual([OPCODES[opcode] for opcode in program.opcodes],
+                         ['h', 'cx', 'u3', 'u1'])
+        self.assertEqual(program.qubits.tolist(),
+                         [[0, -1, -1], [0, 1, -1], [1, -1, -1], [0, -1, -1]])
+        self.assertEqual(program.params.dtype, np.float64)
+        self.assertEqual(program.measurements, [(1, 0)])
+
+    def test_run_is_repeatable(self):
+        program = compile_instructions(self.instructions)
+        expected = [('h', 0), ('cx', 0, 1), ('u', 1, 0.1, 0.2, 0.3), ('u1', 0, 0.5)]
+        for _ in range(2):
+            sim = RecordingState()
+            program.run(sim)
+            self.assertEqual(sim.calls, expected)
+
+    def test_cache_binds_new_parameters(self):
+        cache = CompiledCircuitCache(max_size=1)
+        program, hit = cache.get(self.instructions)
+        self.assertFalse(hit)
+
+        rebound = [dict(instruction) for instruction in self.instructions]
+        rebound[4]['params'] = [1.0, 2.0, 3.0]
+        program, hit = cache.get(rebound)
+        self.assertTrue(hit)
+        self.assertEqual(program.params[2].tolist(), [1.0, 2.0, 3.0])
+
+        other = self.instructions[:2]
+        cache.get(other)
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 2, 'size': 1, 'max_size': 1})
+
+    def test_cache_binds_fused_parameters(self):
+        cache = CompiledCircuitCache()
+        instructions = [{'name': 'u1', 'qubits': [0], 'params': [0.25]},
+                        {'name': 'u1', 'qubits': [0], 'params': [0.5]}]
+        program, _ = cache.get(instructions, fusion=True)
+        self.assertEqual(len(program), 1)
+        self.assertAlmostEqual(program.params[0, 0], 0.75)
+
+        instructions[1] = {'name': 'u1', 'qubits': [0], 'params': [1.0]}
+        program, hit = cache.get(instructions, fusion=True)
+        self.assertTrue(hit)
+        self.assertAlmostEqual(program.params[0, 0], 1.25)
+
+    def test_unitary(self):
+        """Test unitaries keep all their qubits, and matrices serialized as pairs."""
+        swap = [[[1, 0], [0, 0], [0, 0], [0, 0]],
+                [[0, 0], [0, 0], [1, 0], [0, 0]],
+                [[0, 0], [1, 0], [0, 0], [0, 0]],
+                [[0, 0], [0, 0], [0, 0], [1, 0]]]
+        instructions = [{'name': 'unitary', 'qubits': [3, 1], 'params': [swap]}]
+        cache = CompiledCircuitCache()
+        program, _ = cache.get(instructions)
+        opcode, qubits, matrix = program.steps()[0]
+        self.assertEqual(OPCODES[opcode], 'unitary')
+        self.assertEqual(qubits, [3, 1])
+        np.testing.assert_array_equal(matrix, np.eye(4)[[0, 2, 1, 3]])
+
+        program, hit = cache.get([dict(instructions[0], params=[np.eye(4)])])
+        self.assertTrue(hit)
+        np.testing.assert_array_equal(program.steps()[0][2], np.eye(4))
+
+    def test_assign_parameters(self):
+        slots = parameter_slots(self.instructions)
+        self.assertEqual(slots, [(4, 3), (5, 1)])
+
+        bound = assign_parameters(self.instructions, slots, [1.0, 2.0, 3.0, 4.0])
+        program = compile_instructions(self.instructions).bind(bound)
+        self.assertEqual(program.params[2:].tolist(), [[1.0, 2.0, 3.0], [4.0, 0.0, 0.0]])
+        self.assertEqual(self.instructions[4]['params'], [0.1, 0.2, 0.3])
+
+    def test_can_sample(self):
+        self.assertTrue(can_sample(self.instructions))
+        # The target of the cx was measured before it
+        self.assertFalse(can_sample([{'name': 'measure', 'qubits': [1], 'memory': [0]},
+                                     {'name': 'cx', 'qubits': [0, 1]},
+                                     {'name': 'measure', 'qubits': [1], 'memory': [1]}]))
+
+    def test_bfunc_conditions(self):
+        """Test qiskit's assembled conditions, a bfunc and a register bit."""
+        instructions = [{'name': 'measure', 'qubits': [0], 'memory': [0]},
+                        {'name': 'bfunc', 'mask': '0x1', 'relation': '==', 'val': '0x1',
+                         'register': 1},
+                        {'name': 'x', 'qubits': [1], 'conditional': 1}]
+        program = compile_instructions(instructions)
+        self.assertEqual(len(program), 1)
+        self.assertEqual(program.ignored, set())
+        self.assertFalse(program.can_sample)
+        self.assertNotEqual(structure_key(instructions),
+                            structure_key(instructions[:2] + [dict(instructions[2],
+                                                                   conditional=2)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
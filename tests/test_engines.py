@@ -0,0 +1,162 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider import sharding
+from qiskit_qcgpu_provider.engines import (ENGINES, NumpyEngine, NumpyState, ShardedEngine,
+                                           select_engine, calibrate)
+from qiskit_qcgpu_provider.fusion import gate_matrix
+
+from .case import MyTestCase
+
+
+class TestNumpyEngine(MyTestCase):
+    """Test the numpy engine"""
+
+    def test_gates_match_matrices(self):
+        """Test that the gate methods agree with apply_matrix."""
+        cx = np.array([[1, 0, 0, 0],
+                       [0, 0, 0, 1],
+                       [0, 0, 1, 0],
+                       [0, 1, 0, 0]], dtype=complex)
+
+        gates = NumpyState(3)
+        matrices = NumpyState(3)
+        for qubit in range(3):
+            gates.h(qubit)
+            matrices.apply_matrix(gate_matrix('h', []), [qubit])
+        gates.u(1, 0.1, 0.2, 0.3)
+        matrices.apply_matrix(gate_matrix('u3', [0.1, 0.2, 0.3]), [1])
+        gates.t(2)
+        matrices.apply_matrix(gate_matrix('t', []), [2])
+        gates.cx(2, 0)
+        matrices.apply_matrix(cx, [2, 0])
+
+        np.testing.assert_allclose(gates.amplitudes(), matrices.amplitudes(), atol=1e-12)
+        self.assertAlmostEqual(gates.probabilities().sum(), 1)
+
+    def test_native_gates_match_matrices(self):
+        """Test the gates without a qcgpu equivalent against apply_matrix."""
+        ccx = np.eye(8, dtype=complex)[[0, 1, 2, 3, 4, 5, 7, 6]]
+        swap = np.eye(4, dtype=complex)[[0, 2, 1, 3]]
+
+        gates = NumpyState(3)
+        matrices = NumpyState(3)
+        for qubit in range(3):
+            gates.h(qubit)
+            matrices.apply_matrix(gate_matrix('h', []), [qubit])
+        gates.cu1(2, 0, 0.4)
+        matrices.apply_matrix(np.diag([1, 1, 1, np.exp(0.4j)]), [0, 2])
+        gates.rx(1, 0.5)
+        matrices.apply_matrix(gate_matrix('rx', [0.5]), [1])
+        gates.swap(0, 1)
+        matrices.apply_matrix(swap, [0, 1])
+        gates.ccx(0, 2, 1)
+        matrices.apply_matrix(ccx, [1, 0, 2])
+
+        np.testing.assert_allclose(gates.amplitudes(), matrices.amplitudes(), atol=1e-12)
+
+    def test_reset_state(self):
+        engine = NumpyEngine()
+        sim = engine.create_state(3)
+        sim.x(1)
+        engine.reset_state(sim)
+        self.assertEqual(sim.amplitudes().tolist(), [1] + [0] * 7)
+
+    def test_marginal_probabilities(self):
+        engine = NumpyEngine()
+        sim = engine.create_state(3)
+        sim.h(0)
+        sim.cx(0, 2)
+        sim.x(1)
+
+        np.testing.assert_allclose(engine.marginal_probabilities(sim, [1]), [0, 1])
+        np.testing.assert_allclose(engine.marginal_probabilities(sim, [0, 2]),
+                                   [0.5, 0, 0, 0.5])
+        np.testing.assert_allclose(engine.marginal_probabilities(sim, [1, 0]),
+                                   [0, 0.5, 0, 0.5])
+
+    def test_auto_selects_numpy_for_small_circuits(self):
+        engine, selection = select_engine('auto', 2, 10)
+        self.assertEqual(engine.name, 'numpy')
+        self.assertEqual(selection['option'], 'auto')
+        self.assertIn('numpy', selection['estimates'])
+
+    def test_auto_leaves_out_opt_in_engines(self):
+        _, selection = select_engine('auto', 24, 10)
+        self.assertNotIn('sharded', selection['estimates'])
+        if ENGINES['sharded'].available():
+            _, selection = select_engine('auto', 24, 10, opt_in=True)
+            self.assertIn('sharded', selection['estimates'])
+        self.assertEqual(select_engine('sharded', 24)[1]['reason'], 'requested')
+
+    def test_calibrate(self):
+        engine = ENGINES['numpy']
+        defaults = (engine.gate_overhead, engine.amplitude_time, engine.calibrated)
+        try:
+            fitted = calibrate(widths=(2, 4, 6), num_gates=4)
+            self.assertEqual(fitted['numpy'], (engine.gate_overhead, engine.amplitude_time))
+            self.assertTrue(all(value >= 0 for value in fitted['numpy']))
+        finally:
+            engine.gate_overhead, engine.amplitude_time, engine.calibrated = defaults
+
+
+@unittest.skipIf(sharding.shared_memory is None, 'needs multiprocessing.shared_memory')
+class TestShardedEngine(MyTestCase):
+    """Test the sharded engine"""
+
+    def setUp(self):
+        self.engine = ShardedEngine(processes=4)
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_matches_numpy_engine(self):
+        """Test gates on local and global qubits, and controls across shards."""
+        sharded = self.engine.create_state(5)
+        reference = NumpyState(5)
+        self.assertEqual(sharded.num_shards, 4)
+
+        for sim in [sharded, reference]:
+            for qubit in range(5):
+                sim.h(qubit)
+            sim.u(4, 0.1, 0.2, 0.3)
+            sim.cx(4, 0)
+            sim.cx(1, 3)
+            sim.cx(3, 4)
+            sim.t(3)
+            sim.u2(0, 0.4, 0.5)
+            sim.cu1(3, 0, 0.6)
+            sim.cz(1, 4)
+            sim.swap(0, 4)
+            sim.ccx(4, 3, 1)
+            sim.ry(3, 0.7)
+
+        np.testing.assert_allclose(sharded.amplitudes(), reference.amplitudes(), atol=1e-12)
+        sharded.close()
+
+
+@unittest.skipIf(not ENGINES['qcgpu'].available(), 'needs qcgpu and an OpenCL device')
+class TestQCGPUEngine(MyTestCase):
+    """Test the qcgpu engine"""
+
+    def test_matches_numpy_engine(self):
+        """Test the gates keep the global phase of the qiskit gates."""
+        engine = ENGINES['qcgpu']
+        sim = engine.create_state(3)
+        reference = NumpyState(3)
+
+        for state in [sim, reference]:
+            state.h(0)
+            state.u(1, 0.1, 0.2, 0.3)
+            state.u2(2, 0.4, 0.5)
+            state.u1(0, 0.6)
+            state.cx(0, 2)
+            state.cu1(2, 1, 0.7)
+            state.rz(1, 0.8)
+
+        np.testing.assert_allclose(sim.amplitudes(), reference.amplitudes(), atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import math
+
+import numpy as np
+
+from qiskit_qcgpu_provider.compiler import compile_instructions
+from qiskit_qcgpu_provider.fusion import (DiagonalRun, diagonal_plan, fusion_plan,
+                                          fuse_instructions, count_gates,
+                                          gate_matrix, matrix_to_u3, u3_matrix)
+from qiskit_qcgpu_provider.numpy_state import NumpyState
+
+from .case import MyTestCase
+
+
+class TestFusion(MyTestCase):
+    """Test the gate fusion pass"""
+
+    def test_matrix_to_u3(self):
+        for name, params in [('h', []), ('x', []), ('y', []), ('s', []),
+                             ('u1', [0.3]), ('u2', [0.1, -2.0]), ('u3', [1.2, 0.4, -0.7])]:
+            matrix = gate_matrix(name, params)
+            fused = u3_matrix(*matrix_to_u3(matrix))
+            overlap = abs(np.trace(fused.conj().T @ matrix)) / 2
+            self.assertAlmostEqual(overlap, 1, 10)
+
+    def test_single_qubit_runs(self):
+        instructions = [{'name': 'h', 'qubits': [0]},
+                        {'name': 't', 'qubits': [0]},
+                        {'name': 'x', 'qubits': [1]},
+                        {'name': 'h', 'qubits': [0]},
+                        {'name': 'x', 'qubits': [1]},
+                        {'name': 'measure', 'qubits': [0], 'memory': [0]}]
+        fused = fuse_instructions(instructions)
+        self.assertEqual(count_gates(instructions), 5)
+        # x.x on qubit 1 is the identity, and is removed
+        self.assertEqual(count_gates(fused), 1)
+        self.assertEqual(fused[0]['name'], 'u3')
+        self.assertEqual(fused[-1]['name'], 'measure')
+
+    def test_diagonal_through_control(self):
+        instructions = [{'name': 'u1', 'qubits': [0], 'params': [math.pi / 4]},
+                        {'name': 'cx', 'qubits': [0, 1]},
+                        {'name': 'u1', 'qubits': [0], 'params': [math.pi / 4]},
+                        {'name': 'cx', 'qubits': [1, 0]}]
+        fused = fuse_instructions(instructions)
+        self.assertEqual([instruction['name'] for instruction in fused],
+                         ['cx', 'u1', 'cx'])
+        self.assertAlmostEqual(fused[1]['params'][0], math.pi / 2)
+
+    def test_diagonal_runs(self):
+        """Test the controlled phases of a QFT are applied as one diagonal per step."""
+        instructions = [{'name': 'x', 'qubits': [1]}]
+        for target in range(4):
+            instructions.append({'name': 'h', 'qubits': [target]})
+            for control in range(target + 1, 4):
+                instructions.append({'name': 'cu1', 'qubits': [control, target],
+                                     'params': [math.pi / 2 ** (control - target)]})
+        instructions.append({'name': 'rz', 'qubits': [0], 'params': [0.3]})
+
+        plan = diagonal_plan(instructions, fusion_plan(instructions))
+        runs = [entry for entry in plan if isinstance(entry, DiagonalRun)]
+        self.assertEqual([len(run) for run in runs], [3, 2, 2])
+        self.assertEqual(runs[0].qubits, [1, 0, 2, 3])
+
+        fused = NumpyState(4)
+        compile_instructions(instructions, fusion=True).run(fused)
+        reference = NumpyState(4)
+        compile_instructions(instructions).run(reference)
+        np.testing.assert_allclose(fused.amplitudes(), reference.amplitudes(), atol=1e-12)
+
+    def test_global_phase(self):
+        """Test fused programs keep the global phase of the gates."""
+        instructions = [{'name': 'x', 'qubits': [0]},
+                        {'name': 'z', 'qubits': [0]},
+                        {'name': 'h', 'qubits': [1]},
+                        {'name': 'rz', 'qubits': [1], 'params': [0.3]},
+                        {'name': 't', 'qubits': [1]},
+                        {'name': 'cx', 'qubits': [1, 0]},
+                        {'name': 'ry', 'qubits': [0], 'params': [0.4]},
+                        {'name': 'u2', 'qubits': [0], 'params': [0.1, 0.2]}]
+        program = compile_instructions(instructions, fusion=True, global_phase=True)
+        rebound = [dict(instruction, params=[2 * param for param in instruction['params']])
+                   if 'params' in instruction else instruction
+                   for instruction in instructions]
+
+        for bound, fused_program in [(instructions, program),
+                                     (rebound, program.bind(rebound))]:
+            fused = NumpyState(2)
+            fused_program.run(fused)
+            reference = NumpyState(2)
+            compile_instructions(bound).run(reference)
+            np.testing.assert_allclose(fused.amplitudes(), reference.amplitudes(), atol=1e-12)
+
+        # x.z on |0> is -|1>
+        fused = NumpyState(1)
+        compile_instructions(instructions[:2], fusion=True, global_phase=True).run(fused)
+        np.testing.assert_allclose(fused.amplitudes(), [0, -1], atol=1e-12)
+        # Counts don't depend on the phase, so qasm programs leave it out
+        self.assertEqual(len(compile_instructions(instructions[:2], fusion=True)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider.compiler import compile_instructions
+from qiskit_qcgpu_provider.noise import (NoiseModel, TrajectoryBatch, apply_readout_error,
+                                         sample_noisy, sample_rows)
+from qiskit_qcgpu_provider.simulatorerror import QCGPUSimulatorError
+
+from .case import MyTestCase
+
+
+class TestNoise(MyTestCase):
+    """Test the noise models and their trajectories"""
+
+    def setUp(self):
+        self.generator = np.random.default_rng(5)
+
+    def test_noise_model(self):
+        noise_model = NoiseModel(depolarizing=0.1, amplitude_damping={'cx': 0.2},
+                                 readout=[0.01, 0.02])
+        self.assertEqual(noise_model.gate_errors('h'), (0.1, 0.0))
+        self.assertEqual(noise_model.gate_errors('cx'), (0.1, 0.2))
+        self.assertEqual(NoiseModel.from_dict(noise_model.to_dict()).to_dict(),
+                         noise_model.to_dict())
+        self.assertFalse(NoiseModel(readout=[0.1, 0.1]).has_gate_errors)
+        with self.assertRaises(QCGPUSimulatorError):
+            NoiseModel(depolarizing=2)
+
+    def test_batch_applies_gates_to_every_trajectory(self):
+        batch = TrajectoryBatch(2, 3)
+        batch.state.h(0)
+        batch.state.cx(0, 1)
+        for probabilities in batch.marginal_probabilities([0, 1]):
+            np.testing.assert_allclose(probabilities, [0.5, 0, 0, 0.5])
+
+    def test_depolarizing_rate(self):
+        program = compile_instructions([{'name': 'id', 'qubits': [0]},
+                                        {'name': 'x', 'qubits': [0]}])
+        samples = sample_noisy(program, NoiseModel(depolarizing=0.3), 1, [0], 20000, 5000,
+                               self.generator, 2 ** 20)
+        # An x or y error flips the qubit back to 0
+        self.assertAlmostEqual(1 - samples.mean(), 0.2, delta=0.02)
+
+    def test_sample_rows(self):
+        probabilities = np.array([[1.0, 0, 0], [0, 0, 2.0]])
+        samples = sample_rows(probabilities, np.array([3, 2]), self.generator)
+        self.assertEqual(samples.tolist(), [0, 0, 0, 2, 2])
+
+    def test_readout_error(self):
+        outcomes = np.full(100000, 2, dtype=np.int64)
+        read = apply_readout_error(outcomes, 2, (0.1, 0.2), self.generator)
+        self.assertAlmostEqual((read & 1).mean(), 0.1, delta=0.01)
+        self.assertAlmostEqual((read >> 1).mean(), 0.8, delta=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from functools import reduce
+
+import numpy as np
+
+from qiskit_qcgpu_provider.engines import ENGINES, pauli_expectations
+from qiskit_qcgpu_provider.observables import (parse_pauli, parse_observables,
+                                               expectation_values)
+from qiskit_qcgpu_provider.reduction import split_clusters, combine_statevectors
+from qiskit_qcgpu_provider.numpy_state import NumpyState
+from qiskit_qcgpu_provider.simulatorerror import QCGPUSimulatorError
+
+from .case import MyTestCase
+
+PAULIS = {'I': np.eye(2), 'X': np.array([[0, 1], [1, 0]]),
+          'Y': np.array([[0, -1j], [1j, 0]]), 'Z': np.diag([1, -1])}
+
+
+def pauli_matrix(label):
+    return reduce(np.kron, [PAULIS[pauli] for pauli in label])
+
+
+def random_statevector(generator, num_qubits):
+    statevector = generator.normal(size=2 ** num_qubits) + 1j * generator.normal(
+        size=2 ** num_qubits)
+    return statevector / np.linalg.norm(statevector)
+
+
+class TestObservables(MyTestCase):
+    """Test the expectation values of Pauli strings"""
+
+    def setUp(self):
+        self.generator = np.random.default_rng(5)
+
+    def test_parse_pauli(self):
+        self.assertEqual(parse_pauli('XIYZ', 4), (0b1010, 0b0011))
+        with self.assertRaises(QCGPUSimulatorError):
+            parse_pauli('XA', 2)
+        with self.assertRaises(QCGPUSimulatorError):
+            parse_pauli('XZ', 3)
+
+    def test_pauli_expectations(self):
+        statevector = random_statevector(self.generator, 4)
+        labels = ['IIII', 'ZIZI', 'ZZZZ', 'XYZI', 'YYII', 'IXXI', 'YIIY']
+        values = pauli_expectations(statevector, [parse_pauli(label, 4) for label in labels])
+        expected = [np.vdot(statevector, pauli_matrix(label) @ statevector).real
+                    for label in labels]
+        np.testing.assert_allclose(values, expected, atol=1e-12)
+
+    def test_clusters(self):
+        instructions = [{'name': 'h', 'qubits': [0]}, {'name': 'cx', 'qubits': [0, 2]},
+                        {'name': 'h', 'qubits': [1]}]
+        clusters = split_clusters(instructions, 4)
+        statevectors = [random_statevector(self.generator, cluster.num_qubits)
+                        for cluster in clusters]
+        sims = [NumpyState(cluster.num_qubits, vector=statevector)
+                for cluster, statevector in zip(clusters, statevectors)]
+        statevector = combine_statevectors(clusters, statevectors, 4)
+
+        observables = [[[0.5, 'XIYZ'], [2, 'ZZII'], [-1, 'IIII']], [[1, 'YXYX']]]
+        values = expectation_values(ENGINES['numpy'], sims, clusters,
+                                    parse_observables(observables, 4))
+        expected = [sum(coefficient * np.vdot(statevector,
+                                              pauli_matrix(label) @ statevector).real
+                        for coefficient, label in observable)
+                    for observable in observables]
+        np.testing.assert_allclose(values, expected, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
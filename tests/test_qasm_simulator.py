@@ -1,7 +1,9 @@
 from qiskit_qcgpu_provider import QCGPUProvider
 from qiskit import ClassicalRegister, QuantumRegister, QuantumCircuit
 from qiskit.compiler import assemble
+from qiskit.providers import JobStatus
 
+import math
 import unittest
 
 from .case import MyTestCase
@@ -59,6 +61,207 @@ class TestQasmSimulator(MyTestCase):
         for mem in memory:
             self.assertIn(mem, ['10 00', '10 11'])
 
+    def test_partial_measurement(self):
+        """Test sampling when only some, non-contiguous qubits are measured."""
+        qr = QuantumRegister(4, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.x(qr[1])
+        circ.x(qr[3])
+        circ.h(qr[0])
+        circ.measure(qr[3], cr[0])
+        circ.measure(qr[2], cr[1])
+
+        shots = 100
+        qobj = assemble(circ, backend=self.sim, shots=shots, memory=True)
+        result = self.sim.run(qobj).result()
+        self.assertEqual(result.get_counts(), {'01': shots})
+        self.assertEqual(result.get_memory(), ['01'] * shots)
+
+    def test_mid_circuit_measurement(self):
+        """Test measurements and resets followed by more gates."""
+        qr = QuantumRegister(3, 'qr')
+        cr = ClassicalRegister(3, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.h(qr[0])
+        circ.measure(qr[0], cr[0])
+        circ.cx(qr[0], qr[1])
+        circ.x(qr[2])
+        circ.reset(qr[2])
+        circ.measure(qr[1], cr[1])
+        circ.measure(qr[2], cr[2])
+
+        shots = 1000
+        qobj = assemble(circ, backend=self.sim, shots=shots, memory=True, seed=self.seed)
+        result = self.sim.run(qobj).result()
+        counts = result.get_counts()
+        self.assertEqual(set(counts), {'000', '011'})
+        self.assertAlmostEqual(counts['011'] / shots, 0.5, delta=0.1)
+        self.assertEqual(sorted(result.get_memory()),
+                         sorted(['000'] * counts['000'] + ['011'] * counts['011']))
+
+    def test_measurement_before_controlled_gate(self):
+        """Test a measured qubit which is the target of a later gate."""
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.x(qr[0])
+        circ.measure(qr[1], cr[0])
+        circ.cx(qr[0], qr[1])
+        circ.measure(qr[1], cr[1])
+
+        qobj = assemble(circ, backend=self.sim, shots=100, seed=self.seed)
+        counts = self.sim.run(qobj).result().get_counts()
+        self.assertEqual(counts, {'10': 100})
+
+    def test_conditional(self):
+        """Test gates conditioned on mid-circuit measurements."""
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.h(qr[0])
+        circ.measure(qr[0], cr[0])
+        circ.x(qr[1]).c_if(cr, 1)
+        circ.x(qr[0]).c_if(cr, 1)
+        circ.measure(qr[0], cr[0])
+        circ.measure(qr[1], cr[1])
+
+        shots = 1000
+        qobj = assemble(circ, backend=self.sim, shots=shots, seed=self.seed)
+        counts = self.sim.run(qobj).result().get_counts()
+        self.assertEqual(set(counts), {'00', '10'})
+        self.assertAlmostEqual(counts['10'] / shots, 0.5, delta=0.1)
+
+    def test_conditional_after_unconditional(self):
+        """Test that a c_if gate doesn't reuse the program of the same gate without it."""
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        circs = []
+        for conditional in [False, True]:
+            circ = QuantumCircuit(qr, cr)
+            circ.h(qr[0])
+            circ.measure(qr[0], cr[0])
+            gate = circ.x(qr[1])
+            if conditional:
+                gate.c_if(cr, 1)
+            circ.measure(qr[1], cr[1])
+            circs.append(circ)
+
+        shots = 1000
+        counts = [self.sim.run(assemble(circ, backend=self.sim, shots=shots,
+                                        seed=self.seed)).result().get_counts()
+                  for circ in circs]
+        self.assertEqual(set(counts[0]), {'10', '11'})
+        self.assertEqual(set(counts[1]), {'00', '11'})
+        self.assertAlmostEqual(counts[1]['11'] / shots, 0.5, delta=0.1)
+
+    def test_counts_without_memory(self):
+        """Test counts are seeded and complete when memory is not requested."""
+        shots = 100000
+        self.qobj.config.shots = shots
+        self.qobj.config.memory = False
+        self.qobj.config.seed = self.seed
+        result = self.sim.run(self.qobj).result()
+        counts = result.get_counts()
+        self.assertEqual(sum(counts.values()), shots)
+        self.assertEqual(len(counts), 8)
+        self.assertRaises(Exception, result.get_memory)
+
+        repeat = self.sim.run(self.qobj).result()
+        self.assertEqual(repeat.get_counts(), counts)
+
+    def test_job_is_asynchronous(self):
+        """Test that run returns a job that finishes on the executor."""
+        self.qobj.config.shots = 1024
+        job = self.sim.run(self.qobj)
+        self.assertIn(job.status(), [JobStatus.INITIALIZING, JobStatus.RUNNING,
+                                     JobStatus.DONE])
+        result = job.result(timeout=60)
+        self.assertEqual(result.success, True)
+        self.assertEqual(job.status(), JobStatus.DONE)
+
+    def test_warmup(self):
+        """Test that jobs run after the device is warmed up."""
+        self.sim.warmup()
+        self.qobj.config.shots = 16
+        result = self.sim.run(self.qobj).result()
+        self.assertEqual(result.success, True)
+
+    def test_parameter_sweep(self):
+        """Test sweeping one circuit over several angles."""
+        qr = QuantumRegister(1, 'qr')
+        cr = ClassicalRegister(1, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.u3(0, 0, 0, qr[0])
+        circ.measure(qr[0], cr[0])
+
+        shots = 100
+        qobj = assemble(circ, backend=self.sim, shots=shots)
+        sweep = [[0, 0, 0], [math.pi, 0, 0], [0, 1, 2]]
+        result = self.sim.run(qobj, backend_options={'parameter_sweep': sweep}).result()
+        self.assertEqual(result.data(circ)['sweep_counts'],
+                         [{'0x0': shots}, {'0x1': shots}, {'0x0': shots}])
+
+    def test_clusters(self):
+        """Test that qubits which never interact are sampled together."""
+        qr = QuantumRegister(4, 'qr')
+        cr = ClassicalRegister(4, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.h(qr[0])
+        circ.cx(qr[0], qr[2])
+        circ.h(qr[1])
+        circ.cx(qr[1], qr[3])
+        circ.measure(qr, cr)
+
+        shots = 2000
+        qobj = assemble(circ, backend=self.sim, shots=shots, seed=self.seed, memory=True)
+        result = self.sim.run(qobj).result()
+        counts = result.get_counts()
+        self.assertEqual(set(counts), {'0000', '0101', '1010', '1111'})
+        self.assertEqual(len(result.get_memory()), shots)
+        for count in counts.values():
+            self.assertAlmostEqual(count / shots, 0.25, delta=0.05)
+        self.assertEqual(result.results[0].metadata['clusters'], [2, 2])
+
+        # Without memory, the counts of the clusters are drawn and combined
+        qobj = assemble(circ, backend=self.sim, shots=shots, seed=self.seed)
+        counts = self.sim.run(qobj).result().get_counts()
+        self.assertEqual(set(counts), {'0000', '0101', '1010', '1111'})
+        self.assertEqual(sum(counts.values()), shots)
+        for count in counts.values():
+            self.assertAlmostEqual(count / shots, 0.25, delta=0.05)
+
+    def test_no_clbits(self):
+        """Test that circuits without classical bits have no counts."""
+        qr = QuantumRegister(2, 'qr')
+        circ = QuantumCircuit(qr)
+        circ.h(qr[0])
+        circ.x(qr[1])
+
+        qobj = assemble(circ, backend=self.sim, shots=100, seed=self.seed)
+        result = self.sim.run(qobj).result()
+        self.assertEqual(result.data(0)['counts'], {})
+
+    def test_noise_model(self):
+        """Test amplitude damping and readout errors."""
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        circ = QuantumCircuit(qr, cr)
+        circ.x(qr[0])
+        circ.measure(qr, cr)
+
+        shots = 2000
+        qobj = assemble(circ, backend=self.sim, shots=shots, seed=self.seed)
+        noise_model = {'amplitude_damping': {'x': 0.5}, 'readout': [0.1, 0]}
+        counts = self.sim.run(qobj, backend_options={'noise_model': noise_model}).result(
+        ).get_counts()
+        self.assertEqual(sum(counts.values()), shots)
+        # Qubit 0 decays half of the time, qubit 1 is read as 1 a tenth of the time
+        self.assertAlmostEqual((counts.get('01', 0) + counts.get('11', 0)) / shots, 0.5,
+                               delta=0.1)
+        self.assertAlmostEqual((counts.get('10', 0) + counts.get('11', 0)) / shots, 0.1,
+                               delta=0.05)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider.reduction import (reduce_register, split_clusters, combine_counts,
+                                             combine_samples, combine_statevectors)
+from qiskit_qcgpu_provider.sampler import Sampler
+
+from .case import MyTestCase
+
+
+class TestReduction(MyTestCase):
+    """Test the reduction of experiments to the qubits they depend on"""
+
+    def setUp(self):
+        self.instructions = [
+            {'name': 'h', 'qubits': [1]},
+            {'name': 'h', 'qubits': [4]},
+            {'name': 'cx', 'qubits': [1, 3]},
+            {'name': 'barrier', 'qubits': [0, 1, 2, 3, 4]},
+            {'name': 'x', 'qubits': [4]},
+            {'name': 'measure', 'qubits': [3], 'memory': [0]},
+            {'name': 'measure', 'qubits': [1], 'memory': [1]},
+        ]
+
+    def test_idle_qubits(self):
+        reduction = reduce_register(self.instructions, 5)
+        self.assertEqual(reduction.qubit_map, {1: 0, 3: 1, 4: 2})
+        reduced = reduction.apply(self.instructions)
+        self.assertEqual([instruction['name'] for instruction in reduced],
+                         ['h', 'h', 'cx', 'x', 'measure', 'measure'])
+        self.assertEqual(reduced[2]['qubits'], [0, 1])
+        self.assertEqual(reduced[4]['memory'], [0])
+        self.assertEqual(reduction.info(), {'qubits_before': 5, 'qubits_after': 3,
+                                            'instructions_dropped': 1})
+
+    def test_light_cone(self):
+        reduction = reduce_register(self.instructions, 5, light_cone=True)
+        self.assertEqual(reduction.num_qubits, 2)
+        reduced = reduction.apply(self.instructions)
+        self.assertEqual([(instruction['name'], instruction['qubits']) for instruction in reduced],
+                         [('h', [0]), ('cx', [0, 1]), ('measure', [1]), ('measure', [0])])
+
+    def test_apply_to_other_parameters(self):
+        reduction = reduce_register([{'name': 'u1', 'qubits': [2], 'params': [0.1]},
+                                     {'name': 'measure', 'qubits': [2], 'memory': [0]}], 3)
+        reduced = reduction.apply([{'name': 'u1', 'qubits': [2], 'params': [0.7]},
+                                   {'name': 'measure', 'qubits': [2], 'memory': [0]}])
+        self.assertEqual(reduced[0], {'name': 'u1', 'qubits': [0], 'params': [0.7]})
+
+    def test_no_gates(self):
+        reduction = reduce_register([{'name': 'barrier', 'qubits': [0, 1]}], 2)
+        self.assertEqual(reduction.num_qubits, 1)
+        self.assertEqual(reduction.apply([{'name': 'barrier', 'qubits': [0, 1]}]), [])
+
+    def test_split_clusters(self):
+        clusters = split_clusters(self.instructions, 5)
+        self.assertEqual([cluster.qubit_map for cluster in clusters],
+                         [{0: 0}, {1: 0, 3: 1}, {2: 0}, {4: 0}])
+        self.assertEqual([cluster.kept for cluster in clusters], [[], [0, 2, 5, 6], [], [1, 4]])
+
+    def test_combine_samples(self):
+        clusters = split_clusters(self.instructions, 5)[1:4:2]
+        # Qubits 1 and 3, and qubit 4, are measured
+        samples = combine_samples(clusters, [np.array([0, 1, 2, 3]), np.array([1, 0, 1, 0])],
+                                  [1, 3, 4])
+        self.assertEqual(samples.tolist(), [4, 1, 6, 3])
+
+    def test_combine_counts(self):
+        clusters = split_clusters(self.instructions, 5)[1:4:2]
+        # Qubits 1 and 3 are 01 or 11, and qubit 4 is 1
+        samplers = [Sampler(np.array([0, 0.5, 0, 0.5])), Sampler(np.array([0, 1]))]
+        shots = 4000
+        outcomes, counts = combine_counts(clusters, samplers, [1, 3, 4], shots,
+                                          np.random.default_rng(7))
+        self.assertEqual(sorted(outcomes.tolist()), [5, 7])
+        self.assertEqual(counts.sum(), shots)
+        for count in counts:
+            self.assertAlmostEqual(count / shots, 0.5, delta=0.05)
+
+    def test_combine_statevectors(self):
+        clusters = split_clusters(self.instructions, 5)
+        statevectors = [np.array([1, 0]), np.array([0, 0, 0.6, 0.8]), np.array([0, 1]),
+                        np.array([0.6, -0.8])]
+        statevector = combine_statevectors(clusters, statevectors, 5)
+        # Qubit 2 is 1, and qubit 3, or qubits 1 and 3, are 1
+        expected = np.zeros(32)
+        expected[0b01100] = 0.36
+        expected[0b01110] = 0.48
+        expected[0b11100] = -0.48
+        expected[0b11110] = -0.64
+        np.testing.assert_allclose(statevector, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider.sampler import Sampler, alias_table, choose_method
+
+from .case import MyTestCase
+
+
+class TestSampler(MyTestCase):
+    """Test the outcome sampler"""
+
+    def setUp(self):
+        self.probabilities = np.array([0.1, 0, 0.5, 0.4, 0])
+
+    def test_methods_follow_distribution(self):
+        for method in ['cdf', 'alias']:
+            sampler = Sampler(3 * self.probabilities, method)
+            samples = sampler.sample(np.random.default_rng(7), 100000)
+            frequencies = np.bincount(samples, minlength=5) / len(samples)
+            np.testing.assert_allclose(frequencies, self.probabilities, atol=0.01)
+
+    def test_seeded_samples_repeat(self):
+        sampler = Sampler(self.probabilities, 'alias')
+        first = sampler.sample(np.random.default_rng(11), 50)
+        second = sampler.sample(np.random.default_rng(11), 50)
+        self.assertEqual(first.tolist(), second.tolist())
+
+    def test_alias_table(self):
+        keep, alias = alias_table(np.array([0.5, 0.25, 0.25]))
+        # Every outcome is drawn with probability keep / n, plus the aliases
+        drawn = keep / 3
+        for outcome, target in enumerate(alias):
+            drawn[target] += (1 - keep[outcome]) / 3
+        np.testing.assert_allclose(drawn, [0.5, 0.25, 0.25])
+
+    def test_choose_method(self):
+        self.assertEqual(choose_method(4, 1024), 'alias')
+        self.assertEqual(choose_method(2 ** 20, 1024), 'cdf')
+
+
+if __name__ == '__main__':
+    unittest.main()
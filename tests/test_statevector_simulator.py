@@ -1,9 +1,14 @@
 import unittest
 import math
+import tempfile
+
+import numpy as np
 
 from qiskit_qcgpu_provider import QCGPUProvider
+from qiskit_qcgpu_provider.storage import StatevectorFile
 from qiskit import execute, QuantumRegister, QuantumCircuit, BasicAer
-from qiskit.quantum_info import state_fidelity
+from qiskit.quantum_info import Pauli, state_fidelity
+from qiskit.compiler import assemble, transpile
 
 from .case import MyTestCase
 
@@ -16,11 +21,150 @@ class TestStatevectorSimulator(MyTestCase):
             circ = self.random_circuit(n, 5)
             self._compare_outcomes(circ)
 
+    def test_parallel_experiments(self):
+        """Test that parallel experiments keep their order and results."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        circs = [self.random_circuit(n, 5) for n in range(2, 8)]
+
+        serial = execute(circs, backend).result()
+        parallel = execute(circs, backend,
+                           backend_options={'max_parallel_experiments': 4}).result()
+
+        for circ in circs:
+            self.assertAlmostEqual(state_fidelity(serial.get_statevector(circ),
+                                                  parallel.get_statevector(circ)), 1, 5)
+
+    def test_fusion(self):
+        """Test that fused circuits give the same amplitudes, including the global phase."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        for n in range(2, 8):
+            circ = transpile(self.random_circuit(n, 10), backend=backend)
+            qobj = assemble(circ, backend=backend)
+            reference = backend.run(qobj).result().get_statevector(circ)
+            fused = backend.run(qobj, backend_options={'fusion_enable': True}).result(
+            ).get_statevector(circ)
+            np.testing.assert_allclose(fused, reference, atol=1e-5)
+            self._compare_outcomes(circ, {'fusion_enable': True})
+
+    def test_numpy_engine(self):
+        """Test the numpy engine against the qiskit simulator."""
+        for n in range(2, 8):
+            circ = self.random_circuit(n, 5)
+            self._compare_outcomes(circ, {'engine': 'numpy'})
+
+    def test_state_pool(self):
+        """Test that pooled states are reset before being reused."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        circ = transpile(self.random_circuit(4, 5), backend=backend)
+
+        first = backend.run(assemble(circ, backend=backend)).result()
+        second = backend.run(assemble(circ, backend=backend)).result()
+
+        self.assertEqual(backend.state_pool_info()['hits'], 1)
+        self.assertAlmostEqual(state_fidelity(first.get_statevector(circ),
+                                              second.get_statevector(circ)), 1, 5)
+
+    def test_numpy_statevector(self):
+        """Test that statevectors can be returned as NumPy arrays."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        circ = transpile(self.random_circuit(5, 5), backend=backend)
+
+        reference = backend.run(assemble(circ, backend=backend)).result()
+        get_statevector = backend._get_statevector
+        returned = []
+
+        def record(*args):
+            returned.append(get_statevector(*args))
+            return returned[-1]
+
+        backend._get_statevector = record
+        for dtype in ['complex64', 'complex128']:
+            result = backend.run(assemble(circ, backend=backend),
+                                 backend_options={'statevector_dtype': dtype}).result()
+            statevector = result.data(circ)['statevector_array']
+
+            # The array of the backend is returned, without a copy
+            self.assertIs(statevector, returned[-1])
+            self.assertIsInstance(statevector, np.ndarray)
+            self.assertEqual(statevector.dtype, np.dtype(dtype))
+            np.testing.assert_allclose(statevector, reference.data(circ)['statevector'],
+                                       atol=1e-6)
+
+    def test_statevector_dir(self):
+        """Test that statevectors can be written to files."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        circ = transpile(self.random_circuit(5, 5), backend=backend)
+
+        reference = backend.run(assemble(circ, backend=backend)).result()
+        with tempfile.TemporaryDirectory() as directory:
+            result = backend.run(assemble(circ, backend=backend),
+                                 backend_options={'statevector_dir': directory}).result()
+            statevector = StatevectorFile.from_dict(result.data(circ)['statevector_file'])
+
+            self.assertTrue(statevector.path.startswith(directory))
+            np.testing.assert_allclose(np.asarray(statevector),
+                                       reference.data(circ)['statevector'], atol=1e-6)
+
+    def test_native_gates(self):
+        """Test the gates run without decomposition against the qiskit simulator."""
+        qr = QuantumRegister(3, 'qr')
+        circ = QuantumCircuit(qr)
+        circ.h(qr)
+        circ.cz(qr[0], qr[2])
+        circ.cu1(0.3, qr[1], qr[0])
+        circ.swap(qr[0], qr[2])
+        circ.ccx(qr[2], qr[0], qr[1])
+        circ.rz(0.4, qr[0])
+        circ.rx(0.5, qr[1])
+        circ.ry(0.6, qr[2])
+        for engine in ['auto', 'numpy']:
+            self._compare_outcomes(circ, {'engine': engine})
+
+    def test_clusters(self):
+        """Test qubits which never interact against the qiskit simulator."""
+        qr = QuantumRegister(5, 'qr')
+        circ = QuantumCircuit(qr)
+        circ.h(qr[0])
+        circ.cx(qr[0], qr[3])
+        circ.ry(0.3, qr[1])
+        circ.cz(qr[1], qr[4])
+        circ.rx(0.7, qr[4])
+        self._compare_outcomes(circ)
+
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        result = backend.run(assemble(transpile(circ, backend=backend), backend=backend),
+                             backend_options={'statevector_clusters': True}).result()
+        clusters = result.data(0)['cluster_statevectors']
+        self.assertEqual([cluster['qubits'] for cluster in clusters], [[0, 3], [1, 4], [2]])
+        np.testing.assert_allclose(clusters[0]['statevector'],
+                                   [1 / math.sqrt(2), 0, 0, 1 / math.sqrt(2)], atol=1e-6)
+        self.assertEqual(result.results[0].metadata['clusters'], [2, 2, 1])
+
+    def test_observables(self):
+        """Test expectation values against the statevector."""
+        backend = QCGPUProvider().get_backend('statevector_simulator')
+        circ = transpile(self.random_circuit(4, 5), backend=backend)
+        observables = [[[0.5, 'ZIZI'], [-1.5, 'IZZZ'], [2, 'IIII']],
+                       [[1, 'XYIZ'], [0.25, 'YYXX']]]
+
+        statevector = np.asarray(
+            backend.run(assemble(circ, backend=backend)).result().get_statevector(circ))
+        for engine in ['auto', 'numpy']:
+            result = backend.run(assemble(circ, backend=backend),
+                                 backend_options={'observables': observables,
+                                                  'engine': engine}).result()
+            values = result.data(circ)['expectation_values']
+            for value, observable in zip(values, observables):
+                operator = sum(coefficient * Pauli.from_label(label).to_matrix()
+                               for coefficient, label in observable)
+                self.assertAlmostEqual(
+                    value, np.vdot(statevector, operator @ statevector).real, 5)
 
-    def _compare_outcomes(self, circ):
+    def _compare_outcomes(self, circ, backend_options=None):
         Provider = QCGPUProvider()
         backend_qcgpu = Provider.get_backend('statevector_simulator')
-        statevector_qcgpu = execute(circ, backend_qcgpu).result().get_statevector()
+        statevector_qcgpu = execute(circ, backend_qcgpu,
+                                    backend_options=backend_options).result().get_statevector()
 
         backend_qiskit = BasicAer.get_backend('statevector_simulator')
         statevector_qiskit = execute(circ, backend_qiskit).result().get_statevector()
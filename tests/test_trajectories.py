@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+from qiskit_qcgpu_provider.compiler import compile_instructions
+from qiskit_qcgpu_provider.engines import ENGINES
+from qiskit_qcgpu_provider.simulatorerror import QCGPUSimulatorError
+from qiskit_qcgpu_provider.trajectories import (get_bfunc, get_condition, run_trajectories,
+                                                split_instructions)
+
+from .case import MyTestCase
+
+
+class LimitedPool:
+    """A state pool which only has room for a few copies."""
+
+    def __init__(self, size):
+        self.size = size
+        self.taken = []
+
+    def acquire(self, engine, num_qubits):
+        if len(self.taken) == self.size:
+            raise OverflowError('cannot allocate {} qubits'.format(num_qubits))
+        state = engine.create_state(num_qubits)
+        self.taken.append(state)
+        return state
+
+    def release(self, engine, state):
+        self.taken.remove(state)
+
+
+class TestTrajectories(MyTestCase):
+    """Test the grouped trajectories of mid-circuit measurements"""
+
+    def setUp(self):
+        self.engine = ENGINES['numpy']
+        hadamards = compile_instructions([{'name': 'h', 'qubits': [0]},
+                                          {'name': 'h', 'qubits': [1]}])
+        self.operations = [('program', hadamards), ('measure', 0, 0), ('measure', 1, 1)]
+
+    def test_registers(self):
+        pool = LimitedPool(4)
+        results = run_trajectories(self.engine, pool, self.engine.create_state(2),
+                                   self.operations, 1000, np.random.default_rng(3),
+                                   lambda state, count, register: (register, count))
+        self.assertEqual(sorted(register for register, _ in results), [0, 1, 2, 3])
+        self.assertEqual(sum(count for _, count in results), 1000)
+        self.assertEqual(pool.taken, [])
+
+    def test_copies_released_when_out_of_memory(self):
+        pool = LimitedPool(1)
+        with self.assertRaises(QCGPUSimulatorError):
+            run_trajectories(self.engine, pool, self.engine.create_state(2),
+                             self.operations, 1000, np.random.default_rng(3),
+                             lambda state, count, register: register)
+        self.assertEqual(pool.taken, [])
+
+    def test_bfunc_conditions(self):
+        """Test a gate conditioned on the register bit set by a bfunc."""
+        instructions = [{'name': 'h', 'qubits': [0]},
+                        {'name': 'measure', 'qubits': [0], 'memory': [0]},
+                        {'name': 'bfunc', 'mask': '0x3', 'relation': '==', 'val': '0x1',
+                         'register': 2},
+                        {'name': 'x', 'qubits': [1], 'conditional': 2},
+                        {'name': 'measure', 'qubits': [1], 'memory': [1]}]
+        operations, final = split_instructions(instructions)
+        self.assertEqual([name for name, _ in operations], ['gates', 'measure', 'bfunc', 'gate'])
+        self.assertEqual(len(final), 1)
+
+        bfunc = operations[2][1]
+        gate = operations[3][1]
+        operations = [('program', compile_instructions(operations[0][1])), ('measure', 0, 0),
+                      ('bfunc',) + get_bfunc(bfunc),
+                      ('if',) + get_condition(gate) + (('program', compile_instructions([gate])),),
+                      ('measure', 1, 1)]
+        results = run_trajectories(self.engine, LimitedPool(4), self.engine.create_state(2),
+                                   operations, 1000, np.random.default_rng(3),
+                                   lambda state, count, register: register)
+        # The x is applied, and bit 2 set, when qubit 0 is measured as 1
+        self.assertEqual(sorted(results), [0, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()